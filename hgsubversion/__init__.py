@@ -51,7 +51,6 @@ from mercurial import discovery
 from mercurial import revset
 from mercurial import subrepo
 
-import svncommands
 import util
 import svnrepo
 import wrappers
@@ -195,6 +194,7 @@ svncommandopts = [
     ('', 'username', '', 'username for authentication'),
     ('', 'password', '', 'password for authentication'),
     ('r', 'rev', [], 'Mercurial revision'),
+    ('', 'checksum', False, 'only compare file checksums (verify)'),
     ('', 'unsafe-skip-uuid-check', False,
      'skip repository uuid check in rebuildmeta'),
 ]
@@ -206,9 +206,7 @@ __all__ = ('cmdtable', 'reposetup', 'uisetup')
 # set up commands and templatekeywords (written this way to maintain backwards
 # compatibility until we drop support for 3.7 for templatekeywords and 4.3 for
 # commands)
-cmdtable = {
-    "svn": (svncommands.svn, svncommandopts, svnusage),
-}
+cmdtable = None
 configtable = {}
 try:
     from mercurial import registrar
@@ -220,6 +218,8 @@ try:
         command = registrar.command(cmdtable)
         @command('svn', svncommandopts, svnusage)
         def svncommand(*args, **kwargs):
+            # only load the subcommands when they are used
+            import svncommands
             return svncommands.svn(*args, **kwargs)
 
     if hgutil.safehasattr(registrar, 'configitem'):
@@ -244,6 +244,13 @@ except (ImportError, AttributeError):
         # deeply nested
         pass
 
+if cmdtable is None:
+    # no command registrar, hg svn help needs the subcommands docstring
+    import svncommands
+    cmdtable = {
+        "svn": (svncommands.svn, svncommandopts, svnusage),
+    }
+
 if not hgutil.safehasattr(configitem, 'dynamicdefault'):
     # hg 4.3 lacks support for dynamicdefault in a way that means we
     # have to not use the config registrar at all.
@@ -257,6 +264,14 @@ configitem('hgsubversion', 'externals', default=configitem.dynamicdefault)
 
 # If true, use diff+patch instead of svn native replay RPC.
 configitem('hgsubversion', 'stupid', default=False)
+# Number of concurrent svn connections used by stupid mode
+configitem('hgsubversion', 'stupidworkers', default=1)
+# If true, push linear stacks without pulling after each commit
+configitem('hgsubversion', 'batchpush', default=False)
+# If true, record where the time of each pull goes
+configitem('hgsubversion', 'profile', default=False)
+# Memory growth, in megabytes, after which svn sessions are reopened
+configitem('hgsubversion', 'recyclesize', default=64)
 
 # Allows configuring extra of svn+$SCHEME tunnel protocols
 configitem('hgsubversion', 'tunnels', default=list)
@@ -319,6 +334,9 @@ configitem('hgsubversion', 'startrev', default=configitem.dynamicdefault)
 configitem('hgsubversion', 'sqlitepragmas', default=list)
 # real default is False
 configitem('hgsubversion', 'failonmissing', default=configitem.dynamicdefault)
+# real default is 'warn'. Can also be 'abort' or 'refetch'.
+configitem('hgsubversion', 'checksummismatch',
+           default=configitem.dynamicdefault)
 # svn:externals support
 configitem('subrepos', 'hgsubversion:allowed', default=False)
 
@@ -326,17 +344,18 @@ def _templatehelper(ctx, kw):
     '''
     Helper function for displaying information about converted changesets.
     '''
-    convertinfo = util.getsvnrev(ctx, '')
+    convertinfo = util.convertinfo(ctx)
 
-    if not convertinfo or not convertinfo.startswith('svn:'):
+    if convertinfo is None:
         return ''
 
+    uuid, path, revnum = convertinfo
     if kw == 'svnuuid':
-        return convertinfo[4:40]
+        return uuid
     elif kw == 'svnpath':
-        return convertinfo[40:].rsplit('@', 1)[0]
+        return path
     elif kw == 'svnrev':
-        return convertinfo[40:].rsplit('@', 1)[-1]
+        return str(revnum)
     else:
         raise hgerror.Abort('unrecognized hgsubversion keyword %s' % kw)
 
@@ -1,4 +1,6 @@
 import errno
+import hashlib
+import mmap
 import sys
 import tempfile
 import shutil
@@ -16,6 +18,80 @@ import svnexternals
 class EditingError(Exception):
     pass
 
+class SpooledBuffer(object):
+    """Write-only buffer backed by a FileStore.
+
+    Data is kept in memory as a list of blocks, like SimpleStringIO,
+    until the store in-memory budget would be exceeded. It is then
+    spilled to a file in the store temporary directory and further
+    writes go straight to disk. Spilled buffers can be adopted by the
+    store with FileStore.setfile() without copying their content.
+    """
+    def __init__(self, store):
+        self._store = store
+        self._blocks = []
+        self._size = 0
+        self._fp = None
+        self._md5 = hashlib.md5()
+        # name of the spill file in the store temporary directory
+        self.name = None
+        # frozen buffers hold a file base text and cannot be written to
+        self.frozen = False
+
+    def __len__(self):
+        return self._size
+
+    def spilled(self):
+        return self.name is not None
+
+    def hexdigest(self):
+        """Return the MD5 hex digest of the data written so far."""
+        return self._md5.hexdigest()
+
+    def write(self, s):
+        if self.frozen:
+            raise EditingError('trying to write a frozen buffer')
+        self._size += len(s)
+        self._md5.update(s)
+        if self._fp is not None:
+            self._fp.write(s)
+            return
+        self._blocks.append(s)
+        if not self._store.fits(self._size):
+            self.name, self._fp = self._store.mktemp()
+            for b in self._blocks:
+                self._fp.write(str(b))
+            self._blocks = []
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def getvalue(self):
+        if not self.spilled():
+            return ''.join(str(s) for s in self._blocks)
+        self.close()
+        return self._store.readtemp(self.name)
+
+    def map(self):
+        """Return a read-only view of the buffer content.
+
+        Spilled buffers are mmap'd so the Subversion delta code can read
+        windows from them without loading the whole text in memory.
+        """
+        if not self.spilled() or not self._size:
+            return self.getvalue()
+        self.close()
+        return self._store.maptemp(self.name)
+
+    def discard(self):
+        self.close()
+        self._blocks = []
+        if self.spilled():
+            self._store.unlinktemp(self.name)
+            self.name = None
+
 class FileStore(object):
     def __init__(self, maxsize=None):
         self._tempdir = None
@@ -25,9 +101,59 @@ class FileStore(object):
         if self._maxsize is None:
             self._maxsize = 100*(2**20)
         self._size = 0
+        # largest amount of data kept in memory at once
+        self.peaksize = 0
         self._data = {}
         self._popped = set()
 
+    def fits(self, size):
+        """Return True if size bytes can still be kept in memory."""
+        return self._maxsize < 0 or (size + self._size) <= self._maxsize
+
+    def mktemp(self):
+        """Create a new file in the store temporary directory.
+
+        Return its name and a file object opened for writing.
+        """
+        if self._tempdir is None:
+            self._tempdir = tempfile.mkdtemp(prefix='hg-subversion-')
+        # Avoid filename issues with these simple names
+        fn = str(self._created)
+        self._created += 1
+        fp = hgutil.posixfile(os.path.join(self._tempdir, fn), 'wb')
+        return fn, fp
+
+    def readtemp(self, fn):
+        fp = hgutil.posixfile(os.path.join(self._tempdir, fn), 'rb')
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def maptemp(self, fn):
+        fp = hgutil.posixfile(os.path.join(self._tempdir, fn), 'rb')
+        try:
+            return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+    def unlinktemp(self, fn):
+        os.unlink(os.path.join(self._tempdir, fn))
+
+    def newbuffer(self):
+        return SpooledBuffer(self)
+
+    def spill(self, data):
+        """Return a frozen SpooledBuffer holding data.
+
+        Large texts end up on disk and the caller can drop its own copy.
+        """
+        buf = SpooledBuffer(self)
+        buf.write(data)
+        buf.close()
+        buf.frozen = True
+        return buf
+
     def setfile(self, fname, data):
         if fname in self._popped:
             raise EditingError('trying to set a popped file %s' % fname)
@@ -37,22 +163,26 @@ class FileStore(object):
             del self._data[fname]
 
         if fname in self._files:
-            del self._files[fname]
+            self.unlinktemp(self._files.pop(fname))
+
+        if isinstance(data, SpooledBuffer):
+            if data.spilled():
+                # Adopt the spilled file, its content is never copied
+                data.close()
+                self._files[fname] = data.name
+                return
+            data = data.getvalue()
 
-        if self._maxsize < 0 or (len(data) + self._size) <= self._maxsize:
+        if self.fits(len(data)):
             self._data[fname] = data
             self._size += len(data)
+            self.peaksize = max(self.peaksize, self._size)
         else:
-            if self._tempdir is None:
-                self._tempdir = tempfile.mkdtemp(prefix='hg-subversion-')
-            # Avoid filename issues with these simple names
-            fn = str(self._created)
-            fp = hgutil.posixfile(os.path.join(self._tempdir, fn), 'wb')
+            fn, fp = self.mktemp()
             try:
                 fp.write(data)
             finally:
                 fp.close()
-            self._created += 1
             self._files[fname] = fn
 
     def delfile(self, fname):
@@ -60,10 +190,10 @@ class FileStore(object):
             raise EditingError('trying to delete a popped file %s' % fname)
 
         if fname in self._data:
+            self._size -= len(self._data[fname])
             del self._data[fname]
         elif fname in self._files:
-            path = os.path.join(self._tempdir, self._files.pop(fname))
-            os.unlink(path)
+            self.unlinktemp(self._files.pop(fname))
 
     def getfile(self, fname):
         if fname in self._popped:
@@ -73,12 +203,7 @@ class FileStore(object):
             return self._data[fname]
         if self._tempdir is None or fname not in self._files:
             raise IOError
-        path = os.path.join(self._tempdir, self._files[fname])
-        fp = hgutil.posixfile(path, 'rb')
-        try:
-            return fp.read()
-        finally:
-            fp.close()
+        return self.readtemp(self._files[fname])
 
     def popfile(self, fname):
         self.delfile(fname)
@@ -179,6 +304,22 @@ class CopiedFile(object):
             data = 'link ' + data
         return data, 'x' in flags, islink, self.copypath
 
+class OpenFile(object):
+    """State of a file opened by the editor, keyed by its baton.
+
+    Whether the file content must be skipped is resolved once when the
+    file is opened, instead of for every text delta window.
+    """
+    __slots__ = ('path', 'data', 'isexec', 'islink', 'copypath', 'skip')
+
+    def __init__(self, path, data, isexec, islink, copypath, skip=False):
+        self.path = path
+        self.data = data
+        self.isexec = isexec
+        self.islink = islink
+        self.copypath = copypath
+        self.skip = skip
+
 class HgEditor(svnwrap.Editor):
 
     def __init__(self, meta):
@@ -195,9 +336,9 @@ class HgEditor(svnwrap.Editor):
         self._filecounter = 0
         # A mapping of svn paths to CopiedFile entries
         self._svncopies = {}
-        # A mapping of batons to (path, data, isexec, islink, copypath) tuples
-        # data is a SimpleStringIO if the file was edited, a string
-        # otherwise.
+        # A mapping of batons to OpenFile entries. Their data is a
+        # SpooledBuffer if the file was edited or if its base
+        # text was too large to be kept in memory, a string otherwise.
         self._openfiles = {}
         # A mapping of file paths to batons
         self._openpaths = {}
@@ -207,6 +348,12 @@ class HgEditor(svnwrap.Editor):
         self._opendirs = {}
         self._missing = set()
 
+    def cachesize(self):
+        """Return the number of entries the editor holds on to."""
+        return (len(self._svncopies) + len(self._openfiles) +
+                len(self._openpaths) + len(self._deleted) +
+                len(self._opendirs) + len(self._missing))
+
     def _openfile(self, path, data, isexec, islink, copypath, create=False):
         if path in self._openpaths:
             raise EditingError('trying to open an already opened file %s'
@@ -215,9 +362,19 @@ class HgEditor(svnwrap.Editor):
             raise EditingError('trying to open a deleted file %s' % path)
         if path in self._deleted:
             self._deleted.remove(path)
+        store = self.current.store
+        if isinstance(data, basestring) and not store.fits(len(data)):
+            # Move large base texts out of memory until they are patched
+            data = store.spill(data)
+        # Resolve the branch and filemap state once, text deltas may
+        # arrive in many windows.
+        branch = self.meta.split_branch_path(path)[1]
+        skip = (not self.meta.is_path_valid(path)
+                or self.meta.skipbranch(branch))
         self._filecounter += 1
         baton = 'f%d-%s' % (self._filecounter, path)
-        self._openfiles[baton] = (path, data, isexec, islink, copypath)
+        self._openfiles[baton] = OpenFile(path, data, isexec, islink, copypath,
+                                          skip)
         self._openpaths[path] = baton
         return baton
 
@@ -403,13 +560,49 @@ class HgEditor(svnwrap.Editor):
         if file_baton not in self._openfiles:
             raise EditingError('trying to close a non-open file %s'
                     % file_baton)
-        path, data, isexec, islink, copypath = self._openfiles.pop(file_baton)
-        del self._openpaths[path]
-        if not isinstance(data, basestring):
-            # Files can be opened, properties changed and apply_text
-            # never called, in which case data is still a string.
-            data = data.getvalue()
-        self.current.set(path, data, isexec, islink, copypath)
+        f = self._openfiles.pop(file_baton)
+        del self._openpaths[f.path]
+        if checksum and not f.skip and not self._checkdata(f, checksum):
+            return
+        # Files can be opened, properties changed and apply_text never
+        # called, in which case data is still the base text. Spooled
+        # buffers are handed over to the file store without being read.
+        self.current.set(f.path, f.data, f.isexec, f.islink, f.copypath)
+
+    def _checkdata(self, f, checksum):
+        """Check the reconstructed content of an open file against the
+        MD5 checksum sent by the server.
+
+        Mismatches are recorded with the svn metadata, then handled
+        according to hgsubversion.checksummismatch. Return False if the
+        file was refetched and recorded already.
+        """
+        if isinstance(f.data, SpooledBuffer):
+            actual = f.data.hexdigest()
+        else:
+            actual = hashlib.md5(f.data).hexdigest()
+        if actual == checksum:
+            return True
+
+        rev = self.current.rev.revnum
+        self.meta.addchecksumerror(rev, f.path, checksum, actual)
+        action = self.ui.config('hgsubversion', 'checksummismatch', 'warn')
+        msg = ('checksum mismatch for %s in r%d: expected %s, got %s'
+               % (f.path, rev, checksum, actual))
+        if action == 'abort':
+            raise hgerror.Abort(msg)
+        elif action == 'refetch':
+            self.ui.warn('%s, refetching\n' % msg)
+            svn = self._svn
+            root = svn.subdir and svn.subdir[1:] or ''
+            data, mode = svn.get_file(f.path[len(root):], rev)
+            if isinstance(f.data, SpooledBuffer):
+                f.data.discard()
+            self.current.set(f.path, data, 'x' in mode, 'l' in mode,
+                             f.copypath)
+            return False
+        self.ui.warn('%s\n' % msg)
+        return True
 
     @svnwrap.ieditor
     def add_directory(self, path, parent_baton, copyfrom_path,
@@ -517,16 +710,11 @@ class HgEditor(svnwrap.Editor):
     def change_file_prop(self, file_baton, name, value, pool=None):
         if file_baton is None:
             return
-        path, data, isexec, islink, copypath = self._openfiles[file_baton]
-        changed = False
+        f = self._openfiles[file_baton]
         if name == 'svn:executable':
-            changed = True
-            isexec = bool(value is not None)
+            f.isexec = bool(value is not None)
         elif name == 'svn:special':
-            changed = True
-            islink = bool(value is not None)
-        if changed:
-            self._openfiles[file_baton] = (path, data, isexec, islink, copypath)
+            f.islink = bool(value is not None)
 
     @svnwrap.ieditor
     def change_dir_prop(self, dir_baton, name, value, pool=None):
@@ -565,29 +753,25 @@ class HgEditor(svnwrap.Editor):
             return lambda x: None
         if file_baton not in self._openfiles:
             raise EditingError('trying to patch a closed file %s' % file_baton)
-        path, base, isexec, islink, copypath = self._openfiles[file_baton]
-        if not isinstance(base, basestring):
-            raise EditingError('trying to edit a file again: %s' % path)
-        if not self.meta.is_path_valid(path):
+        f = self._openfiles[file_baton]
+        base = f.data
+        if isinstance(base, SpooledBuffer) and not base.frozen:
+            raise EditingError('trying to edit a file again: %s' % f.path)
+        if f.skip:
             return lambda x: None
 
-        target = svnwrap.SimpleStringIO(closing=False)
+        source = base
+        if isinstance(base, SpooledBuffer):
+            source = base.map()
+        target = self.current.store.newbuffer()
         self.stream = target
 
-        handler = svnwrap.apply_txdelta(base, target)
+        handler = svnwrap.apply_txdelta(source, target)
         if not callable(handler): # pragma: no cover
             raise hgerror.Abort('Error in Subversion bindings: '
                                'cannot call handler!')
         def txdelt_window(window):
             try:
-                if not self.meta.is_path_valid(path):
-                    return
-
-                # are we skipping this branch entirely?
-                br_path, branch = self.meta.split_branch_path(path)[:2]
-                if self.meta.skipbranch(branch):
-                    return
-
                 try:
                     handler(window)
                 except AssertionError, e: # pragma: no cover
@@ -605,12 +789,16 @@ class HgEditor(svnwrap.Editor):
 
                 # window being None means commit this file
                 if not window:
-                    self._openfiles[file_baton] = (
-                        path, target, isexec, islink, copypath)
+                    target.close()
+                    if isinstance(base, SpooledBuffer):
+                        if not isinstance(source, basestring):
+                            source.close()
+                        base.discard()
+                    f.data = target
             except svnwrap.SubversionException, e: # pragma: no cover
                 self.ui.traceback()
                 if e.args[1] == svnwrap.ERR_INCOMPLETE_DATA:
-                    self.addmissing(path)
+                    self.addmissing(f.path)
                 else: # pragma: no cover
                     raise hgerror.Abort(*e.args)
             except: # pragma: no cover
@@ -621,7 +809,7 @@ class HgEditor(svnwrap.Editor):
     def close(self):
         if self._openfiles:
             for e in self._openfiles.itervalues():
-                self.ui.debug('error: %s was not closed\n' % e[0])
+                self.ui.debug('error: %s was not closed\n' % e.path)
             raise EditingError('%d edited files were not closed'
                     % len(self._openfiles))
 
@@ -650,16 +838,13 @@ class HgEditor(svnwrap.Editor):
             svn = self._svn
             rev = self.current.rev.revnum
             root = svn.subdir and svn.subdir[1:] or ''
-            i = 1
             for f in missing:
                 if self.ui.debugflag:
                     self.ui.debug('fetching %s\n' % f)
                 else:
                     self.ui.note('.')
                 self.ui.flush()
-                if i % 50 == 0:
-                    svn.init_ra_and_client()
-                i += 1
+                self.meta.memwatch.check(svn)
                 data, mode = svn.get_file(f, rev)
                 self.current.set(root + f, data, 'x' in mode, 'l' in mode)
             if not self.ui.debugflag:
@@ -6,6 +6,7 @@ import errno
 import os
 import re
 import sqlite3
+import struct
 import sys
 from mercurial import error
 from mercurial import util as hgutil
@@ -354,6 +355,7 @@ class RevMap(dict):
         self._filepath = revmap_path
         self._lastpulled_file = lastpulled_path
         self._hashes = None
+        self._revs = None
         # disable iteration to have a consistent interface with SqliteRevMap
         # it's less about performance since RevMap needs iteration internally
         self._allowiter = False
@@ -369,6 +371,11 @@ class RevMap(dict):
             self._hashes = dict((v, k) for (k, v) in self._origiteritems())
         return self._hashes
 
+    def cachesize(self):
+        '''Return the number of entries held in memory.'''
+        return (len(self) + len(self._hashes or ()) +
+                len(self._revs or ()))
+
     def branchedits(self, branch, revnum):
         check = lambda x: x[0][1] == branch and x[0][0] < revnum
         return sorted(filter(check, self._origiteritems()), reverse=True)
@@ -388,14 +395,23 @@ class RevMap(dict):
         return bin(lines[-1].split(' ', 2)[1])
 
     def revhashes(self, revnum):
-        for key, value in self._origiteritems():
-            if key[0] == revnum:
-                yield value
+        for branch, ha in self.revbranches(revnum):
+            yield ha
+
+    def revbranches(self, revnum):
+        """Return the sorted (branch, hash) pairs converted from revnum."""
+        if self._revs is None:
+            revs = {}
+            for (num, branch), ha in self._origiteritems():
+                revs.setdefault(num, {})[branch] = ha
+            self._revs = revs
+        return sorted(self._revs.get(revnum, {}).iteritems())
 
     def clear(self):
         self._write()
         dict.clear(self)
         self._hashes = None
+        self._revs = None
 
     def batchset(self, items, lastpulled):
         '''Set items in batches
@@ -468,6 +484,8 @@ class RevMap(dict):
         dict.__setitem__(self, (revnum, branch), ha)
         if self._hashes is not None:
             self._hashes[ha] = (revnum, branch)
+        if self._revs is not None:
+            self._revs.setdefault(revnum, {})[branch] = ha
 
     @classmethod
     def _wrapitermethods(cls):
@@ -519,6 +537,9 @@ class SqliteRevMap(collections.MutableMapping):
     # but "bytes" won't get truncated.
     sqlblobtype = bytes if sys.version_info >= (3, 0) else buffer
 
+    # keys looked up by a single query of ReverseRevMap.prefetch()
+    PREFETCHSIZE = 500
+
     class ReverseRevMap(object):
         # collections.Mapping is not suitable since we don't want 2/3 of
         # its required interfaces: __iter__, __len__.
@@ -540,6 +561,27 @@ class SqliteRevMap(collections.MutableMapping):
         def __contains__(self, key):
             return self.get(key) != None
 
+        def prefetch(self, keys):
+            """Look several keys up with as few queries as possible.
+
+            Each query looks up at most PREFETCHSIZE keys, as SQLite
+            limits the number of variables in a statement to 999 by
+            default.
+            """
+            keys = [k for k in keys if k not in self._cache]
+            for key in keys:
+                self._cache[key] = None
+            size = SqliteRevMap.PREFETCHSIZE
+            for i in xrange(0, len(keys), size):
+                chunk = keys[i:i + size]
+                for row in self.revmap._query(
+                    'SELECT rev, branch, hash FROM revmap WHERE hash IN (%s)'
+                    % ','.join('?' * len(chunk)),
+                    [SqliteRevMap.sqlblobtype(k) for k in chunk]):
+                    key = bytes(row[2])
+                    if self._cache.get(key) is None:
+                        self._cache[key] = (row[0], row[1] or None)
+
         def __getitem__(self, key):
             dummy = self._cache
             item = self.get(key, dummy)
@@ -576,6 +618,10 @@ class SqliteRevMap(collections.MutableMapping):
     def hashes(self):
         return self.ReverseRevMap(self, self._hashescache)
 
+    def cachesize(self):
+        '''Return the number of entries held in memory.'''
+        return len(self._hashescache)
+
     def branchedits(self, branch, revnum):
         return [((r[0], r[1] or None), bytes(r[2])) for r in
                 self._query('SELECT rev, branch, hash FROM revmap ' +
@@ -602,6 +648,12 @@ class SqliteRevMap(collections.MutableMapping):
                                (revnum,)):
             yield bytes(row[0])
 
+    def revbranches(self, revnum):
+        """Return the sorted (branch, hash) pairs converted from revnum."""
+        return [(r[0] or None, bytes(r[1])) for r in
+                self._query('SELECT branch, hash FROM revmap ' +
+                            'WHERE rev = ? ORDER BY branch', (revnum,))]
+
     def clear(self):
         hgutil.unlinkpath(self._filepath, ignoremissing=True)
         hgutil.unlinkpath(self._dbpath, ignoremissing=True)
@@ -786,6 +838,137 @@ class SqliteRevMap(collections.MutableMapping):
                 f.write('%s %s %s\n' % (rev, hex(ha), br))
 
 
+class ConvertInfoCache(object):
+    '''Persistent cache of the Subversion origin of each changeset.
+
+    Entries are indexed by changelog revision and hold a (uuid, path,
+    revnum) tuple, or None for changesets that were not converted from
+    Subversion. Each record keeps a prefix of the changeset node, so
+    entries made stale by a strip are detected and recomputed.
+
+    The file starts with a header and the list of distinct uuid and path
+    pairs, followed by one fixed-size record per revision.
+    '''
+
+    VERSION = 1
+
+    _header = struct.Struct('>4sII')
+    _name = struct.Struct('>I')
+    _record = struct.Struct('>4sIi')
+    _magic = 'HSCI'
+
+    # revnum values with a special meaning
+    _unknown = -2
+    _notsvn = -1
+
+    def __init__(self, path):
+        self._path = path
+        self._names = []
+        self._nameidx = {}
+        self._records = bytearray()
+        self.dirty = False
+        self._load()
+
+    def __len__(self):
+        return len(self._records) // self._record.size
+
+    def known(self, rev, node):
+        return self._find(rev, node) is not None
+
+    def get(self, rev, node):
+        '''Return the origin of rev, or raise KeyError if it isn't cached.'''
+        record = self._find(rev, node)
+        if record is None:
+            raise KeyError(rev)
+        nameidx, revnum = record
+        if revnum == self._notsvn:
+            return None
+        uuid, path = self._names[nameidx]
+        return uuid, path, revnum
+
+    def set(self, rev, node, info):
+        if info is None:
+            nameidx, revnum = 0, self._notsvn
+        else:
+            uuid, path, revnum = info
+            nameidx = self._nameidx.get((uuid, path))
+            if nameidx is None:
+                nameidx = len(self._names)
+                self._names.append((uuid, path))
+                self._nameidx[(uuid, path)] = nameidx
+        size = self._record.size
+        if rev >= len(self):
+            blank = self._record.pack('\0' * 4, 0, self._unknown)
+            self._records.extend(blank * (rev + 1 - len(self)))
+        self._record.pack_into(self._records, rev * size,
+                               node[:4], nameidx, revnum)
+        self.dirty = True
+
+    def truncate(self, length):
+        '''Forget about revisions from length onwards.'''
+        if length < len(self):
+            del self._records[length * self._record.size:]
+            self.dirty = True
+
+    def write(self):
+        dirname = os.path.dirname(self._path)
+        if not os.path.isdir(dirname):
+            hgutil.makedirs(dirname)
+        f = hgutil.atomictempfile(self._path, 'wb')
+        try:
+            f.write(self._header.pack(self._magic, self.VERSION,
+                                      len(self._names)))
+            for uuid, path in self._names:
+                name = uuid + path
+                f.write(self._name.pack(len(name)))
+                f.write(name)
+            f.write(self._records)
+            f.close()
+        finally:
+            f.discard()
+        self.dirty = False
+
+    def _find(self, rev, node):
+        if rev >= len(self):
+            return None
+        prefix, nameidx, revnum = self._record.unpack_from(
+            self._records, rev * self._record.size)
+        if revnum == self._unknown or prefix != node[:4]:
+            return None
+        return nameidx, revnum
+
+    def _load(self):
+        try:
+            with open(self._path, 'rb') as f:
+                data = f.read()
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+        try:
+            magic, version, count = self._header.unpack_from(data)
+            if magic != self._magic or version != self.VERSION:
+                return
+            offset = self._header.size
+            names = []
+            for i in xrange(count):
+                length, = self._name.unpack_from(data, offset)
+                offset += self._name.size
+                name = data[offset:offset + length]
+                if len(name) != length:
+                    return
+                offset += length
+                names.append((name[:36], name[36:]))
+        except struct.error:
+            # a damaged cache is simply rebuilt
+            return
+        records = data[offset:]
+        records = records[:len(records) - len(records) % self._record.size]
+        self._names = names
+        self._nameidx = dict((n, i) for i, n in enumerate(names))
+        self._records = bytearray(records)
+
+
 class FileMap(object):
 
     VERSION = 1
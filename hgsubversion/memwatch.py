@@ -0,0 +1,131 @@
+'''Memory accounting of a pull, and recycling of Subversion sessions.
+
+The Subversion bindings, the SWIG ones in particular, leak memory in
+their sessions. Instead of reopening sessions blindly, the pull loop
+samples the resident set size of the process after every revision and
+the sessions are only reopened once it has grown by more than
+hgsubversion.recyclesize megabytes since they were last opened.
+
+Where the resident size cannot be measured, sessions are reopened after
+every revision and every RECYCLEFILES missing files fetched, as they
+used to be.
+'''
+
+import csv
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# sessions are reopened every so many fetches when memory is not measured
+RECYCLEFILES = 50
+
+try:
+    _PAGESIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGESIZE = None
+
+def rss():
+    '''Return the resident set size of the process in bytes, or None.'''
+    if _PAGESIZE is not None:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * _PAGESIZE
+        except (IOError, ValueError, IndexError):
+            pass
+    if resource is not None:
+        # the peak size, which grows with the current one; it is
+        # reported in kilobytes, but in bytes on Mac OS X
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if peak:
+            if sys.platform == 'darwin':
+                return peak
+            return peak * 1024
+    return None
+
+class NullWatch(object):
+    '''Watch that never recycles sessions.'''
+
+    def check(self, svn):
+        pass
+
+    def endrev(self, revnum, svn):
+        pass
+
+class MemoryWatch(object):
+    '''Sample memory after each revision and recycle sessions on growth.
+
+    threshold is the growth, in bytes, above which sessions are reopened:
+    0 reopens them after every revision, a negative value never does.
+    When record is true, every sample is kept for write().
+    '''
+
+    def __init__(self, ui, meta, threshold, record=False):
+        self.ui = ui
+        self.meta = meta
+        self.threshold = threshold
+        self.record = record
+        self.samples = []
+        self.recycled = 0
+        self._fetches = 0
+        self.baseline = self.peak = rss()
+
+    def check(self, svn):
+        '''Called between fetches made while converting a revision.'''
+        if self.baseline is None:
+            self._fetches += 1
+            if self.threshold >= 0 and self._fetches % RECYCLEFILES == 0:
+                self.recycle(svn)
+            return
+        if self.threshold > 0 and rss() - self.baseline > self.threshold:
+            self.recycle(svn)
+
+    def endrev(self, revnum, svn):
+        '''Account for revnum and recycle sessions if needed.'''
+        current = rss()
+        if current is not None:
+            self.peak = max(self.peak, current)
+            # memory released by the revision counts against later growth
+            self.baseline = min(self.baseline, current)
+        recycle = self.threshold == 0 or (
+            self.threshold > 0 and (current is None or
+                                    current - self.baseline > self.threshold))
+        if self.record:
+            sizes = self.meta.cachesizes()
+            self.samples.append((revnum, current, sizes['store'],
+                                 sizes['editor'], sizes['revmap'],
+                                 int(bool(recycle))))
+        if recycle:
+            if current is not None and self.threshold > 0:
+                self.ui.debug('memory grew by %d MB, reopening sessions '
+                              'after r%d\n'
+                              % ((current - self.baseline) // 2**20, revnum))
+            self.recycle(svn)
+
+    def recycle(self, svn):
+        '''Reopen the session of svn and drop the fetch workers' ones.'''
+        import stupid
+        svn.init_ra_and_client()
+        stupid.recyclepool(svn)
+        self.recycled += 1
+        self._fetches = 0
+        current = rss()
+        if current is not None:
+            self.baseline = current
+
+    def write(self, ui, metapath):
+        '''Write memory.csv and summarize the memory usage of the pull.'''
+        path = os.path.join(metapath, 'memory.csv')
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['revnum', 'rss', 'store', 'editor', 'revmap',
+                             'recycled'])
+            for sample in self.samples:
+                writer.writerow(['' if v is None else v for v in sample])
+        if self.peak is not None:
+            ui.status('peak memory %d MB, ' % (self.peak // 2**20))
+        ui.status('sessions reopened %d times\n' % self.recycled)
+        ui.status('memory samples written to %s\n' % path)
@@ -0,0 +1,192 @@
+'''Accounting of where the time goes during a pull.
+
+Enabled by the hgsubversion.profile option. The pull loop and the
+conversion code wrap their expensive steps in named phases, like this:
+
+  with meta.profiler.phase('commitctx'):
+      ...
+
+When profiling is disabled, meta.profiler is a NullProfile, and entering
+a phase costs no more than a method call.
+
+Phases nest. Each phase is charged only for its own time, without the
+phases nested in it, so no time is counted twice.
+'''
+
+import csv
+import json
+import os
+import time
+
+# time.clock() is process time on Unix but wall-clock time on Windows
+if os.name == 'nt':
+    def _cputime():
+        t = os.times()
+        return t[0] + t[1]
+else:
+    _cputime = time.clock
+
+# number of revisions listed at the end of a profiled pull
+TOPREVISIONS = 10
+
+class _nullphase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+_NULLPHASE = _nullphase()
+
+class NullProfile(object):
+    '''Profile that records nothing.'''
+
+    enabled = False
+
+    def phase(self, name):
+        return _NULLPHASE
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def startrev(self, revnum):
+        pass
+
+    def endrev(self):
+        pass
+
+class _phase(object):
+    __slots__ = ['profile', 'name', 'wall', 'cpu', 'childwall', 'childcpu']
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.childwall = self.childcpu = 0.0
+        self.profile._stack.append(self)
+        self.wall = time.time()
+        self.cpu = _cputime()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.time() - self.wall
+        cpu = _cputime() - self.cpu
+        stack = self.profile._stack
+        stack.pop()
+        if stack:
+            stack[-1].childwall += wall
+            stack[-1].childcpu += cpu
+        self.profile._add(self.name, wall - self.childwall,
+                          cpu - self.childcpu)
+        return False
+
+class PullProfile(object):
+    '''Wall-clock time, CPU time and calls per phase and per revision.'''
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = {}
+        self.revisions = []
+        self._stack = []
+        self._rev = None
+        self._pending = {}
+        self._wall = time.time()
+        self._cpu = _cputime()
+
+    def phase(self, name):
+        return _phase(self, name)
+
+    def iterate(self, name, iterable):
+        '''Charge the time spent producing each item to phase name.
+
+        The time is counted towards the revision started next, so that
+        fetching the log entry of a revision is part of its cost.
+        '''
+        it = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = it.next()
+                except StopIteration:
+                    return
+            yield item
+
+    def startrev(self, revnum):
+        phases, self._pending = self._pending, {}
+        wall = sum(p[0] for p in phases.itervalues())
+        cpu = sum(p[1] for p in phases.itervalues())
+        self._rev = (revnum, time.time() - wall, _cputime() - cpu, phases)
+
+    def endrev(self):
+        if self._rev is None:
+            return
+        revnum, wall, cpu, phases = self._rev
+        self._rev = None
+        self.revisions.append((revnum, time.time() - wall,
+                               _cputime() - cpu, phases))
+
+    def _add(self, name, wall, cpu):
+        if self._rev is not None:
+            current = self._rev[3]
+        else:
+            current = self._pending
+        for phases in (self.phases, current):
+            entry = phases.get(name)
+            if entry is None:
+                phases[name] = entry = [0.0, 0.0, 0]
+            entry[0] += wall
+            entry[1] += cpu
+            entry[2] += 1
+
+    def report(self):
+        '''Return the totals as a dictionary suitable for JSON.'''
+        wall = time.time() - self._wall
+        cpu = _cputime() - self._cpu
+        phases = dict((name, {'wall': w, 'cpu': c, 'calls': n})
+                      for name, (w, c, n) in self.phases.iteritems())
+        return {
+            'version': 1,
+            'wall': wall,
+            'cpu': cpu,
+            'revisions': len(self.revisions),
+            'phases': phases,
+            'unaccounted': {
+                'wall': wall - sum(p[0] for p in self.phases.itervalues()),
+                'cpu': cpu - sum(p[1] for p in self.phases.itervalues()),
+            },
+        }
+
+    def write(self, ui, metapath):
+        '''Write profile.json and profile.csv and summarize the pull.'''
+        jsonpath = os.path.join(metapath, 'profile.json')
+        with open(jsonpath, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+        names = sorted(self.phases)
+        csvpath = os.path.join(metapath, 'profile.csv')
+        with open(csvpath, 'wb') as f:
+            writer = csv.writer(f)
+            header = ['revnum', 'wall', 'cpu']
+            for name in names:
+                header.extend([name + '_wall', name + '_cpu',
+                               name + '_calls'])
+            writer.writerow(header)
+            for revnum, wall, cpu, phases in self.revisions:
+                row = [revnum, '%.6f' % wall, '%.6f' % cpu]
+                for name in names:
+                    w, c, n = phases.get(name, (0.0, 0.0, 0))
+                    row.extend(['%.6f' % w, '%.6f' % c, n])
+                writer.writerow(row)
+
+        slowest = sorted(self.revisions, key=lambda r: r[1], reverse=True)
+        if slowest:
+            ui.status('slowest revisions:\n')
+        for revnum, wall, cpu, phases in slowest[:TOPREVISIONS]:
+            top = sorted(phases.iteritems(), key=lambda p: p[1][0],
+                         reverse=True)[:3]
+            ui.status('  r%d: %.3fs wall, %.3fs cpu (%s)\n' % (
+                revnum, wall, cpu,
+                ', '.join('%s %.3fs' % (name, p[0]) for name, p in top)))
+        ui.status('profile written to %s and %s\n' % (jsonpath, csvpath))
@@ -11,15 +11,53 @@ class NoFilesException(Exception):
     """
 
 
-def _isdir(svn, branchpath, svndir):
-    try:
-        path = ''
-        if branchpath:
-            path = branchpath + '/'
-        svn.list_dir('%s%s' % (path, svndir))
-        return True
-    except svnwrap.SubversionException:
-        return False
+class _DirCache(object):
+    """Tell which directories exist at HEAD below branchpath.
+
+    Directories are looked up in the listing of their parent, which is
+    requested once and cached with the kind of each entry, so checking
+    many directories costs one request per parent directory instead of
+    one per directory. Parents already known to be missing, or to be
+    files, are not requested at all, so checking shallower directories
+    first saves requests.
+
+    A cache only serves the commit of one changeset: the listings stop
+    describing HEAD once that commit adds or deletes directories, so
+    each pushed changeset starts with an empty cache.
+    """
+    def __init__(self, svn, branchpath):
+        self._svn = svn
+        self._branchpath = branchpath
+        self._listings = {}
+
+    def _list(self, svndir):
+        if svndir not in self._listings:
+            entries = None
+            parent, name = self._split(svndir)
+            if (parent is None or parent not in self._listings
+                or self.isdir(svndir)):
+                try:
+                    path = '/'.join(p for p in (self._branchpath, svndir) if p)
+                    entries = self._svn.list_kinds(path)
+                except svnwrap.SubversionException:
+                    pass
+            self._listings[svndir] = entries
+        return self._listings[svndir]
+
+    def _split(self, svndir):
+        if not svndir:
+            return None, None
+        pos = svndir.rfind('/')
+        if pos == -1:
+            return '', svndir
+        return svndir[:pos], svndir[pos + 1:]
+
+    def isdir(self, svndir):
+        parent, name = self._split(svndir)
+        if parent is None:
+            return self._list(svndir) is not None
+        entries = self._list(parent)
+        return entries is not None and entries.get(name) == 'd'
 
 
 def _getdirchanges(svn, branchpath, parentctx, ctx, changedfiles, extchanges):
@@ -79,22 +117,69 @@ def _getdirchanges(svn, branchpath, parentctx, ctx, changedfiles, extchanges):
     newdirs = getctxdirs(ctx, changeddirs,
                          [e[0] for e in extchanges if e[2]])
 
-    for d in newdirs:
-        if d not in olddirs and not _isdir(svn, branchpath, d):
+    dircache = _DirCache(svn, branchpath)
+    for d in sorted(newdirs):
+        if d not in olddirs and not dircache.isdir(d):
             added.append(d)
 
-    for d in olddirs:
+    for d in sorted(olddirs):
         if not d:
             # Do not remove the root directory when the hg repo becomes
             # empty. hgsubversion cannot create branches, do not remove
             # them.
             continue
-        if d not in newdirs and _isdir(svn, branchpath, d):
+        if d not in newdirs and dircache.isdir(d):
             deleted.append(d)
 
     return added, deleted
 
 
+def _nodata():
+    return ''
+
+
+class _lazydata(object):
+    """Callable reading fctx data, so only the file being sent to the
+    server is kept in memory.
+
+    peek() reads the data before it is sent; the call sending it then
+    returns it without reading it again and releases it.
+    """
+    def __init__(self, fctx, prefix=''):
+        self._fctx = fctx
+        self._prefix = prefix
+        self._data = None
+
+    def peek(self):
+        if self._data is None:
+            self._data = self._prefix + self._fctx.data()
+        return self._data
+
+    def __call__(self):
+        data = self.peek()
+        self._data = None
+        return data
+
+
+def _lazynewdata(fctx, base_data, fileprops):
+    """Return a function reading fctx data, which sets svn:mime-type in
+    fileprops from the data it reads.
+
+    The commit drivers read the new text of a file before sending its
+    properties, so binary files are detected without reading them ahead.
+    base_data, if not None, is peeked to unset the property of files
+    that are no longer binary.
+    """
+    def read():
+        data = fctx.data()
+        if compathacks.binary(data):
+            fileprops.setdefault('svn:mime-type', 'application/octet-stream')
+        elif base_data is not None and compathacks.binary(base_data.peek()):
+            fileprops['svn:mime-type'] = None
+        return data
+    return read
+
+
 def commit(ui, repo, rev_ctx, meta, base_revision, svn):
     """Build and send a commit from Mercurial to Subversion.
     """
@@ -114,19 +199,16 @@ def commit(ui, repo, rev_ctx, meta, base_revision, svn):
     for file in rev_ctx.files():
         if file in util.ignoredfiles:
             continue
-        new_data = base_data = ''
+        new_data = base_data = _nodata
         action = ''
         if file in rev_ctx:
             fctx = rev_ctx.filectx(file)
-            new_data = fctx.data()
+            fileprops = props.setdefault(file, {})
 
             if 'x' in fctx.flags():
-                props.setdefault(file, {})['svn:executable'] = '*'
+                fileprops['svn:executable'] = '*'
             if 'l' in fctx.flags():
-                props.setdefault(file, {})['svn:special'] = '*'
-            isbinary = compathacks.binary(new_data)
-            if isbinary:
-                props.setdefault(file, {})['svn:mime-type'] = 'application/octet-stream'
+                fileprops['svn:special'] = '*'
 
             if file not in parent:
                 renamed = fctx.renamed()
@@ -134,26 +216,28 @@ def commit(ui, repo, rev_ctx, meta, base_revision, svn):
                     # TODO current model (and perhaps svn model) does not support
                     # this kind of renames: a -> b, b -> c
                     copies[file] = renamed[0]
-                    base_data = parent[renamed[0]].data()
-                    if 'l' in parent[renamed[0]].flags():
-                        base_data = 'link ' + base_data
+                    basectx = parent[renamed[0]]
+                    base_data = _lazydata(basectx)
+                    if 'l' in basectx.flags():
+                        base_data = _lazydata(basectx, 'link ')
                 else:
                     autoprops = svn.autoprops_config.properties(file)
                     if autoprops:
-                        props.setdefault(file, {}).update(autoprops)
+                        fileprops.update(autoprops)
 
+                new_data = _lazynewdata(fctx, None, fileprops)
                 action = 'add'
             else:
-                base_data = parent.filectx(file).data()
-                if ('x' in parent.filectx(file).flags()
+                basectx = parent.filectx(file)
+                base_data = _lazydata(basectx)
+                if ('x' in basectx.flags()
                     and 'x' not in rev_ctx.filectx(file).flags()):
-                    props.setdefault(file, {})['svn:executable'] = None
-                if 'l' in parent.filectx(file).flags():
-                    base_data = 'link ' + base_data
+                    fileprops['svn:executable'] = None
+                if 'l' in basectx.flags():
+                    base_data = _lazydata(basectx, 'link ')
                     if 'l' not in rev_ctx.filectx(file).flags():
-                        props.setdefault(file, {})['svn:special'] = None
-                if compathacks.binary(base_data) and not isbinary:
-                    props.setdefault(file, {})['svn:mime-type'] = None
+                        fileprops['svn:special'] = None
+                new_data = _lazynewdata(fctx, base_data, fileprops)
                 action = 'modify'
         else:
             pos = file.rfind('/')
@@ -161,6 +245,11 @@ def commit(ui, repo, rev_ctx, meta, base_revision, svn):
                 if file[:pos] in deleteddirs:
                     # This file will be removed when its directory is removed
                     continue
+            if file in addeddirs:
+                # The file is replaced by a directory, which is added once
+                # the entry is deleted
+                deleteddirs.add(file)
+                continue
             action = 'delete'
         file_data[file] = base_data, new_data, action
 
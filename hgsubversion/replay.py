@@ -65,14 +65,16 @@ def _convert_rev(ui, meta, svn, r, tbdelta, firstrun):
     editor.current.rev = r
     editor.setsvn(svn)
 
-    if firstrun and meta.revmap.firstpulled <= 0:
-        # We know nothing about this project, so fetch everything before
-        # trying to apply deltas.
-        ui.debug('replay: fetching full revision\n')
-        svn.get_revision(r.revnum, editor)
-    else:
-        svn.get_replay(r.revnum, editor, meta.revmap.firstpulled)
-    editor.close()
+    with meta.profiler.phase('replay'):
+        if firstrun and meta.revmap.firstpulled <= 0:
+            # We know nothing about this project, so fetch everything
+            # before trying to apply deltas.
+            ui.debug('replay: fetching full revision\n')
+            svn.get_revision(r.revnum, editor)
+        else:
+            svn.get_replay(r.revnum, editor, meta.revmap.firstpulled)
+    with meta.profiler.phase('editorclose'):
+        editor.close()
 
     current = editor.current
 
@@ -184,21 +186,25 @@ def _convert_rev(ui, meta, svn, r, tbdelta, firstrun):
         meta.mapbranch(extra)
         if 'branch' not in extra:
             extra['branch'] = 'default'
-        current_ctx = context.memctx(meta.repo,
-                                     parents,
-                                     util.forceutf8(meta.getmessage(rev)),
-                                     [util.forceutf8(f) for f in files.keys()],
-                                     filectxfn,
-                                     util.forceutf8(meta.authors[rev.author]),
-                                     date,
-                                     extra)
-
-        new_hash = meta.repo.svn_commitctx(current_ctx)
+        with meta.profiler.phase('memctx'):
+            current_ctx = context.memctx(
+                meta.repo,
+                parents,
+                util.forceutf8(meta.getmessage(rev)),
+                [util.forceutf8(f) for f in files.keys()],
+                filectxfn,
+                util.forceutf8(meta.authors[rev.author]),
+                date,
+                extra)
+
+        with meta.profiler.phase('commitctx'):
+            new_hash = meta.repo.svn_commitctx(current_ctx)
         util.describe_commit(ui, new_hash, branch)
         if (rev.revnum, branch) not in meta.revmap and not tag:
             meta.revmap[rev.revnum, branch] = new_hash
         if tag:
-            meta.movetag(tag, new_hash, rev, date)
+            with meta.profiler.phase('tags'):
+                meta.movetag(tag, new_hash, rev, date)
             meta.addedtags.pop(tag, None)
 
     # 2. handle branches that need to be committed without any files
@@ -223,15 +229,18 @@ def _convert_rev(ui, meta, svn, r, tbdelta, firstrun):
         extra = meta.genextra(rev.revnum, branch)
         meta.mapbranch(extra)
 
-        current_ctx = context.memctx(meta.repo,
-                                     (ha, node.nullid),
-                                     util.forceutf8(meta.getmessage(rev)),
-                                     [util.forceutf8(f) for f in files],
-                                     del_all_files,
-                                     util.forceutf8(meta.authors[rev.author]),
-                                     date,
-                                     extra)
-        new_hash = meta.repo.svn_commitctx(current_ctx)
+        with meta.profiler.phase('memctx'):
+            current_ctx = context.memctx(
+                meta.repo,
+                (ha, node.nullid),
+                util.forceutf8(meta.getmessage(rev)),
+                [util.forceutf8(f) for f in files],
+                del_all_files,
+                util.forceutf8(meta.authors[rev.author]),
+                date,
+                extra)
+        with meta.profiler.phase('commitctx'):
+            new_hash = meta.repo.svn_commitctx(current_ctx)
         util.describe_commit(ui, new_hash, branch)
         if (rev.revnum, branch) not in meta.revmap:
             meta.revmap[rev.revnum, branch] = new_hash
@@ -1,6 +1,11 @@
+import Queue
+import bisect
 import cStringIO
 import errno
 import re
+import sys
+import threading
+import weakref
 
 from mercurial import context
 from mercurial import error as hgerror
@@ -120,6 +125,131 @@ def parsediff(diff):
 class BadPatchApply(Exception):
     pass
 
+class FetchPool(object):
+    """Run read-only Subversion requests over concurrent connections.
+
+    Every worker thread uses its own connection, cloned from the main
+    one on first use and kept for later requests. With a single worker,
+    requests are run in the calling thread over the main connection.
+    """
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self._sessions = []
+
+    def run(self, svn, fn, items):
+        """Call fn(session, item) for every item and return a dict mapping
+        items to (result, exc_info) pairs, to be unpacked with
+        fetchresult().
+        """
+        items = list(items)
+        results = {}
+        workers = min(self.workers, len(items))
+        if workers <= 1:
+            for item in items:
+                results[item] = _callfetch(fn, svn, item)
+            return results
+
+        # clone connections from the main thread, they may prompt
+        while len(self._sessions) < workers:
+            self._sessions.append(svn.clone())
+        queue = Queue.Queue()
+        for item in items:
+            queue.put(item)
+
+        def work(session):
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                results[item] = _callfetch(fn, session, item)
+
+        threads = [threading.Thread(target=work, args=(session,))
+                   for session in self._sessions[:workers]]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def recycle(self):
+        """Drop the worker connections, new ones are cloned on demand."""
+        self._sessions = []
+
+def _callfetch(fn, svn, item):
+    try:
+        return fn(svn, item), None
+    except Exception:
+        return None, sys.exc_info()
+
+def fetchresult(entry):
+    """Return the result of a FetchPool request or re-raise its error."""
+    result, exc_info = entry
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return result
+
+_pools = weakref.WeakKeyDictionary()
+
+def getpool(ui, svn):
+    """Return the FetchPool associated with svn connection."""
+    pool = _pools.get(svn)
+    if pool is None:
+        workers = ui.configint('hgsubversion', 'stupidworkers', 1)
+        pool = _pools[svn] = FetchPool(workers)
+    return pool
+
+def recyclepool(svn):
+    """Drop the worker connections of the FetchPool of svn, if any."""
+    pool = _pools.get(svn)
+    if pool is not None:
+        pool.recycle()
+
+class FileFetcher(object):
+    """Retrieve file contents at a given revision.
+
+    Files announced with want() are retrieved concurrently, by batches
+    following the paths order, when the first of them is requested.
+    Batches are bounded to keep memory usage low. Other files are
+    fetched on demand.
+    """
+    batchsize = 8
+
+    def __init__(self, svn, revnum, pool=None):
+        self.svn = svn
+        self.revnum = revnum
+        self.pool = pool
+        self._wanted = set()
+        self._queue = None
+        self._fetched = {}
+
+    def want(self, path):
+        if self.pool is None or self.pool.workers <= 1:
+            return
+        self._wanted.add(path)
+        self._queue = None
+
+    def get_file(self, path):
+        if path in self._wanted:
+            self._prefetch(path)
+        if path in self._fetched:
+            return fetchresult(self._fetched.pop(path))
+        return self.svn.get_file(path, self.revnum)
+
+    def _prefetch(self, path):
+        if self._queue is None:
+            self._queue = sorted(self._wanted)
+        start = bisect.bisect_left(self._queue, path)
+        end = start + self.batchsize * self.pool.workers
+        batch = self._queue[start:end]
+        del self._queue[start:end]
+        self._wanted.difference_update(batch)
+        revnum = self.revnum
+        def getfile(svn, path):
+            return svn.get_file(path, revnum)
+        self._fetched.update(self.pool.run(self.svn, getfile, batch))
+
 def print_your_svn_is_old_message(ui): # pragma: no cover
     ui.status("In light of that, I'll fall back and do diffs, but it won't do "
               "as good a job. You should really upgrade your server.\n")
@@ -218,18 +348,78 @@ def patchrepo(ui, meta, parentctx, patchfp):
     finally:
         store.close()
 
-def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx):
-    """Extract all 'branch' content at a given revision.
+class PathCache(object):
+    """Kinds of entries at a given revision.
 
-    Return a tuple (files, filectxfn) where 'files' is the list of all files
-    in the branch at the given revision, and 'filectxfn' is a memctx compatible
-    callable to retrieve individual file information. Raise BadPatchApply upon
-    error.
+    Provides the checkpath() and list_files() methods of svn for a
+    single revision. Recursive directory listings are cached and used
+    to answer later requests on anything they contain, so classifying
+    the content of a copied tree costs a single request. Requests at
+    other revisions are forwarded to svn.
+    """
+    def __init__(self, svn, revnum):
+        self.svn = svn
+        self.revnum = revnum
+        self._kinds = {}
+        # directory path -> recursive list of (path, kind) entries
+        self._listed = {}
+
+    def _listedparent(self, path):
+        while path:
+            path = path.rpartition('/')[0]
+            if path in self._listed:
+                return path
+        return None
+
+    def list_files(self, dirpath, revision):
+        if revision != self.revnum:
+            return self.svn.list_files(dirpath, revision)
+        entries = self._listed.get(dirpath)
+        if entries is None:
+            parent = self._listedparent(dirpath)
+            if parent is not None:
+                if self.checkpath(dirpath, revision) != 'd':
+                    raise IOError(errno.ENOENT, '%s cannot be found at r%d'
+                                  % (dirpath, revision))
+                prefix = dirpath[len(parent):].lstrip('/') + '/'
+                entries = [(p[len(prefix):], k)
+                           for p, k in self._listed[parent]
+                           if p.startswith(prefix)]
+            else:
+                entries = list(self.svn.list_files(dirpath, revision))
+            self._listed[dirpath] = entries
+            self._kinds[dirpath] = 'd'
+            prefix = (dirpath and dirpath + '/') or ''
+            for p, k in entries:
+                self._kinds[prefix + p] = k
+        return iter(entries)
+
+    def checkpath(self, path, revision):
+        if revision != self.revnum:
+            return self.svn.checkpath(path, revision)
+        if path not in self._kinds:
+            if self._listedparent(path) is not None:
+                # not part of a listed directory, it does not exist
+                self._kinds[path] = None
+            else:
+                self._kinds[path] = self.svn.checkpath(path, revision)
+        return self._kinds[path]
+
+def branchsource(meta, parentctx):
+    """Return the (revnum, branch, branchpath) source of parentctx, or
+    None values if it was not converted from Subversion.
     """
     try:
-        prev, pbranch, ppath = meta.get_source_rev(ctx=parentctx)
+        return meta.get_source_rev(ctx=parentctx)
     except KeyError:
-        prev, pbranch, ppath = None, None, None
+        return None, None, None
+
+def branchdiff(svn, branch, branchpath, r, source):
+    """Return the unified diff of 'branch' at a given revision against its
+    source, as returned by branchsource(). Raise BadPatchApply if it
+    cannot be used to patch the source.
+    """
+    prev, pbranch, ppath = source
     try:
         if prev is None or pbranch == branch:
             # letting patch handle binaries sounded
@@ -250,6 +440,26 @@ def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx):
         raise BadPatchApply('previous revision does not exist')
     if '\0' in d:
         raise BadPatchApply('binary diffs are not supported')
+    return d
+
+def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx,
+                   d=None, fetcher=None, pathcache=None):
+    """Extract all 'branch' content at a given revision.
+
+    Return a tuple (files, filectxfn) where 'files' is the list of all files
+    in the branch at the given revision, and 'filectxfn' is a memctx compatible
+    callable to retrieve individual file information. Raise BadPatchApply upon
+    error. 'd' is the branch diff if already retrieved with branchdiff(),
+    'fetcher' an optional FileFetcher used to retrieve file contents and
+    'pathcache' an optional PathCache used to check entry kinds.
+    """
+    if d is None:
+        d = branchdiff(svn, branch, branchpath, r,
+                       branchsource(meta, parentctx))
+    if fetcher is None:
+        fetcher = FileFetcher(svn, r.revnum)
+    if pathcache is None:
+        pathcache = PathCache(svn, r.revnum)
     files_data = {}
     changed = parsediff(d)
     # Here we ensure that all files, including the new empty ones
@@ -300,7 +510,7 @@ def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx):
             continue
         # We can be smarter here by checking if f is a subcomponent
         # of a know path in parentctx or touched_files. KISS for now.
-        kind = svn.checkpath(branchprefix + f, r.revnum)
+        kind = pathcache.checkpath(branchprefix + f, r.revnum)
         if kind == 'd':
             touched_files.discard(f)
 
@@ -316,6 +526,10 @@ def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx):
                       if f.executable is not None)
     link_files = dict((f.name, f.symlink) for f in changed
                       if f.symlink is not None)
+    for f in touched_files:
+        if f in binary_files or f in unknown_files:
+            fetcher.want(branchprefix + f)
+
     def filectxfn(repo, memctx, path):
         if path in files_data and files_data[path] is None:
             return compathacks.filectxfn_deleted(memctx, path)
@@ -325,7 +539,7 @@ def diff_branchrev(ui, svn, meta, branch, branchpath, r, parentctx):
             if branchpath:
                 pa = branchpath + '/' + path
             try:
-                data, mode = svn.get_file(pa, r.revnum)
+                data, mode = fetcher.get_file(pa)
             except IOError:
                 return compathacks.filectxfn_deleted_reraise(memctx)
             isexe = 'x' in mode
@@ -489,17 +703,24 @@ def fetch_externals(ui, svn, branchpath, r, parentctx):
     return externals
 
 
-def fetch_branchrev(svn, meta, branch, branchpath, r, parentctx):
+def fetch_branchrev(svn, meta, branch, branchpath, r, parentctx,
+                    fetcher=None, pathcache=None):
     """Extract all 'branch' content at a given revision.
 
     Return a tuple (files, filectxfn) where 'files' is the list of all files
     in the branch at the given revision, and 'filectxfn' is a memctx compatible
-    callable to retrieve individual file information.
+    callable to retrieve individual file information. 'fetcher' is an optional
+    FileFetcher used to retrieve file contents and 'pathcache' an optional
+    PathCache used to check entry kinds.
     """
+    if fetcher is None:
+        fetcher = FileFetcher(svn, r.revnum)
+    if pathcache is None:
+        pathcache = PathCache(svn, r.revnum)
     files = []
     if parentctx.node() == revlog.nullid:
         # Initial revision, fetch all files
-        for path, kind in svn.list_files(branchpath, r.revnum):
+        for path, kind in pathcache.list_files(branchpath, r.revnum):
             if kind == 'f':
                 files.append(path)
     else:
@@ -514,7 +735,7 @@ def fetch_branchrev(svn, meta, branch, branchpath, r, parentctx):
                 continue
             if not meta.is_path_valid(path):
                 continue
-            kind = svn.checkpath(path, r.revnum)
+            kind = pathcache.checkpath(path, r.revnum)
             path = path[len(branchprefix):]
             if kind == 'f':
                 files.append(path)
@@ -522,7 +743,7 @@ def fetch_branchrev(svn, meta, branch, branchpath, r, parentctx):
                 if e.action == 'M':
                     continue
                 dirpath = branchprefix + path
-                for child, k in svn.list_files(dirpath, r.revnum):
+                for child, k in pathcache.list_files(dirpath, r.revnum):
                     if k == 'f':
                         if path:
                             childpath = '%s/%s' % (path, child)
@@ -543,13 +764,16 @@ def fetch_branchrev(svn, meta, branch, branchpath, r, parentctx):
                 files += deleted
 
     copies = getcopies(svn, meta, branch, branchpath, r, files, parentctx)
+    branchprefix = (branchpath and branchpath + '/') or ''
+    for f in files:
+        fetcher.want(branchprefix + f)
 
     def filectxfn(repo, memctx, path):
         svnpath = path
         if branchpath:
             svnpath = branchpath + '/' + path
         try:
-            data, mode = svn.get_file(svnpath, r.revnum)
+            data, mode = fetcher.get_file(svnpath)
         except IOError:
             return compathacks.filectxfn_deleted_reraise(memctx)
         isexec = 'x' in mode
@@ -609,17 +833,19 @@ def branches_in_paths(meta, tbdelta, paths, revnum, checkpath, listdir,
         return branches
 
     actually_files = []
-    while paths_need_discovery:
-        p = paths_need_discovery.pop(0)
+    # Parent directories are visited first, so when checkpath and listdir
+    # are backed by a PathCache the content of a copied tree is classified
+    # with a single listing.
+    for p in sorted(paths_need_discovery):
         if checkpath(p, revnum) == 'f':
             actually_files.append(p)
         # if there's a copyfrom_path and there were files inside that copyfrom,
-        # we need to detect those branches. It's a little thorny and slow, but
-        # seems to be the best option.
+        # we need to detect those branches. The listing is recursive and
+        # tells which entries are files.
         elif paths[p].copyfrom_path and not meta.get_path_tag(p):
-            paths_need_discovery.extend(['%s/%s' % (p, x[0])
-                                         for x in listdir(p, revnum)
-                                         if x[1] == 'f'])
+            actually_files.extend(['%s/%s' % (p, x[0])
+                                   for x in listdir(p, revnum)
+                                   if x[1] == 'f'])
 
     for path in actually_files:
         if meta.get_path_tag(path):
@@ -631,6 +857,16 @@ def branches_in_paths(meta, tbdelta, paths, revnum, checkpath, listdir,
 
     return branches
 
+def isincremental(meta, parentctx, firstrun):
+    # The nullrev check might not be necessary in theory but svn <
+    # 1.7 failed to diff branch creation so the diff_branchrev()
+    # path does not support this case with svn >= 1.7. We can fix
+    # it, or we can force the existing fetch_branchrev() path. Do
+    # the latter for now.
+    return (meta.revmap.firstpulled > 0 and
+            parentctx.rev() != node.nullrev and
+            not firstrun)
+
 def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
     if svnwrap.subversion_version >= (1, 9, 0):
         raise hgerror.Abort(
@@ -642,8 +878,10 @@ def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
     if meta.filemap:
         raise hgerror.Abort('filemaps currently unsupported with stupid replay.')
 
+    pathcache = PathCache(svn, r.revnum)
     branches = branches_in_paths(meta, tbdelta, r.paths, r.revnum,
-                                 svn.checkpath, svn.list_files, firstrun)
+                                 pathcache.checkpath, pathcache.list_files,
+                                 firstrun)
     bad_branch_paths = {}
     for br, bp in branches.iteritems():
         bad_branch_paths[br] = []
@@ -689,14 +927,32 @@ def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
 
     date = meta.fixdate(r.date)
     check_deleted_branches = set(tbdelta['branches'][1])
-    for b in branches:
-
-        if meta.skipbranch(b):
-            continue
 
-        parentctx = meta.repo[meta.get_parent_revision(r.revnum, b)]
+    # Retrieve branch kinds and diffs for all branches at once, file
+    # contents are fetched by batches while committing.
+    pool = getpool(ui, svn)
+    fetcher = FileFetcher(svn, r.revnum, pool)
+    active = [b for b in branches if not meta.skipbranch(b)]
+    parentctxs = dict((b, meta.repo[meta.get_parent_revision(r.revnum, b)])
+                      for b in active)
+    def checkbranchpath(svn, b):
+        return svn.checkpath(branches[b], r.revnum)
+    with meta.profiler.phase('fetch'):
+        kinds = pool.run(svn, checkbranchpath, active)
+    sources = {}
+    for b in active:
+        if (kinds[b][1] is None and kinds[b][0] == 'd'
+            and isincremental(meta, parentctxs[b], firstrun)):
+            sources[b] = branchsource(meta, parentctxs[b])
+    def getbranchdiff(svn, b):
+        return branchdiff(svn, b, branches[b], r, sources[b])
+    with meta.profiler.phase('fetch'):
+        diffs = pool.run(svn, getbranchdiff, sources)
+
+    for b in active:
+        parentctx = parentctxs[b]
         tag = meta.get_path_tag(meta.remotename(b))
-        kind = svn.checkpath(branches[b], r.revnum)
+        kind = fetchresult(kinds[b])
         if kind != 'd':
             if not tag:
                 # Branch does not exist at this revision. Get parent
@@ -704,26 +960,23 @@ def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
                 deleted_branches[b] = parentctx.node()
             continue
 
-        # The nullrev check might not be necessary in theory but svn <
-        # 1.7 failed to diff branch creation so the diff_branchrev()
-        # path does not support this case with svn >= 1.7. We can fix
-        # it, or we can force the existing fetch_branchrev() path. Do
-        # the latter for now.
-        incremental = (meta.revmap.firstpulled > 0 and
-                       parentctx.rev() != node.nullrev and
-                       not firstrun)
+        incremental = b in diffs
 
         if incremental:
             try:
-                files_touched, filectxfn2 = diff_branchrev(
-                    ui, svn, meta, b, branches[b], r, parentctx)
+                with meta.profiler.phase('fetch'):
+                    files_touched, filectxfn2 = diff_branchrev(
+                        ui, svn, meta, b, branches[b], r, parentctx,
+                        fetchresult(diffs[b]), fetcher, pathcache)
             except BadPatchApply, e:
                 # Either this revision or the previous one does not exist.
                 ui.note("Fetching entire revision: %s.\n" % e.args[0])
                 incremental = False
         if not incremental:
-            files_touched, filectxfn2 = fetch_branchrev(
-                svn, meta, b, branches[b], r, parentctx)
+            with meta.profiler.phase('fetch'):
+                files_touched, filectxfn2 = fetch_branchrev(
+                    svn, meta, b, branches[b], r, parentctx, fetcher,
+                    pathcache)
 
         externals = {}
         if meta.layout != 'single':
@@ -782,16 +1035,18 @@ def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
 
         origbranch = extra.get('branch', None)
         meta.mapbranch(extra)
-        current_ctx = context.memctx(
-            meta.repo,
-            [parentctx.node(), revlog.nullid],
-            util.forceutf8(meta.getmessage(r)),
-            [util.forceutf8(f) for f in files_touched],
-            filectxfn,
-            util.forceutf8(meta.authors[r.author]),
-            date,
-            extra)
-        ha = meta.repo.svn_commitctx(current_ctx)
+        with meta.profiler.phase('memctx'):
+            current_ctx = context.memctx(
+                meta.repo,
+                [parentctx.node(), revlog.nullid],
+                util.forceutf8(meta.getmessage(r)),
+                [util.forceutf8(f) for f in files_touched],
+                filectxfn,
+                util.forceutf8(meta.authors[r.author]),
+                date,
+                extra)
+        with meta.profiler.phase('commitctx'):
+            ha = meta.repo.svn_commitctx(current_ctx)
 
         if not tag:
             if (not origbranch in meta.branches
@@ -799,7 +1054,8 @@ def convert_rev(ui, meta, svn, r, tbdelta, firstrun):
                 meta.branches[origbranch] = None, 0, r.revnum
             meta.revmap[r.revnum, b] = ha
         else:
-            meta.movetag(tag, ha, r, date)
+            with meta.profiler.phase('tags'):
+                meta.movetag(tag, ha, r, date)
             meta.addedtags.pop(tag, None)
         util.describe_commit(ui, ha, b)
 
@@ -1,13 +1,16 @@
 import os
+import struct
 import sys
 import traceback
 import errno
 
 from mercurial import commands
+from mercurial import encoding
 from mercurial import hg
 from mercurial import node
 from mercurial import util as hgutil
 from mercurial import error
+from mercurial import worker
 
 import compathacks
 import svnwrap
@@ -101,56 +104,75 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
     skipped = set()
     closed = set()
 
-    numrevs = len(repo) - startrev
-
-    # ctx.children() visits all revisions in the repository after ctx. Calling
-    # it would make us use O(revisions^2) time, so we perform an extra traversal
-    # of the repository instead. During this traversal, we find all converted
-    # changesets that close a branch, and store their first parent
-    for ctx in util.get_contexts(repo, startrev):
-        compathacks.progress(ui, 'prepare', ctx.rev() - startrev, total=numrevs)
-
-        convinfo = util.getsvnrev(ctx, None)
-        if not convinfo:
-            continue
-        svnrevnum = int(convinfo.rsplit('@', 1)[1])
-        youngest = max(youngest, svnrevnum)
-
-        if ctx.extra().get('close', None) is None:
-            continue
-
-        droprev = lambda x: x.rsplit('@', 1)[0]
-        parentctx = ctx.parents()[0]
-        parentinfo = util.getsvnrev(parentctx, '@')
+    # Decode the changelog entries we need in a single pass, in parallel
+    # for large repositories. Building full changectx objects is much
+    # slower and used to be done twice. The decoding pass also finds the
+    # youngest converted revision and the converted changesets that close
+    # a branch; ctx.children() visits all revisions in the repository after
+    # ctx, so calling it would make us use O(revisions^2) time.
+    cl = repo.changelog
+    revs = list(cl.revs(startrev))
+    numrevs = len(revs)
+    changesets = {}
+    closing = []
+    if numrevs > _PARALLELREBUILD:
+        decoded = ((rev, data.split('\0')) for rev, data in
+                   worker.worker(ui, 0.0001, _readchangesets, (repo,), revs))
+    else:
+        decoded = ((rev, _changesetfields(cl, rev)) for rev in revs)
+    for i, (rev, fields) in enumerate(decoded):
+        compathacks.progress(ui, 'prepare', i, total=numrevs)
+        cs = changesets[rev] = _changeset(rev, fields)
+        if cs.convinfo:
+            youngest = max(youngest, int(cs.convinfo.rsplit('@', 1)[1]))
+            if cs.close:
+                closing.append(cs)
+    compathacks.progress(ui, 'prepare', None, total=numrevs)
 
-        if droprev(parentinfo) == droprev(convinfo):
-            if parentctx.rev() < startrev:
-                parentbranch = parentctx.branch()
+    def getchangeset(rev):
+        cs = changesets.get(rev)
+        if cs is None:
+            # parents of the rebuilt revisions
+            cs = changesets[rev] = _changeset(rev, _changesetfields(cl, rev))
+        return cs
+
+    # store the first parent of the changesets closing a branch; workers
+    # may return them out of order, so do it once all are decoded
+    droprev = lambda x: x.rsplit('@', 1)[0]
+    for cs in sorted(closing, key=lambda cs: cs.rev):
+        parentcs = getchangeset(cs.p1)
+        parentinfo = parentcs.convinfo or '@'
+
+        if droprev(parentinfo) == droprev(cs.convinfo):
+            if parentcs.rev < startrev:
+                parentbranch = parentcs.branch
                 if parentbranch == 'default':
                     parentbranch = None
                 branchinfo.pop(parentbranch)
             else:
-                closed.add(parentctx.rev())
-
-    compathacks.progress(ui, 'prepare', None, total=numrevs)
+                closed.add(parentcs.rev)
 
     revmapbuf = []
-    for ctx in util.get_contexts(repo, startrev):
-        compathacks.progress(ui, 'rebuild', ctx.rev() - startrev, total=numrevs)
+    for i, rev in enumerate(revs):
+        compathacks.progress(ui, 'rebuild', i, total=numrevs)
 
-        convinfo = util.getsvnrev(ctx, None)
+        cs = changesets[rev]
+        convinfo = cs.convinfo
         if not convinfo:
             continue
-        if '.hgtags' in ctx.files():
-            parent = ctx.parents()[0]
-            parentdata = ''
-            if '.hgtags' in parent:
-                parentdata = parent.filectx('.hgtags').data()
-            newdata = ctx.filectx('.hgtags').data()
-            for newtag in newdata[len(parentdata):-1].split('\n'):
+        if cs.hastags:
+            ctx = repo[rev]
+            newdata = _appendedtags(repo, ctx)
+            if newdata is None:
+                parent = ctx.parents()[0]
+                parentdata = ''
+                if '.hgtags' in parent:
+                    parentdata = parent.filectx('.hgtags').data()
+                newdata = ctx.filectx('.hgtags').data()[len(parentdata):]
+            for newtag in newdata[:-1].split('\n'):
                 ha, tag = newtag.split(' ', 1)
-                tagged = util.getsvnrev(repo[ha], None)
-                if tagged is None:
+                tagged = getchangeset(cl.rev(node.bin(ha))).convinfo
+                if not tagged:
                     tagged = -1
                 else:
                     tagged = int(tagged[40:].split('@')[1])
@@ -180,7 +202,7 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
         # revpath extracted from the commit)
         if meta.layout == 'auto':
             meta.layout = meta.layout_from_commit(subdir, revpath,
-                                                  ctx.branch())
+                                                  cs.branch)
         elif meta.layout == 'single':
             assert (subdir or '/') == revpath, ('Possible layout detection'
                                                 ' defect in replay')
@@ -198,9 +220,10 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
             meta.uuid = uuid
 
         # don't reflect closed branches
-        if (ctx.extra().get('close') and not ctx.files() or
-            ctx.parents()[0].node() in skipped):
-            skipped.add(ctx.node())
+        parentcs = getchangeset(cs.p1)
+        if (cs.close and not cs.hasfiles or
+            parentcs.node in skipped):
+            skipped.add(cs.node)
             continue
 
         # find commitpath, write to revmap
@@ -212,11 +235,11 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
             if commitpath.startswith(location + '/'):
                 found_tag = True
                 break
-        if found_tag and ctx.extra().get('close'):
+        if found_tag and cs.close:
             continue
 
         branch = meta.layoutobj.localname(commitpath)
-        revmapbuf.append((revision, branch, ctx.node()))
+        revmapbuf.append((revision, branch, cs.node))
 
         revision = int(revision)
         if revision > last_rev:
@@ -224,12 +247,12 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
 
         # deal with branches
         if branch and branch.startswith('../'):
-            parent = ctx
-            while parent.node() != node.nullid:
-                parentextra = parent.extra()
-                parentinfo = util.getsvnrev(parent)
+            parent = cs
+            while parent.node != node.nullid:
+                parentinfo = parent.convinfo
                 assert parentinfo
-                parent = parent.parents()[0]
+                parentclose = parent.close
+                parent = getchangeset(parent.p1)
 
                 parentpath = parentinfo[40:].split('@')[0][len(subdir) + 1:]
 
@@ -238,30 +261,29 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
                     if parentpath.startswith(location + '/'):
                         found_tag = True
                         break
-                if found_tag and parentextra.get('close'):
+                if found_tag and parentclose:
                     continue
 
                 branch = meta.layoutobj.localname(parentpath)
                 break
 
-        if ctx.rev() in closed:
+        if rev in closed:
             # a direct child of this changeset closes the branch; drop it
             branchinfo.pop(branch, None)
-        elif ctx.extra().get('close'):
+        elif cs.close:
             pass
         elif branch not in branchinfo:
-            parent = ctx.parents()[0]
-            if (parent.node() not in skipped
-                and util.getsvnrev(parent, '').startswith('svn:')
-                and parent.branch() != ctx.branch()):
-                parentbranch = parent.branch()
+            if (parentcs.node not in skipped
+                and parentcs.convinfo
+                and parentcs.branch != cs.branch):
+                parentbranch = parentcs.branch
                 if parentbranch == 'default':
                     parentbranch = None
             else:
                 parentbranch = None
             # branchinfo is a map from mercurial branch to a
             # (svn branch, svn parent revision, svn revision) tuple
-            parentrev = util.getsvnrev(parent, '@').split('@')[1] or 0
+            parentrev = (parentcs.convinfo or '@').split('@')[1] or 0
             branchinfo[branch] = (parentbranch,
                                   int(parentrev),
                                   revision)
@@ -273,6 +295,79 @@ def _buildmeta(ui, repo, args, partial=False, skipuuid=False):
     util.dump(branchinfo, meta.branch_info_file)
 
 
+# decode changesets in worker processes above this many revisions
+_PARALLELREBUILD = 20000
+
+class _changeset(object):
+    """Conversion data of a changeset, as returned by _changesetfields()."""
+    __slots__ = ('rev', 'node', 'p1', 'convinfo', 'branch', 'close',
+                 'hastags', 'hasfiles')
+
+    def __init__(self, rev, fields):
+        self.rev = rev
+        self.node = node.bin(fields[0])
+        self.p1 = int(fields[1])
+        self.convinfo = fields[2]
+        self.branch = encoding.tolocal(fields[3])
+        self.close = bool(fields[4])
+        self.hastags = bool(fields[5])
+        self.hasfiles = bool(fields[6])
+
+def _changesetfields(cl, rev):
+    """Decode the raw changelog entry of rev into a list of strings."""
+    if rev == node.nullrev:
+        return [node.nullhex, str(node.nullrev), '', 'default', '', '', '']
+    n = cl.node(rev)
+    c = cl.read(n)
+    files, extra = c[3], c[5]
+    convinfo = extra.get('convert_revision', '')
+    if not convinfo.startswith('svn:'):
+        convinfo = ''
+    return [node.hex(n),
+            str(cl.parentrevs(rev)[0]),
+            convinfo,
+            extra.get('branch', 'default'),
+            extra.get('close') and '1' or '',
+            '.hgtags' in files and '1' or '',
+            files and '1' or '']
+
+def _readchangesets(repo, revs):
+    """Decode the raw changelog entries of revs in a worker process.
+
+    Yield (rev, data) pairs, data holding the fields returned by
+    _changesetfields separated by NUL characters.
+    """
+    cl = repo.changelog
+    for rev in revs:
+        yield rev, '\0'.join(_changesetfields(cl, rev))
+
+def _appendedtags(repo, ctx):
+    """Return the text appended to .hgtags by ctx to the .hgtags of its
+    first parent, or None if it does more than appending lines.
+
+    The filelog delta between both revisions is used; when the parent
+    revision is its delta base it is read as stored, without building the
+    full file texts, which grow large with many tags.
+    """
+    if '.hgtags' not in ctx:
+        return None
+    fl = repo.file('.hgtags')
+    filerev = fl.rev(ctx.filenode('.hgtags'))
+    parent = ctx.p1()
+    if '.hgtags' not in parent:
+        return fl.revision(fl.node(filerev))
+    base = fl.rev(parent.filenode('.hgtags'))
+    # recent filelogs wrap a revlog instead of being one
+    delta = getattr(fl, '_revlog', fl).revdiff(base, filerev)
+    if len(delta) < 12:
+        return None
+    start, end, length = struct.unpack('>lll', delta[:12])
+    if len(delta) != 12 + length or start != end:
+        return None
+    if start != fl.size(base):
+        return None
+    return delta[12:]
+
 def help_(ui, args=None, **opts):
     """show help for a given subcommands or a help overview
     """
@@ -298,6 +393,9 @@ def help_(ui, args=None, **opts):
 
 def update(ui, args, repo, clean=False, **opts):
     """update to a specified Subversion revision number
+
+    An optional branch name selects one of several changesets converted
+    from the same revision.
     """
 
     try:
@@ -311,10 +409,10 @@ def update(ui, args, repo, clean=False, **opts):
 
     meta = repo.svnmeta()
 
-    answers = []
-    for k, v in meta.revmap.iteritems():
-        if k[0] == rev:
-            answers.append((v, k[1]))
+    answers = [(ha, branch) for branch, ha in meta.revmap.revbranches(rev)]
+    if len(args) > 1:
+        answers = [(ha, branch) for ha, branch in answers
+                   if args[1] in (branch or 'default', repo[ha].branch())]
 
     if len(answers) == 1:
         if clean:
@@ -410,6 +508,29 @@ Last Changed Date: %(date)s\n''' %
               })
 
 
+def netstats(ui, repo, **opts):
+    """show network statistics of the last pull
+
+    Lists the Subversion remote calls made by the last pull, with their
+    time, the bytes they received and sent, the bytes transferred on the
+    wire when the protocol reports them, and latency percentiles.
+
+    The bytes sent by a commit are the new data of its text deltas. The
+    SWIG bindings compute the deltas themselves, so with them the full
+    new texts are counted instead, an upper bound of what is sent.
+    """
+    if repo is None:
+        raise error.RepoError("There is no Mercurial repository"
+                              " here (.hg not found)")
+
+    ops = util.readnetstats(repo.vfs.join('svn'))
+    if not ops:
+        ui.status('no network statistics recorded\n')
+        return
+    for line in svnwrap.format_netstats(ops):
+        ui.write(line)
+
+
 def listauthors(ui, args, authors=None, **opts):
     """list all authors in a Subversion repository
     """
@@ -489,6 +610,7 @@ table = {
     'genignore': genignore,
     'info': info,
     'listauthors': listauthors,
+    'netstats': netstats,
     'update': update,
     'help': help_,
     'updatemeta': updatemeta,
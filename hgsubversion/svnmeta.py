@@ -1,3 +1,5 @@
+import errno
+import json
 import posixpath
 import os
 
@@ -11,12 +13,37 @@ import compathacks
 import util
 import maps
 import layouts
-import editor
+import memwatch
+import pullprofile
 import svnwrap
 
 
+def metastat(metapath):
+    """Return a signature of the files in metapath, which changes
+    whenever one of them is created, replaced, removed or modified.
+    """
+    try:
+        names = sorted(os.listdir(metapath))
+    except OSError, err:
+        if err.errno != errno.ENOENT:
+            raise
+        return None
+    signature = []
+    for name in names:
+        try:
+            st = os.stat(os.path.join(metapath, name))
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            continue
+        signature.append((name, st.st_ino, st.st_size, st.st_mtime))
+    return signature
+
+
 class SVNMeta(object):
 
+    OPTIONS_VERSION = 1
+
     def __init__(self, repo, uuid=None, subdir=None, skiperrorcheck=False):
         """path is the path to the target hg repo.
 
@@ -41,6 +68,13 @@ class SVNMeta(object):
         self._tagmap = None
         self._filemap = None
         self._layout = None
+        self._options = None
+        self._branches = None
+        self._prevbranches = None
+        # replaced by a PullProfile while pulling with hgsubversion.profile
+        self.profiler = pullprofile.NullProfile()
+        # replaced by a MemoryWatch while pulling
+        self.memwatch = memwatch.NullWatch()
 
         # create .hg/svn folder if it doesn't exist
         if not os.path.isdir(self.metapath):
@@ -60,9 +94,47 @@ class SVNMeta(object):
         self._gen_cachedconfig('branch', '')
         self._gen_cachedconfig('layout', 'auto')
 
-        # misc
-        self.branches = util.load(self.branch_info_file) or {}
-        self.prevbranches = dict(self.branches)
+    @property
+    def options_file(self):
+        return os.path.join(self.metapath, 'options')
+
+    def _loadoptions(self):
+        """Read the cached config values, keyed by their legacy file name.
+
+        Values are scrubbed and descrubbed like util.dump() and util.load()
+        do for the legacy files.
+        """
+        try:
+            f = open(self.options_file)
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return {}
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        if data.get('version') > self.OPTIONS_VERSION:
+            raise hgerror.Abort('svn metadata options too new -- '
+                                'please upgrade')
+        options = util._convert(data.get('options', {}), lambda x: x)
+        return dict((k, util._convert(v, util._descrub))
+                    for k, v in options.iteritems())
+
+    def _saveoption(self, filename, value):
+        # Read the file again so values saved by another SVNMeta since we
+        # loaded ours are not lost.
+        options = self._loadoptions()
+        options[filename] = value
+        f = hgutil.atomictempfile(self.options_file, 'w+b', 0644)
+        json.dump({'version': self.OPTIONS_VERSION,
+                   'options': dict((k, util._convert(v, util._scrub))
+                                   for k, v in options.iteritems())}, f)
+        f.close()
+        self._options = self._loadoptions()
+        # the value has been migrated out of its legacy file
+        hgutil.unlinkpath(os.path.join(self.metapath, filename),
+                          ignoremissing=True)
 
     def _get_cachedconfig(self, name, filename, configname, default, pre):
         """Return a cached value for a config option. If the cache is uninitialized
@@ -76,9 +148,8 @@ class SVNMeta(object):
         """
         varname = '_' + name
         if getattr(self, varname) is None:
-            # construct the file path from metapath (e.g. .hg/svn) plus the
-            # filename
-            f = os.path.join(self.metapath, filename)
+            if self._options is None:
+                self._options = self._loadoptions()
 
             # load the config property (i.e. command-line or .hgrc)
             c = None
@@ -98,8 +169,13 @@ class SVNMeta(object):
                 else:
                     c = self.ui.config('hgsubversion', configname, default)
 
-            # load the value from disk
-            val = util.load(f, default=default)
+            # load the value from disk, falling back on the file used to
+            # store it before options were consolidated
+            if filename in self._options:
+                val = self._options[filename]
+            else:
+                f = os.path.join(self.metapath, filename)
+                val = util.load(f, default=default, resave=False)
 
             # prefer the non-default, and the one sent from command-line
             if c is not None and c != val and c != default:
@@ -119,9 +195,14 @@ class SVNMeta(object):
 
     def _set_cachedconfig(self, value, name, filename):
         varname = '_' + name
-        f = os.path.join(self.metapath, filename)
         setattr(self, varname, value)
-        util.dump(value, f)
+        if self._options is None:
+            self._options = self._loadoptions()
+        # compare with the value as it would be read back
+        stored = util._convert(util._convert(value, util._scrub),
+                               util._descrub)
+        if filename not in self._options or self._options[filename] != stored:
+            self._saveoption(filename, value)
 
     def _gen_cachedconfig(self, name, default=None, filename=None,
                           configname=None, pre=None):
@@ -131,6 +212,8 @@ class SVNMeta(object):
         The actual value from the config file will be read lazily, and then
         cached once that read has occurred. No cache invalidation will happen,
         so within a session these values shouldn't be required to mutate.
+        All values are stored together in the options file, which is only
+        written when one of them changes.
         """
         setattr(SVNMeta, '_' + name, None)
         if filename is None:
@@ -220,9 +303,28 @@ class SVNMeta(object):
     @property
     def editor(self):
         if not hgutil.safehasattr(self, '_editor'):
+            # the editor derives from the bindings editor class, only
+            # load them when converting
+            import editor
             self._editor = editor.HgEditor(self)
         return self._editor
 
+    def cachesizes(self):
+        '''Return the sizes of the caches held while converting.
+
+        store is the peak in-memory size, in bytes, of the files of the
+        last converted revision; editor and revmap are numbers of
+        cached entries.
+        '''
+        store = editor = 0
+        if hgutil.safehasattr(self, '_editor'):
+            store = self._editor.current.store.peaksize
+            editor = self._editor.cachesize()
+        revmap = 0
+        if self._revmap is not None:
+            revmap = self._revmap.cachesize()
+        return {'store': store, 'editor': editor, 'revmap': revmap}
+
     def _get_subdir(self):
         return self.__subdir
 
@@ -285,6 +387,40 @@ class SVNMeta(object):
     def branch_info_file(self):
         return os.path.join(self.metapath, 'branch_info')
 
+    def _loadbranches(self):
+        if self._branches is None:
+            self._branches = util.load(self.branch_info_file) or {}
+            self._prevbranches = dict(self._branches)
+
+    @property
+    def branches(self):
+        self._loadbranches()
+        return self._branches
+
+    def _get_prevbranches(self):
+        self._loadbranches()
+        return self._prevbranches
+
+    def _set_prevbranches(self, prevbranches):
+        self._loadbranches()
+        self._prevbranches = prevbranches
+
+    prevbranches = property(_get_prevbranches, _set_prevbranches)
+
+    @property
+    def checksumerrors_file(self):
+        return os.path.join(self.metapath, 'checksum_errors')
+
+    def addchecksumerror(self, revnum, path, expected, actual):
+        """Record that the content of path converted from revision revnum
+        does not match the checksum sent by the server.
+        """
+        fp = open(self.checksumerrors_file, 'a')
+        try:
+            fp.write('%d %s %s %s\n' % (revnum, expected, actual, path))
+        finally:
+            fp.close()
+
     @property
     def authormap_file(self):
         return os.path.join(self.metapath, 'authors')
@@ -343,10 +479,38 @@ class SVNMeta(object):
     def revmap_file(self):
         return os.path.join(self.metapath, 'rev_map')
 
+    @property
+    def lastpulled_file(self):
+        return os.path.join(self.metapath, 'lastpulled')
+
+    @property
+    def lastpulled(self):
+        """The last pulled revision, read without loading the revmap."""
+        if self._revmap is not None:
+            return self._revmap.lastpulled
+        try:
+            f = open(self.lastpulled_file)
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            return int(f.read())
+        finally:
+            f.close()
+
+    @lastpulled.setter
+    def lastpulled(self, value):
+        if self._revmap is not None:
+            self._revmap.lastpulled = value
+        else:
+            with open(self.lastpulled_file, 'w') as f:
+                f.write(str(value))
+
     @property
     def revmap(self):
         if self._revmap is None:
-            lastpulled_path = os.path.join(self.metapath, 'lastpulled')
+            lastpulled_path = self.lastpulled_file
             opts = {}
             if self.revmapclass is maps.SqliteRevMap:
                 # sqlite revmap takes an optional option: sqlitepragmas
@@ -388,7 +552,8 @@ class SVNMeta(object):
         '''Save the Subversion metadata. This should really be called after
         every revision is created.
         '''
-        util.dump(self.branches, self.branch_info_file)
+        if self._branches is not None:
+            util.dump(self._branches, self.branch_info_file)
 
     def localname(self, path):
         """Compute the local name for a branch located at path.
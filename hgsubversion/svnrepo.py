@@ -105,7 +105,30 @@ def generate_repo_class(ui, repo):
             return wrappers.findoutgoing(self, remote, heads, force)
 
         def svnmeta(self, uuid=None, subdir=None, skiperrorcheck=False):
-            return svnmeta.SVNMeta(self, uuid, subdir, skiperrorcheck)
+            if uuid is not None or subdir is not None:
+                # validating against a remote repository, and possibly
+                # initializing metadata: always start afresh
+                return svnmeta.SVNMeta(self, uuid, subdir, skiperrorcheck)
+
+            # Reuse the last SVNMeta built for this repository view as
+            # long as the files under .hg/svn are unchanged, so revsets
+            # and templates do not reload the revmap every time.
+            cache = self.unfiltered().__dict__.setdefault('_svnmetacache', {})
+            key = (getattr(self, 'filtername', None), skiperrorcheck)
+            stat = svnmeta.metastat(self.vfs.join('svn'))
+            cached = cache.get(key)
+            if (cached is not None and cached[0] == stat
+                and cached[1].ui is self.ui):
+                return cached[1]
+            meta = svnmeta.SVNMeta(self, uuid, subdir, skiperrorcheck)
+            cache[key] = (stat, meta)
+            return meta
+
+        def _writecaches(self):
+            orig = getattr(super(svnlocalrepo, self), '_writecaches', None)
+            if orig is not None:
+                orig()
+            util.writeconvertinfo(self)
 
     repo.__class__ = svnlocalrepo
 
@@ -4,33 +4,63 @@ uses the SWIG Python bindings. That's great, but those leak RAM and have a few
 other quirks. The goal is to have this file automatically contain the "best"
 available implementation without the user having to configure what is actually
 present.
+
+The bindings are only loaded when one of their names is first looked up, so
+importing this package does not load the native Subversion libraries.
+Commands which never talk to Subversion do not pay for them.
 """
 
 from common import *
 
 import os
+import sys
+import types
 
-choice = os.environ.get('HGSUBVERSION_BINDINGS', '').lower()
+def _loadbindings():
+    choice = os.environ.get('HGSUBVERSION_BINDINGS', '').lower()
 
-if choice == 'subvertpy':
-    from subvertpy_wrapper import *
-elif choice == 'swig':
-    from svn_swig_wrapper import *
-elif choice == 'none':
-    # useful for verifying that demandimport works properly
-    raise ImportError('cannot use hgsubversion; '
-                      'bindings disabled using HGSUBVERSION_BINDINGS')
-else:
-    try:
-        from subvertpy_wrapper import *
-    except ImportError, e1:
+    if choice == 'subvertpy':
+        import subvertpy_wrapper as bindings
+    elif choice == 'swig':
+        import svn_swig_wrapper as bindings
+    elif choice == 'none':
+        # useful for verifying that lazy loading works properly
+        raise ImportError('cannot use hgsubversion; '
+                          'bindings disabled using HGSUBVERSION_BINDINGS')
+    else:
         try:
-            from svn_swig_wrapper import *
-        except ImportError, e2:
-            raise ImportError('no compatible bindings available:\n\n'
-                              '%s\n%s\n\n'
-                              'Please install either Subvertpy or the '
-                              'Subversion Python SWIG bindings'
-                              % (e2, e1))
+            import subvertpy_wrapper as bindings
+        except ImportError, e1:
+            try:
+                import svn_swig_wrapper as bindings
+            except ImportError, e2:
+                raise ImportError('no compatible bindings available:\n\n'
+                                  '%s\n%s\n\n'
+                                  'Please install either Subvertpy or the '
+                                  'Subversion Python SWIG bindings'
+                                  % (e2, e1))
+    return bindings
+
+class _lazymodule(types.ModuleType):
+    """Stand-in for this package, importing the bindings into it when a
+    name they define is first looked up, like 'from bindings import *'
+    used to.
+    """
+    def __getattr__(self, name):
+        if name.startswith('__') or self.__dict__.get('_loaded'):
+            raise AttributeError(name)
+        bindings = _loadbindings()
+        for key, value in vars(bindings).iteritems():
+            if not key.startswith('_'):
+                self.__dict__[key] = value
+        self.__dict__['_loaded'] = True
+        return getattr(self, name)
 
-del os, choice
+_module = sys.modules[__name__]
+_lazy = _lazymodule(__name__, __doc__)
+_lazy.__dict__.update((k, v) for k, v in vars(_module).iteritems()
+                      if k != '__doc__')
+# keep a reference to the original module so its globals, which the
+# functions above use, are not cleared
+_lazy._module = _module
+sys.modules[__name__] = _lazy
@@ -1,3 +1,4 @@
+import bisect
 import cStringIO
 import getpass
 import errno
@@ -5,13 +6,18 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
+import time
 import urlparse
 import urllib
 import collections
 import fnmatch
 import ConfigParser
+import struct
 import sys
 
+from mercurial import mdiff
+
 class SubversionRepoCanNotReplay(Exception):
     """Exception raised when the svn server is too old to have replay.
     """
@@ -169,3 +175,226 @@ class SimpleStringIO(object):
     def close(self):
         if self._closing:
             del self._blocks
+
+
+# svn_delta_action values, shared by both bindings
+TXDELTA_SOURCE = 0
+TXDELTA_NEW = 2
+
+# Largest target view of a single delta window, as in svn itself
+DELTA_WINDOW_SIZE = 102400
+
+def _deltaops(base, target):
+    """Yield (offset, length, data) operations rebuilding target from base.
+
+    Copies from base have data set to None, new text has offset set to
+    None. Operations are generated from a Mercurial binary diff so copied
+    ranges are increasing in base.
+    """
+    patch = mdiff.textdiff(base, target)
+    pos = i = 0
+    while i < len(patch):
+        start, end, length = struct.unpack('>lll', patch[i:i + 12])
+        i += 12
+        if start > pos:
+            yield pos, start - pos, None
+        if length:
+            yield None, length, patch[i:i + length]
+        i += length
+        pos = end
+    if pos < len(base):
+        yield pos, len(base) - pos, None
+
+def txdelta_windows(base, target, windowsize=DELTA_WINDOW_SIZE):
+    """Yield text delta windows turning base into target.
+
+    Windows are (sview_offset, sview_len, tview_len, src_ops, ops,
+    new_data) tuples, ops being (action, offset, length) tuples, and
+    describe at most windowsize bytes of target, copied from at most
+    windowsize bytes of base, each. Unchanged ranges are copied from
+    base so only changed text is sent.
+    """
+    sstart = send = tlen = 0
+    ops = []
+    data = []
+    datalen = srcops = 0
+    for offset, length, text in _deltaops(base, target):
+        pos = 0
+        while pos < length:
+            if (tlen == windowsize or offset is not None and srcops
+                and offset + pos - sstart >= windowsize):
+                yield (sstart, send - sstart, tlen, srcops, ops,
+                       ''.join(data))
+                # source views may only move forward
+                sstart = send
+                ops = []
+                data = []
+                tlen = datalen = srcops = 0
+            chunk = min(length - pos, windowsize - tlen)
+            if offset is not None and srcops:
+                # keep the source view within windowsize too
+                chunk = min(chunk, windowsize - (offset + pos - sstart))
+            if offset is None:
+                ops.append((TXDELTA_NEW, datalen, chunk))
+                data.append(text[pos:pos + chunk])
+                datalen += chunk
+            else:
+                if not srcops:
+                    sstart = offset + pos
+                ops.append((TXDELTA_SOURCE, offset + pos - sstart, chunk))
+                send = offset + pos + chunk
+                srcops += 1
+            tlen += chunk
+            pos += chunk
+    if ops:
+        yield sstart, send - sstart, tlen, srcops, ops, ''.join(data)
+
+
+# upper bounds, in seconds, of the latency histogram buckets; the last
+# bucket counts everything slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                   1, 2, 5, 10)
+
+class _NetCall(object):
+    __slots__ = ['stats', 'op', 'start', 'child', 'received', 'sent',
+                 'transferred']
+
+    def __init__(self, stats, op):
+        self.stats = stats
+        self.op = op
+        self.child = 0.0
+        self.received = self.sent = self.transferred = 0
+
+    def __enter__(self):
+        self.stats._calls.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        calls = self.stats._calls
+        calls.pop()
+        if calls:
+            calls[-1].child += elapsed
+        self.stats._add(self.op, 1, elapsed - self.child, self.received,
+                        self.sent, self.transferred)
+        return False
+
+class NetStats(object):
+    """Count the remote calls of a SubversionRepo.
+
+    Calls are grouped by operation, with their number, total time and
+    latency histogram. Each call also records the payload bytes it
+    received and sent as seen by the wrapper. It records as well the
+    bytes transferred on the wire, when the RA layer reports progress;
+    file:// URLs do not.
+
+    A call made while another is in progress, like listing a directory
+    from a replay editor, is not counted in the time of the outer one.
+    Statistics of a cloned connection are added to the parent's, so
+    concurrent fetches are accounted too.
+    """
+    def __init__(self, parent=None):
+        self._parent = parent
+        self._lock = threading.Lock()
+        self._calls = []
+        self.ops = {}
+
+    def call(self, op):
+        """Return a context manager accounting one call of op."""
+        return _NetCall(self, op)
+
+    def progressfunc(self):
+        """Return an RA progress callback for a new session.
+
+        The RA layer reports the total bytes transferred by the session,
+        which are charged to the call being made.
+        """
+        last = [0]
+        def progress(transferred, total, pool=None):
+            if transferred < last[0]:
+                last[0] = 0
+            delta = transferred - last[0]
+            last[0] = transferred
+            if self._calls:
+                self._calls[-1].transferred += delta
+            else:
+                self._add('other', 0, 0, 0, 0, delta)
+        return progress
+
+    def _add(self, op, calls, seconds, received, sent, transferred):
+        with self._lock:
+            entry = self.ops.get(op)
+            if entry is None:
+                entry = self.ops[op] = {
+                    'calls': 0, 'seconds': 0.0, 'received': 0, 'sent': 0,
+                    'transferred': 0,
+                    'histogram': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['received'] += received
+            entry['sent'] += sent
+            entry['transferred'] += transferred
+            if calls:
+                entry['histogram'][bisect.bisect_left(LATENCY_BUCKETS,
+                                                      seconds)] += 1
+        if self._parent is not None:
+            self._parent._add(op, calls, seconds, received, sent,
+                              transferred)
+
+    def snapshot(self, since=None):
+        """Return a copy of the statistics, keyed by operation.
+
+        If since is an earlier snapshot, return only what was counted
+        after it.
+        """
+        with self._lock:
+            ops = dict((op, dict(entry, histogram=list(entry['histogram'])))
+                       for op, entry in self.ops.iteritems())
+        for op, old in (since or {}).iteritems():
+            entry = ops[op]
+            for key in ('calls', 'seconds', 'received', 'sent',
+                        'transferred'):
+                entry[key] -= old[key]
+            entry['histogram'] = [n - o for n, o in zip(entry['histogram'],
+                                                        old['histogram'])]
+            if not (entry['calls'] or entry['transferred']):
+                del ops[op]
+        return ops
+
+def _percentile(histogram, fraction):
+    """Return the bucket upper bound below which fraction of calls fall."""
+    wanted = sum(histogram) * fraction
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if count and seen >= wanted:
+            if i < len(LATENCY_BUCKETS):
+                return '<%gms' % (LATENCY_BUCKETS[i] * 1000)
+            return '>%gms' % (LATENCY_BUCKETS[-1] * 1000)
+    return '-'
+
+def format_netstats(ops):
+    """Return lines describing the statistics from NetStats.snapshot()."""
+    lines = []
+    total = {'calls': 0, 'seconds': 0.0, 'received': 0, 'sent': 0,
+             'transferred': 0}
+    for op, entry in sorted(ops.iteritems()):
+        for key in total:
+            total[key] += entry[key]
+        histogram = entry['histogram']
+        lines.append('%-18s %6d calls %9.3fs  received %10d  sent %10d  '
+                     'transferred %10d  p50 %s p90 %s p99 %s\n'
+                     % (op, entry['calls'], entry['seconds'],
+                        entry['received'], entry['sent'],
+                        entry['transferred'], _percentile(histogram, 0.5),
+                        _percentile(histogram, 0.9),
+                        _percentile(histogram, 0.99)))
+    if lines:
+        lines.append('%-18s %6d calls %9.3fs  received %10d  sent %10d  '
+                     'transferred %10d\n'
+                     % ('total', total['calls'], total['seconds'],
+                        total['received'], total['sent'],
+                        total['transferred']))
+    return lines
@@ -1,5 +1,5 @@
-import cStringIO
 import errno
+import hashlib
 import os
 import shutil
 import sys
@@ -219,18 +219,21 @@ class SubversionRepo(object):
     to ensure that the API is the same as for the SWIG wrapper.
     """
     def __init__(self, url='', username='', password='', head=None,
-                 password_stores=None):
+                 password_stores=None, netstats=None):
         parsed = common.parse_url(url, username, password)
         # --username and --password override URL credentials
         self.username = parsed[0]
         self.password = parsed[1]
         self.svn_url = parsed[2]
+        self.password_stores = password_stores
+        self.netstats = common.NetStats(netstats)
 
         self.init_ra_and_client()
 
-        self.svn_url = self.remote.get_url()
-        self.uuid = self.remote.get_uuid()
-        self.root = self.remote.get_repos_root()
+        with self.netstats.call('session'):
+            self.svn_url = self.remote.get_url()
+            self.uuid = self.remote.get_uuid()
+            self.root = self.remote.get_repos_root()
         assert self.svn_url.startswith(self.root)
 
         # *will* have a leading '/', would not if we used get_repos_root2
@@ -243,6 +246,16 @@ class SubversionRepo(object):
         self.hasdiff3 = True
         self.autoprops_config = common.AutoPropsConfig()
 
+    def clone(self):
+        """Return a new connection to the same repository.
+
+        Sessions cannot be shared between threads, concurrent requests
+        must each use their own connection.
+        """
+        return SubversionRepo(self.svn_url, self.username, self.password,
+                              password_stores=self.password_stores,
+                              netstats=self.netstats)
+
     def init_ra_and_client(self):
         """
         Initializes the RA and client layers.
@@ -300,9 +313,10 @@ class SubversionRepo(object):
             auth.set_parameter(subvertpy.AUTH_PARAM_DEFAULT_PASSWORD, self.password)
 
         try:
-            self.remote = ra.RemoteAccess(url=self.svn_url,
-                                          client_string_func=getclientstring,
-                                          auth=auth)
+            with self.netstats.call('session'):
+                self.remote = ra.RemoteAccess(
+                    url=self.svn_url, client_string_func=getclientstring,
+                    auth=auth, progress_cb=self.netstats.progressfunc())
         except SubversionException, e:
             # e.child contains a detailed error messages
             msglist = []
@@ -319,7 +333,8 @@ class SubversionRepo(object):
 
     @property
     def HEAD(self):
-        return self.remote.get_latest_revnum()
+        with self.netstats.call('get_latest_revnum'):
+            return self.remote.get_latest_revnum()
 
     @property
     def last_changed_rev(self):
@@ -328,10 +343,12 @@ class SubversionRepo(object):
             def callback(paths, revnum, props, haschildren):
                 holder.append(revnum)
 
-            self.remote.get_log(paths=[''],
-                                start=self.HEAD, end=1, limit=1,
-                                discover_changed_paths=False,
-                                callback=callback)
+            head = self.HEAD
+            with self.netstats.call('get_log'):
+                self.remote.get_log(paths=[''],
+                                    start=head, end=1, limit=1,
+                                    discover_changed_paths=False,
+                                    callback=callback)
 
             return holder[-1]
         except SubversionException, e:
@@ -353,10 +370,21 @@ class SubversionRepo(object):
         if path:
             path = path.rstrip('/') + '/'
 
-        r = self.remote.get_dir(path, revision or self.HEAD, ra.DIRENT_ALL)
+        revision = revision or self.HEAD
+        with self.netstats.call('get_dir'):
+            r = self.remote.get_dir(path, revision, ra.DIRENT_ALL)
         dirents, fetched_rev, properties = r
         return dirents
 
+    def list_kinds(self, path, revision=None):
+        """List the contents of a server-side directory like list_dir().
+
+        Return a dict mapping entry names to their kind, 'f' if the entry
+        is a file, 'd' if it is a directory.
+        """
+        return dict((name, _svntypes.get(e['kind']))
+                    for name, e in self.list_dir(path, revision).iteritems())
+
     def revisions(self, paths=None, start=0, stop=0,
                   chunk_size=common.chunk_size):
         """Load the history of this repo.
@@ -393,10 +421,12 @@ class SubversionRepo(object):
                 # TODO: using min(start + chunk_size, stop) may be preferable;
                 #       ra.get_log(), even with chunk_size set, takes a while
                 #       when converting the 65k+ rev. in LLVM.
-                self.remote.get_log(paths=paths, revprops=revprops,
-                                    start=start + 1, end=stop, limit=chunk_size,
-                                    discover_changed_paths=True,
-                                    callback=callback)
+                with self.netstats.call('get_log'):
+                    self.remote.get_log(paths=paths, revprops=revprops,
+                                        start=start + 1, end=stop,
+                                        limit=chunk_size,
+                                        discover_changed_paths=True,
+                                        callback=callback)
             except SubversionException, e:
                 if e.args[1] == ERR_FS_NOT_FOUND:
                     msg = ('%s not found at revision %d!'
@@ -422,6 +452,12 @@ class SubversionRepo(object):
                deleteddirs, props, copies):
         """Commits the appropriate targets from revision in editor's store.
 
+        file_data maps file paths to (base_text, new_text, action) tuples,
+        where base_text and new_text are functions returning the file
+        contents. They are only called when the file is sent, so a
+        single file has to be kept in memory at a time. new_text is called
+        before the properties of the file are sent and may update them.
+
         Return the committed revision as a common.Revision instance.
         """
         def commitcb(rev, date, author):
@@ -431,7 +467,6 @@ class SubversionRepo(object):
         committedrev = []
         revprops = { properties.PROP_REVISION_LOG: message }
         # revprops.update(props)
-        commiteditor = self.remote.get_commit_editor(revprops, commitcb)
 
         paths = set(paths)
         paths.update(addeddirs)
@@ -470,6 +505,7 @@ class SubversionRepo(object):
                     else:
                         assert False, "invalid action '%s'" % action
 
+                    new_text = new_text()
                     if path in props:
                         if props[path].get('svn:special', None):
                             new_text = 'link %s' % new_text
@@ -478,8 +514,12 @@ class SubversionRepo(object):
 
 
                     handler = fileeditor.apply_textdelta()
-                    delta.send_stream(cStringIO.StringIO(new_text), handler)
-                    fileeditor.close()
+                    for window in common.txdelta_windows(base_text(),
+                                                         new_text):
+                        netcall.sent += len(window[-1])
+                        handler(window)
+                    handler(None)
+                    fileeditor.close(hashlib.md5(new_text).hexdigest())
 
                 else:
                     # visiting a directory
@@ -506,21 +546,24 @@ class SubversionRepo(object):
 
             return pathidx
 
-        try:
-            rooteditor = commiteditor.open_root()
-            visitdir(rooteditor, '', paths, 0)
-            rooteditor.close()
-        except:
-            commiteditor.abort()
-            raise
-        commiteditor.close()
+        with self.netstats.call('commit') as netcall:
+            commiteditor = self.remote.get_commit_editor(revprops, commitcb)
+            try:
+                rooteditor = commiteditor.open_root()
+                visitdir(rooteditor, '', paths, 0)
+                rooteditor.close()
+            except:
+                commiteditor.abort()
+                raise
+            commiteditor.close()
 
         return committedrev.pop()
 
     def get_replay(self, revision, editor, oldestrev=0):
 
         try:
-            self.remote.replay(revision, oldestrev, BaseEditor(editor))
+            with self.netstats.call('replay'):
+                self.remote.replay(revision, oldestrev, BaseEditor(editor))
         except (SubversionException, NotImplementedError), e: # pragma: no cover
             # can I depend on this number being constant?
             if (isinstance(e, NotImplementedError) or
@@ -532,12 +575,26 @@ class SubversionRepo(object):
             else:
                 raise
 
-    def get_revision(self, revision, editor):
-        ''' feed the contents of the given revision to the given editor '''
-        reporter = self.remote.do_update(revision, '', True,
-                                         BaseEditor(editor))
-        reporter.set_path('', revision, True)
-        reporter.finish()
+    def get_revision(self, revision, editor, text_deltas=True):
+        ''' feed the contents of the given revision to the given editor
+
+        If text_deltas is False, file contents are not transferred and
+        files are only described by the checksum passed to close_file().
+        '''
+        if text_deltas:
+            op = 'do_update'
+        else:
+            op = 'do_diff'
+        with self.netstats.call(op):
+            if text_deltas:
+                reporter = self.remote.do_update(revision, '', True,
+                                                 BaseEditor(editor))
+            else:
+                reporter = self.remote.do_diff(revision, '', self.svn_url,
+                                               BaseEditor(editor), True, True,
+                                               False)
+            reporter.set_path('', revision, True)
+            reporter.finish()
 
     def get_unified_diff(self, path, revision, other_path=None, other_rev=None,
                          deleted=True, ignore_type=False):
@@ -550,13 +607,16 @@ class SubversionRepo(object):
         if other_rev is None:
             other_rev = revision - 1
 
-        outfile, errfile = self.client.diff(other_rev, revision, url2, url,
-                                            no_diff_deleted=deleted,
-                                            ignore_content_type=ignore_type)
-        error = errfile.read()
-        assert not error, error
+        with self.netstats.call('diff') as netcall:
+            outfile, errfile = self.client.diff(
+                other_rev, revision, url2, url, no_diff_deleted=deleted,
+                ignore_content_type=ignore_type)
+            error = errfile.read()
+            assert not error, error
 
-        return outfile.read()
+            diff = outfile.read()
+            netcall.received += len(diff)
+        return diff
 
     def get_file(self, path, revision):
         """Return content and mode of file at given path and revision.
@@ -569,8 +629,10 @@ class SubversionRepo(object):
         mode = ''
         try:
             out = common.SimpleStringIO()
-            rev, info = self.remote.get_file(path, out, revision)
-            data = out.getvalue()
+            with self.netstats.call('get_file') as netcall:
+                rev, info = self.remote.get_file(path, out, revision)
+                data = out.getvalue()
+                netcall.received += len(data)
             out.close()
             if isinstance(info, list):
                 info = info[-1]
@@ -592,8 +654,9 @@ class SubversionRepo(object):
         specified path does not exist.
         """
         try:
-            pl = self.client.proplist(self.path2url(path), revision,
-                                      client.depth_empty)
+            with self.netstats.call('proplist'):
+                pl = self.client.proplist(self.path2url(path), revision,
+                                          client.depth_empty)
         except SubversionException, e:
             # Specified path does not exist at this revision
             if e.args[1] == subvertpy.ERR_NODE_UNKNOWN_KIND:
@@ -610,8 +673,10 @@ class SubversionRepo(object):
         revision.
         """
         try:
-            entries = self.client.list(self.path2url(dirpath), revision,
-                                       client.depth_infinity, ra.DIRENT_KIND)
+            with self.netstats.call('list'):
+                entries = self.client.list(self.path2url(dirpath), revision,
+                                           client.depth_infinity,
+                                           ra.DIRENT_KIND)
         except SubversionException, e:
             if e.args[1] == subvertpy.ERR_FS_NOT_FOUND:
                 raise IOError(errno.ENOENT,
@@ -626,7 +691,8 @@ class SubversionRepo(object):
         """Return the entry type at the given revision, 'f', 'd' or None
         if the entry does not exist.
         """
-        kind = self.remote.check_path(path, revision)
+        with self.netstats.call('check_path'):
+            kind = self.remote.check_path(path, revision)
         return _svntypes.get(kind)
 
     def path2url(self, path):
@@ -1,5 +1,6 @@
 import cStringIO
 import errno
+import hashlib
 import os
 import shutil
 import sys
@@ -234,21 +235,24 @@ class SubversionRepo(object):
     It uses the SWIG Python bindings, see above for requirements.
     """
     def __init__(self, url='', username='', password='', head=None,
-                 password_stores=None):
+                 password_stores=None, netstats=None):
         parsed = common.parse_url(url, username, password)
         # --username and --password override URL credentials
         self.username = parsed[0]
         self.password = parsed[1]
         self.svn_url = core.svn_path_canonicalize(parsed[2])
+        self.password_stores = password_stores
+        self.netstats = common.NetStats(netstats)
         self.auth_baton_pool = core.Pool()
         self.auth_baton = _create_auth_baton(self.auth_baton_pool, password_stores)
         # self.init_ra_and_client() assumes that a pool already exists
         self.pool = core.Pool()
 
         self.init_ra_and_client()
-        self.uuid = ra.get_uuid(self.ra, self.pool)
-        self.svn_url = ra.get_session_url(self.ra, self.pool)
-        self.root = ra.get_repos_root(self.ra, self.pool)
+        with self.netstats.call('session'):
+            self.uuid = ra.get_uuid(self.ra, self.pool)
+            self.svn_url = ra.get_session_url(self.ra, self.pool)
+            self.root = ra.get_repos_root(self.ra, self.pool)
         assert self.svn_url.startswith(self.root)
         # *will* have a leading '/', would not if we used get_repos_root2
         self.subdir = self.svn_url[len(self.root):]
@@ -260,6 +264,16 @@ class SubversionRepo(object):
         self.hasdiff3 = True
         self.autoprops_config = common.AutoPropsConfig()
 
+    def clone(self):
+        """Return a new connection to the same repository.
+
+        Sessions cannot be shared between threads, concurrent requests
+        must each use their own connection.
+        """
+        return SubversionRepo(self.svn_url, self.username, self.password,
+                              password_stores=self.password_stores,
+                              netstats=self.netstats)
+
     def init_ra_and_client(self):
         """Initializes the RA and client layers, because sometimes getting
         unified diffs runs the remote server out of open files.
@@ -280,10 +294,12 @@ class SubversionRepo(object):
         self.client_context.config = svn_config
         callbacks = RaCallbacks()
         callbacks.auth_baton = self.auth_baton
+        callbacks.progress_func = self.netstats.progressfunc()
         self.callbacks = callbacks
         try:
-            self.ra = ra.open2(self.svn_url, callbacks,
-                               svn_config, self.pool)
+            with self.netstats.call('session'):
+                self.ra = ra.open2(self.svn_url, callbacks,
+                                   svn_config, self.pool)
         except SubversionException, e:
             # e.child contains a detailed error messages
             msglist = []
@@ -297,20 +313,23 @@ class SubversionRepo(object):
 
     @property
     def HEAD(self):
-        return ra.get_latest_revnum(self.ra, self.pool)
+        with self.netstats.call('get_latest_revnum'):
+            return ra.get_latest_revnum(self.ra, self.pool)
 
     @property
     def last_changed_rev(self):
         try:
             holder = []
-            ra.get_log(self.ra, [''],
-                       self.HEAD, 1,
-                       1, # limit of how many log messages to load
-                       True, # don't need to know changed paths
-                       True, # stop on copies
-                       lambda paths, revnum, author, date, message, pool:
-                           holder.append(revnum),
-                       self.pool)
+            head = self.HEAD
+            with self.netstats.call('get_log'):
+                ra.get_log(self.ra, [''],
+                           head, 1,
+                           1, # limit of how many log messages to load
+                           True, # don't need to know changed paths
+                           True, # stop on copies
+                           lambda paths, revnum, author, date, message, pool:
+                               holder.append(revnum),
+                           self.pool)
 
             return holder[-1]
         except SubversionException, e:
@@ -333,10 +352,21 @@ class SubversionRepo(object):
             dir = dir[:-1]
         if revision is None:
             revision = self.HEAD
-        r = ra.get_dir2(self.ra, dir, revision, core.SVN_DIRENT_KIND, self.pool)
+        with self.netstats.call('get_dir'):
+            r = ra.get_dir2(self.ra, dir, revision, core.SVN_DIRENT_KIND,
+                            self.pool)
         folders, props, junk = r
         return folders
 
+    def list_kinds(self, path, revision=None):
+        """List the contents of a server-side directory like list_dir().
+
+        Return a dict mapping entry names to their kind, 'f' if the entry
+        is a file, 'd' if it is a directory.
+        """
+        return dict((name, _svntypes.get(e.kind))
+                    for name, e in self.list_dir(path, revision).iteritems())
+
     def revisions(self, paths=None, start=0, stop=0,
                   chunk_size=common.chunk_size):
         """Load the history of this repo.
@@ -363,15 +393,16 @@ class SubversionRepo(object):
                 # TODO: using min(start + chunk_size, stop) may be preferable;
                 #       ra.get_log(), even with chunk_size set, takes a while
                 #       when converting the 65k+ rev. in LLVM.
-                ra.get_log(self.ra,
-                           paths,
-                           start + 1,
-                           stop,
-                           chunk_size, # limit of how many log messages to load
-                           True, # don't need to know changed paths
-                           True, # stop on copies
-                           callback,
-                           self.pool)
+                with self.netstats.call('get_log'):
+                    ra.get_log(self.ra,
+                               paths,
+                               start + 1,
+                               stop,
+                               chunk_size, # limit of how many log messages
+                               True, # don't need to know changed paths
+                               True, # stop on copies
+                               callback,
+                               self.pool)
             except core.SubversionException, e:
                 if e.apr_err == core.SVN_ERR_FS_NOT_FOUND:
                     msg = ('%s not found at revision %d!'
@@ -398,8 +429,16 @@ class SubversionRepo(object):
                deleteddirs, properties, copies):
         """Commits the appropriate targets from revision in editor's store.
 
+        file_data maps file paths to (base_text, new_text, action) tuples,
+        where base_text and new_text are functions returning the file
+        contents. They are only called when the file is sent, so a
+        single file has to be kept in memory at a time. new_text is called
+        before the properties of the file are sent and may update them.
+
         Return the committed revision as a common.Revision instance.
         """
+        # unlike with subvertpy, the session is reopened for every commit,
+        # including those of a batched push
         self.init_ra_and_client()
 
         def commit_cb(commit_info, pool):
@@ -411,16 +450,11 @@ class SubversionRepo(object):
 
         committedrev = []
 
-        editor, edit_baton = ra.get_commit_editor2(self.ra,
-                                                   message,
-                                                   commit_cb,
-                                                   None,
-                                                   False,
-                                                   self.pool)
+        netcall = self.netstats.call('commit')
         checksum = []
         # internal dir batons can fall out of scope and get GCed before svn is
         # done with them. This prevents that (credit to gvn for the idea).
-        batons = [edit_baton, ]
+        batons = []
         def driver_cb(parent, path, pool):
             if not parent:
                 bat = editor.open_root(edit_baton, base_revision, self.pool)
@@ -460,6 +494,7 @@ class SubversionRepo(object):
                 baton = editor.delete_entry(path, base_revision, parent, pool)
                 compute_delta = False
 
+            new_text = new_text()
             if path in properties:
                 if properties[path].get('svn:special', None):
                     new_text = 'link %s' % new_text
@@ -470,35 +505,49 @@ class SubversionRepo(object):
                 handler, wh_baton = editor.apply_textdelta(baton, None,
                                                            self.pool)
 
+                # the delta is computed by svn_txdelta, out of sight, so
+                # count the full text: an upper bound of the delta data
+                # the subvertpy wrapper counts
+                netcall.sent += len(new_text)
                 txdelta_stream = delta.svn_txdelta(
-                    cStringIO.StringIO(base_text), cStringIO.StringIO(new_text),
+                    cStringIO.StringIO(base_text()),
+                    cStringIO.StringIO(new_text),
                     self.pool)
                 delta.svn_txdelta_send_txstream(txdelta_stream, handler,
                                                 wh_baton, pool)
 
-                # TODO pass md5(new_text) instead of None
-                editor.close_file(baton, None, pool)
-
-        try:
-            delta.path_driver(editor, edit_baton, base_revision, paths, driver_cb,
-                              self.pool)
-        except:
-            # If anything went wrong on the preceding lines, we should
-            # abort the in-progress transaction.
-            editor.abort_edit(edit_baton, self.pool)
-            raise
+                editor.close_file(baton, hashlib.md5(new_text).hexdigest(),
+                                  pool)
+
+        with netcall:
+            editor, edit_baton = ra.get_commit_editor2(self.ra,
+                                                       message,
+                                                       commit_cb,
+                                                       None,
+                                                       False,
+                                                       self.pool)
+            batons.append(edit_baton)
+            try:
+                delta.path_driver(editor, edit_baton, base_revision, paths,
+                                  driver_cb, self.pool)
+            except:
+                # If anything went wrong on the preceding lines, we should
+                # abort the in-progress transaction.
+                editor.abort_edit(edit_baton, self.pool)
+                raise
 
-        editor.close_edit(edit_baton, self.pool)
+            editor.close_edit(edit_baton, self.pool)
 
         return committedrev.pop()
 
     def get_replay(self, revision, editor, oldest_rev_i_have=0):
-        # this method has a tendency to chew through RAM if you don't re-init
-        self.init_ra_and_client()
+        # this method has a tendency to chew through RAM; the pull loop
+        # re-inits the session once memory has grown enough
         e_ptr, e_baton = delta.make_editor(editor)
         try:
-            ra.replay(self.ra, revision, oldest_rev_i_have, True, e_ptr,
-                      e_baton, self.pool)
+            with self.netstats.call('replay'):
+                ra.replay(self.ra, revision, oldest_rev_i_have, True, e_ptr,
+                          e_baton, self.pool)
         except SubversionException, e: # pragma: no cover
             # can I depend on this number being constant?
             if (e.apr_err == core.SVN_ERR_RA_NOT_IMPLEMENTED or
@@ -527,16 +576,31 @@ class SubversionRepo(object):
                 links[f] = mode == 'l'
                 execs[f] = mode == 'x'
 
-    def get_revision(self, revision, editor):
-        ''' feed the contents of the given revision to the given editor '''
+    def get_revision(self, revision, editor, text_deltas=True):
+        ''' feed the contents of the given revision to the given editor
+
+        If text_deltas is False, file contents are not transferred and
+        files are only described by the checksum passed to close_file().
+        '''
 
         e_ptr, e_baton = delta.make_editor(editor)
 
-        reporter, reporter_baton = ra.do_update(self.ra, revision, "", True,
-                                                e_ptr, e_baton)
+        if text_deltas:
+            netcall = self.netstats.call('do_update')
+        else:
+            netcall = self.netstats.call('do_diff')
+        with netcall:
+            if text_deltas:
+                reporter, reporter_baton = ra.do_update(self.ra, revision, "",
+                                                        True, e_ptr, e_baton)
+            else:
+                reporter, reporter_baton = ra.do_diff2(self.ra, revision, "",
+                                                       True, True, False,
+                                                       self.svn_url, e_ptr,
+                                                       e_baton)
 
-        reporter.set_path(reporter_baton, "", revision, True, None)
-        reporter.finish_report(reporter_baton)
+            reporter.set_path(reporter_baton, "", revision, True, None)
+            reporter.finish_report(reporter_baton)
 
     def get_unified_diff(self, path, revision, other_path=None, other_rev=None,
                          deleted=True, ignore_type=False):
@@ -562,23 +626,27 @@ class SubversionRepo(object):
             error_path = os.path.join(tmpdir, 'differr')
             out = open(out_path, 'w')
             err = open(error_path, 'w')
-            try:
-                client.diff3([], url2, optrev(other_rev), url, optrev(revision),
-                             True, True, deleted, ignore_type, 'UTF-8', out, err,
-                             self.client_context, self.pool)
-            except SubversionException, e:
-                # "Can't write to stream: The handle is invalid."
-                # This error happens systematically under Windows, possibly
-                # related to file handles being non-write shareable by default.
-                if e.apr_err != 720006:
-                    raise
-                self.hasdiff3 = False
-                raise common.SubversionRepoCanNotDiff()
-            out.close()
-            err.close()
-            out, err = None, None
-            assert len(open(error_path).read()) == 0
-            diff = open(out_path).read()
+            with self.netstats.call('diff') as netcall:
+                try:
+                    client.diff3([], url2, optrev(other_rev), url,
+                                 optrev(revision), True, True, deleted,
+                                 ignore_type, 'UTF-8', out, err,
+                                 self.client_context, self.pool)
+                except SubversionException, e:
+                    # "Can't write to stream: The handle is invalid."
+                    # This error happens systematically under Windows,
+                    # possibly related to file handles being non-write
+                    # shareable by default.
+                    if e.apr_err != 720006:
+                        raise
+                    self.hasdiff3 = False
+                    raise common.SubversionRepoCanNotDiff()
+                out.close()
+                err.close()
+                out, err = None, None
+                assert len(open(error_path).read()) == 0
+                diff = open(out_path).read()
+                netcall.received += len(diff)
             return diff
         finally:
             if out: out.close()
@@ -598,8 +666,10 @@ class SubversionRepo(object):
         mode = ''
         try:
             out = common.SimpleStringIO()
-            info = ra.get_file(self.ra, path, revision, out)
-            data = out.getvalue()
+            with self.netstats.call('get_file') as netcall:
+                info = ra.get_file(self.ra, path, revision, out)
+                data = out.getvalue()
+                netcall.received += len(data)
             out.close()
             if isinstance(info, list):
                 info = info[-1]
@@ -625,8 +695,9 @@ class SubversionRepo(object):
         rev = optrev(revision)
         rpath = self.path2url(path)
         try:
-            pl = client.proplist2(rpath, rev, rev, False,
-                                  self.client_context, self.pool)
+            with self.netstats.call('proplist'):
+                pl = client.proplist2(rpath, rev, rev, False,
+                                      self.client_context, self.pool)
         except SubversionException, e:
             # Specified path does not exist at this revision
             if e.apr_err == core.SVN_ERR_NODE_UNKNOWN_KIND:
@@ -648,7 +719,9 @@ class SubversionRepo(object):
         pool = core.Pool()
         rev = optrev(revision)
         try:
-            entries = client.ls(rpath, rev, True, self.client_context, pool)
+            with self.netstats.call('list'):
+                entries = client.ls(rpath, rev, True, self.client_context,
+                                    pool)
         except SubversionException, e:
             if e.apr_err == core.SVN_ERR_FS_NOT_FOUND:
                 raise IOError(errno.ENOENT,
@@ -662,7 +735,8 @@ class SubversionRepo(object):
         """Return the entry type at the given revision, 'f', 'd' or None
         if the entry does not exist.
         """
-        kind = ra.check_path(self.ra, path.strip('/'), revision)
+        with self.netstats.call('check_path'):
+            kind = ra.check_path(self.ra, path.strip('/'), revision)
         return _svntypes.get(kind)
 
     def path2url(self, path):
@@ -215,6 +215,21 @@ def load(file_path, default=None, resave=True):
             dump(data, file_path)
     return data
 
+def writenetstats(metapath, ops):
+    """Save the network statistics of a pull, see svnwrap.NetStats."""
+    f = hgutil.atomictempfile(os.path.join(metapath, 'netstats.json'),
+                              'w+b', 0644)
+    json.dump(ops, f, indent=2, sort_keys=True)
+    f.close()
+
+def readnetstats(metapath):
+    """Return the network statistics of the last pull, or None."""
+    path = os.path.join(metapath, 'netstats.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
 def parseurl(url, heads=[]):
     checkout = None
     svn_url, (_junk, heads) = hg.parseurl(url, heads)
@@ -255,23 +270,52 @@ class PrefixMatch(object):
     def visitchildrenset(self, dir):
         return 'this'
 
+def _svnancestor(repo, reverse_map, sourcerev):
+    """Walk the first parents of sourcerev up to the closest changeset
+    in reverse_map.
+
+    Return (outgoing, ancestor) where 'outgoing' lists the nodes of the
+    walked changesets not in reverse_map, starting with sourcerev, and
+    'ancestor' is the node found, or None if the root was reached.
+    Changesets are looked up by batches of growing size when the
+    reverse map supports it, so long stacks of local changesets do not
+    cost one query each.
+    """
+    cl = repo.changelog
+    prefetch = getattr(reverse_map, 'prefetch', None)
+    outgoing = []
+    rev = repo[sourcerev].rev()
+    batchsize = 16
+    while rev != node.nullrev:
+        chain = [rev]
+        while len(chain) < batchsize:
+            p1, p2 = cl.parentrevs(chain[-1])
+            if p1 == node.nullrev or p2 != node.nullrev:
+                break
+            chain.append(p1)
+        if prefetch is not None:
+            prefetch([cl.node(r) for r in chain])
+        for r in chain:
+            n = cl.node(r)
+            if n in reverse_map:
+                return outgoing, n
+            outgoing.append(n)
+            p1, p2 = cl.parentrevs(r)
+            if p2 != node.nullrev:
+                raise error.Abort(
+                    "Sorry, can't find svn parent of a merge revision.")
+        rev = p1
+        batchsize = min(batchsize * 2, 512)
+    return outgoing, None
+
 def outgoing_revisions(repo, reverse_map, sourcerev):
     """Given a repo and an hg_editor, determines outgoing revisions for the
     current working copy state.
     """
-    outgoing_rev_hashes = []
     if sourcerev in reverse_map:
         return
-    sourcerev = repo[sourcerev]
-    while (not sourcerev.node() in reverse_map
-           and sourcerev.node() != node.nullid):
-        outgoing_rev_hashes.append(sourcerev.node())
-        sourcerev = sourcerev.parents()
-        if len(sourcerev) != 1:
-            raise error.Abort(
-                "Sorry, can't find svn parent of a merge revision.")
-        sourcerev = sourcerev[0]
-    if sourcerev.node() != node.nullid:
+    outgoing_rev_hashes, ancestor = _svnancestor(repo, reverse_map, sourcerev)
+    if ancestor is not None:
         return outgoing_rev_hashes
 
 def outgoing_common_and_heads(repo, reverse_map, sourcerev):
@@ -281,16 +325,9 @@ def outgoing_common_and_heads(repo, reverse_map, sourcerev):
     """
     if sourcerev in reverse_map:
         return ([sourcerev], [sourcerev]) # nothing outgoing
-    sourcecx = repo[sourcerev]
-    while (not sourcecx.node() in reverse_map
-           and sourcecx.node() != node.nullid):
-        ps = sourcecx.parents()
-        if len(ps) != 1:
-            raise error.Abort(
-                "Sorry, can't find svn parent of a merge revision.")
-        sourcecx = ps[0]
-    if sourcecx.node() != node.nullid:
-        return ([sourcecx.node()], [sourcerev])
+    outgoing, ancestor = _svnancestor(repo, reverse_map, sourcerev)
+    if ancestor is not None:
+        return ([ancestor], [sourcerev])
     return ([sourcerev], [sourcerev]) # nothing outgoing
 
 def describe_commit(ui, h, b):
@@ -342,6 +379,82 @@ def getsvnrev(ctx, defval=None):
         return convertrev
     return defval
 
+def parseconvertinfo(convertrev):
+    '''Split a convert_revision into a (uuid, path, revnum) tuple'''
+    if not convertrev or not convertrev.startswith('svn:'):
+        return None
+    path, revnum = convertrev[40:].rsplit('@', 1)
+    try:
+        return convertrev[4:40], path, int(revnum)
+    except ValueError:
+        return None
+
+# number of revisions looked up at once when filling the convertinfo cache
+_CONVERTINFOBATCH = 1024
+
+def _convertinfocache(repo):
+    cache = repo.__dict__.get('_convertinfocache')
+    if cache is None:
+        import maps
+        path = repo.vfs.join('cache', 'hgsubversion-convertinfo')
+        cache = maps.ConvertInfoCache(path)
+        repo.__dict__['_convertinfocache'] = cache
+    return cache
+
+def _fillconvertinfo(repo, cache, startrev):
+    cl = repo.changelog
+    # the value recorded in the changeset is used even for those listed
+    # in the revmap: regenerating it would follow the current layout and
+    # branch configuration rather than those of the conversion
+    if hgutil.safehasattr(cl, 'changelogrevision'):
+        # only decodes the extra, not the file list and description
+        readextra = lambda node: cl.changelogrevision(node).extra
+    else:
+        readextra = lambda node: cl.read(node)[5]
+    for rev in xrange(startrev, min(startrev + _CONVERTINFOBATCH, len(cl))):
+        node = cl.node(rev)
+        if cache.known(rev, node):
+            continue
+        convertrev = readextra(node).get('convert_revision')
+        cache.set(rev, node, parseconvertinfo(convertrev))
+
+def convertinfo(ctx):
+    '''Return the (uuid, path, revnum) a changeset was converted from
+
+    Returns None for changesets that didn't come from Subversion. The
+    result is kept in a persistent cache, so that rendering every
+    changeset of a large repository doesn't parse each of them again.
+    '''
+    rev = ctx.rev()
+    if rev is None:
+        return parseconvertinfo(getsvnrev(ctx))
+    repo = ctx.repo().unfiltered()
+    cache = _convertinfocache(repo)
+    node = ctx.node()
+    try:
+        return cache.get(rev, node)
+    except KeyError:
+        pass
+    cache.truncate(len(repo.changelog))
+    _fillconvertinfo(repo, cache, rev)
+    return cache.get(rev, node)
+
+def writeconvertinfo(repo):
+    '''Save the convertinfo cache if anything was added to it'''
+    cache = repo.unfiltered().__dict__.get('_convertinfocache')
+    if cache is None or not cache.dirty:
+        return
+    try:
+        wlock = repo.wlock(wait=False)
+    except error.LockError:
+        return
+    try:
+        cache.write()
+    except (IOError, OSError), err:
+        repo.ui.debug('couldn\'t write convertinfo cache: %s\n' % err)
+    finally:
+        wlock.release()
+
 def revset_fromsvn(repo, subset, x):
     '''``fromsvn()``
     Select changesets that originate from Subversion.
@@ -396,6 +509,18 @@ def getfilestoresize(ui):
         size = -1
     return size
 
+def getrecyclesize(ui):
+    """Return the memory growth in bytes after which Subversion sessions
+    are reopened during a pull, 0 to reopen them after every revision or
+    -1 to never do it.
+    """
+    size = ui.configint('hgsubversion', 'recyclesize', 64)
+    if size > 0:
+        size = size*(2**20)
+    elif size < 0:
+        size = -1
+    return size
+
 def parse_revnum(svnrepo, r):
     try:
         return int(r or 0)
@@ -1,7 +1,10 @@
 import difflib
+import hashlib
 import posixpath
 
 from mercurial import error
+from mercurial import hg
+from mercurial import scmutil
 from mercurial import worker
 
 import compathacks
@@ -11,13 +14,107 @@ import util
 
 def verify(ui, repo, args=None, **opts):
     '''verify current revision against Subversion repository
+
+    With --checksum, only file checksums are retrieved from the server
+    and compared to the local ones, file contents are transferred only
+    when they differ.
+
+    Several revisions can be verified at once with --rev, for instance
+    --rev 'fromsvn()' for the whole converted history. They are verified
+    in parallel, and revisions successfully verified by a previous run
+    are skipped unless --force is passed.
     '''
 
     if repo is None:
         raise error.RepoError("There is no Mercurial repository"
                               " here (.hg not found)")
 
-    ctx = repo[opts.get('rev', '.')]
+    if args:
+        url = repo.ui.expandpath(args[0])
+    else:
+        url = repo.ui.expandpath('default')
+
+    revs = opts.get('rev') or '.'
+    if isinstance(revs, list):
+        revs = list(scmutil.revrange(repo, revs))
+    else:
+        revs = [repo[revs].rev()]
+    if len(revs) == 1:
+        ctx = repo[revs[0]]
+        result = verifyctx(ui, repo, ctx, url, opts)
+        if not result:
+            recordverified(repo, [ctx])
+        return result
+
+    verified = loadverified(repo)
+    todo = [r for r in revs if opts.get('force')
+            or repo[r].hex() not in verified]
+    if len(todo) < len(revs):
+        ui.status('skipping %d revisions already verified\n'
+                  % (len(revs) - len(todo)))
+
+    def verifyrevs(revs):
+        # revisions are already verified in parallel
+        wui = ui.copy()
+        wui.setconfig('worker', 'enabled', False, 'verify')
+        # workers are forked: open the repository again rather than
+        # share the parent's file handles and sqlite revmap connection,
+        # which cannot be used after a fork
+        wrepo = hg.repository(wui, repo.root)
+        for rev in revs:
+            wui.pushbuffer()
+            res = verifyctx(wui, wrepo, wrepo[rev], url, opts)
+            out = wui.popbuffer()
+            yield rev, '%d\0%s' % (res, out.encode('string_escape'))
+
+    result = 0
+    ok = []
+    w = worker.worker(ui, 1.0, verifyrevs, (), tuple(todo))
+    for i, (rev, t) in enumerate(w):
+        compathacks.progress(ui, 'verify revisions', i, total=len(todo))
+        res, out = t.split('\0', 1)
+        ui.write(out.decode('string_escape'))
+        if int(res):
+            result = 1
+        else:
+            ok.append(repo[rev])
+    compathacks.progress(ui, 'verify revisions', None, total=len(todo))
+    recordverified(repo, ok)
+    return result
+
+def loadverified(repo):
+    '''Return the set of verified changeset hashes.'''
+    verified = set()
+    try:
+        fp = repo.vfs('svn/verified')
+    except IOError:
+        return verified
+    try:
+        for line in fp:
+            verified.add(line.split(' ', 1)[0])
+    finally:
+        fp.close()
+    return verified
+
+def recordverified(repo, ctxs):
+    '''Add converted changesets to the verified revisions watermark.
+
+    Each line holds the changeset hash, which covers the files content
+    and flags through the manifest hash, and the Subversion revision for
+    reference.'''
+    ctxs = [ctx for ctx in ctxs if 'close' not in ctx.extra()]
+    if not ctxs:
+        return
+    fp = repo.vfs('svn/verified', 'a')
+    try:
+        for ctx in sorted(ctxs, key=lambda c: c.rev()):
+            svnrev = ctx.extra()['convert_revision'].rsplit('@', 1)[1]
+            fp.write('%s %s\n' % (ctx.hex(), svnrev))
+    finally:
+        fp.close()
+
+def verifyctx(ui, repo, ctx, url, opts):
+    '''verify a single changeset against Subversion repository at url'''
     if 'close' in ctx.extra():
         ui.write('cannot verify closed branch')
         return 0
@@ -25,11 +122,6 @@ def verify(ui, repo, args=None, **opts):
     if convert_revision is None or not convert_revision.startswith('svn:'):
         raise error.Abort('revision %s not from SVN' % ctx)
 
-    if args:
-        url = repo.ui.expandpath(args[0])
-    else:
-        url = repo.ui.expandpath('default')
-
     svn = svnrepo.svnremoterepo(ui, url).svn
     meta = repo.svnmeta(svn.uuid, svn.subdir)
     srev, branch, branchpath = meta.get_source_rev(ctx=ctx)
@@ -51,7 +143,100 @@ def verify(ui, repo, args=None, **opts):
                                           svndesc, hgdesc):
                 ui.note(c)
 
-    if opts.get('stupid', ui.configbool('hgsubversion', 'stupid')):
+    def check_files(svnfiles):
+        hgfiles = set(ctx) - util.ignoredfiles
+        if hgfiles == svnfiles:
+            return True
+        unexpected = hgfiles - svnfiles
+        for f in sorted(unexpected):
+            ui.write('unexpected file: %s\n' % f)
+        missing = svnfiles - hgfiles
+        for f in sorted(missing):
+            ui.write('missing file: %s\n' % f)
+        return False
+
+    if opts.get('checksum'):
+        class ChecksumEditor(svnwrap.Editor):
+            """editor collecting file checksums and properties."""
+            def __init__(self):
+                self.checksums = {}
+                self.props = {}
+
+            def open_root(self, base_revnum, pool=None):
+                pass
+
+            def add_directory(self, path, parent_baton, copyfrom_path,
+                              copyfrom_revision, pool=None):
+                pass
+
+            def open_directory(self, path, parent_baton, base_revision, pool=None):
+                pass
+
+            def add_file(self, path, parent_baton=None, copyfrom_path=None,
+                         copyfrom_revision=None, file_pool=None):
+                self.props[path] = {}
+                return path
+
+            def open_file(self, path, base_revnum):
+                raise NotImplementedError()
+
+            def apply_textdelta(self, file_baton, base_checksum, pool=None):
+                # no text is sent, only the closing window
+                return lambda window: None
+
+            def change_dir_prop(self, dir_baton, name, value, pool=None):
+                pass
+
+            def change_file_prop(self, file_baton, name, value, pool=None):
+                self.props[file_baton][name] = value
+
+            def close_file(self, file_baton, checksum, pool=None):
+                self.checksums[file_baton] = checksum
+
+            def close_directory(self, dir_baton, pool=None):
+                pass
+
+            def delete_entry(self, path, revnum, pool=None):
+                raise NotImplementedError()
+
+        v = ChecksumEditor()
+        branchsvn = svnrepo.svnremoterepo(ui, branchurl).svn
+        branchsvn.get_revision(srev, v, text_deltas=False)
+
+        result = 0
+        files = sorted(f for f in v.checksums if f in ctx)
+        for i, fn in enumerate(files):
+            compathacks.progress(ui, 'verify', i, total=len(files))
+            fctx = ctx[fn]
+            props = v.props[fn]
+            mode = ''
+            if 'svn:executable' in props:
+                mode = 'x'
+            elif 'svn:special' in props:
+                mode = 'l'
+            if fctx.flags() != mode:
+                ui.write('wrong flags for: %s\n' % fn)
+                result = 1
+
+            hgdata = fctx.data()
+            if mode == 'l':
+                hgdata = 'link ' + hgdata
+            checksum = v.checksums[fn]
+            if checksum and hashlib.md5(hgdata).hexdigest() == checksum:
+                continue
+            # checksums differ or were not reported, compare contents
+            ui.debug('fetching %s\n' % fn)
+            svndata, svnmode = branchsvn.get_file(fn, srev)
+            if fctx.data() != svndata:
+                ui.write('difference in: %s\n' % fn)
+                diff_file(fn, svndata)
+                result = 1
+        compathacks.progress(ui, 'verify', None, total=len(files))
+
+        if not check_files(set(v.checksums)):
+            result = 1
+
+    elif opts.get('stupid', ui.configbool('hgsubversion', 'stupid')):
         svnfiles = set()
         result = 0
 
@@ -102,13 +287,7 @@ def verify(ui, repo, args=None, **opts):
                 result = 1
             svnfiles.add(fn)
 
-        if hgfiles != svnfiles:
-            unexpected = hgfiles - svnfiles
-            for f in sorted(unexpected):
-                ui.write('unexpected file: %s\n' % f)
-            missing = svnfiles - hgfiles
-            for f in sorted(missing):
-                ui.write('missing file: %s\n' % f)
+        if not check_files(svnfiles):
             result = 1
 
         compathacks.progress(ui, 'verify', None, total=len(hgfiles))
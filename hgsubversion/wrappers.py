@@ -28,7 +28,9 @@ except ImportError:
 from mercurial import scmutil
 
 import compathacks
+import memwatch
 import replay
+import pullprofile
 import pushmod
 import stupid as stupidmod
 import svnwrap
@@ -251,7 +253,91 @@ def push(repo, dest, force, revs):
         tip_ctx = repo[outgoing[-1]].p1()
         svnbranch = tip_ctx.branch()
         modified_files = {}
-        for i in range(len(outgoing) - 1, -1, -1):
+
+        def rebasechildren(original_ctx, tip_ctx):
+            # Rebase any children of the commit we just pushed that
+            # are not in the outgoing set
+            for c in original_ctx.children():
+                if not c.node() in hashes and not c.node() in outgoing:
+                    util.swap_out_encoding(old_encoding)
+                    try:
+                        # Path changed as subdirectories were getting
+                        # deleted during push.
+                        saved_path = os.getcwd()
+                        os.chdir(repo.root)
+
+                        def extrafn(ctx, extra):
+                            extra['branch'] = ctx.branch()
+
+                        ui.status('rebasing non-outgoing %s onto %s\n' % (c, tip_ctx))
+                        needs_rebase_set = "%s::" % node.hex(c.node())
+                        hgrebase.rebase(ui, repo,
+                                        dest=node.hex(tip_ctx.node()),
+                                        rev=[needs_rebase_set],
+                                        extrafn=extrafn,
+                                        keep=not hasobsolete)
+                    finally:
+                        os.chdir(saved_path)
+                        util.swap_out_encoding()
+
+        start = len(outgoing) - 1
+        if ui.configbool('hgsubversion', 'batchpush', False):
+            # Commit the changesets in a row, each on top of the
+            # previous one, and pull them back once. Stop when another
+            # client committed in between, including before the first
+            # one; the remaining changesets are then pushed one by one
+            # and rebased if necessary.
+            pushed = {}
+            nofiles = None
+            base_revnum = hashes[tip_ctx.node()][0]
+            while start >= 0:
+                current_ctx = repo[outgoing[start]]
+                if (len(current_ctx.parents()) != 1
+                    or current_ctx.branch() != svnbranch):
+                    break
+                try:
+                    ui.status('committing %s\n' % current_ctx)
+                    pushedrev = pushmod.commit(ui, repo, current_ctx, meta,
+                                               base_revnum, svn)
+                except pushmod.NoFilesException:
+                    # the changesets committed so far are pulled first
+                    nofiles = current_ctx
+                    break
+                start -= 1
+                interleaved = pushedrev.revnum != base_revnum + 1
+                pushed[pushedrev.revnum] = current_ctx
+                base_revnum = pushedrev.revnum
+                if interleaved:
+                    ui.note('r%d was interleaved with other commits\n'
+                            % pushedrev.revnum)
+                    break
+
+            if pushed:
+                repo.hook('debug-hgsubversion-between-push-and-pull-for-tests')
+                r = pull(repo, dest, force=force, meta=meta)
+                assert not r or r == 0
+
+                converted = []
+                for c in tip_ctx.descendants():
+                    if c.node() in hashes and c.branch() == svnbranch:
+                        original_ctx = pushed.get(
+                            meta.get_source_rev(ctx=c)[0])
+                        if original_ctx is not None:
+                            if hasobsolete:
+                                obsmarkers.append([(original_ctx, [c])])
+                            converted.append((original_ctx, c))
+                        tip_ctx = c
+                        for file in c.files():
+                            modified_files[file] = True
+                for original_ctx, c in converted:
+                    rebasechildren(original_ctx, c)
+
+            if nofiles is not None:
+                ui.warn("Could not push revision %s because it had no "
+                        "changes in svn.\n" % nofiles)
+                return
+
+        for i in range(start, -1, -1):
             # 2. Pick the oldest changeset that needs to be pushed
             current_ctx = repo[outgoing[i]]
             original_ctx = current_ctx
@@ -335,28 +421,7 @@ def push(repo, dest, force, revs):
 
             # 7. Rebase any children of the commit we just pushed
             # that are not in the outgoing set
-            for c in original_ctx.children():
-                if not c.node() in hashes and not c.node() in outgoing:
-                    util.swap_out_encoding(old_encoding)
-                    try:
-                        # Path changed as subdirectories were getting
-                        # deleted during push.
-                        saved_path = os.getcwd()
-                        os.chdir(repo.root)
-
-                        def extrafn(ctx, extra):
-                            extra['branch'] = ctx.branch()
-
-                        ui.status('rebasing non-outgoing %s onto %s\n' % (c, tip_ctx))
-                        needs_rebase_set = "%s::" % node.hex(c.node())
-                        hgrebase.rebase(ui, repo,
-                                        dest=node.hex(tip_ctx.node()),
-                                        rev=[needs_rebase_set],
-                                        extrafn=extrafn,
-                                        keep=not hasobsolete)
-                    finally:
-                        os.chdir(saved_path)
-                        util.swap_out_encoding()
+            rebasechildren(original_ctx, tip_ctx)
 
 
         util.swap_out_encoding(old_encoding)
@@ -415,6 +480,26 @@ def exchangepush(orig, repo, remote, force=False, revs=None, newbranch=False,
         return orig(repo, remote, force, revs, newbranch, bookmarks=bookmarks,
                     **kwargs)
 
+def uptodate(svn, meta, stopat_rev):
+    """Tell whether a previously pulled repository has nothing to pull,
+    without loading the revision map.
+    """
+    lastpulled = meta.lastpulled
+    if lastpulled <= 0:
+        return False
+    if stopat_rev:
+        return stopat_rev <= lastpulled
+    if svn.HEAD <= lastpulled:
+        return True
+    if svn.subdir.strip('/'):
+        # HEAD moves with commits anywhere in the repository, look for
+        # changes below the cloned directory instead
+        try:
+            return svn.last_changed_rev <= lastpulled
+        except svnwrap.SubversionException:
+            pass
+    return False
+
 def pull(repo, source, heads=[], force=False, meta=None):
     """pull new revisions from Subversion"""
     assert source.capable('subversion')
@@ -424,12 +509,16 @@ def pull(repo, source, heads=[], force=False, meta=None):
     svn_url, heads, checkout = util.parseurl(svn_url, heads)
     old_encoding = util.swap_out_encoding()
     total = None
+    profiler = None
+    watch = None
+    netbase = None
     try:
         have_replay = not repo.ui.configbool('hgsubversion', 'stupid')
         if not have_replay:
             repo.ui.note('fetching stupidly...\n')
 
         svn = source.svn
+        netbase = svn.netstats.snapshot()
         if meta is None:
             meta = repo.svnmeta(svn.uuid, svn.subdir)
 
@@ -448,7 +537,11 @@ def pull(repo, source, heads=[], force=False, meta=None):
             meta.branchmap['default'] = meta.branch
 
         ui = repo.ui
-        start = meta.revmap.lastpulled
+        if uptodate(svn, meta, stopat_rev):
+            ui.status(i18n._("no changes found\n"))
+            return 0
+
+        start = meta.lastpulled
 
         if start <= 0:
             # we are initializing a new repository
@@ -471,7 +564,14 @@ def pull(repo, source, heads=[], force=False, meta=None):
         skiprevs = repo.ui.configlist('hgsubversion', 'unsafeskip', '')
         skiprevs = set(util.parse_revnum(svn, r) for r in skiprevs)
 
-        oldrevisions = len(meta.revmap)
+        if repo.ui.configbool('hgsubversion', 'profile'):
+            profiler = meta.profiler = pullprofile.PullProfile()
+        watch = meta.memwatch = memwatch.MemoryWatch(
+            ui, meta, util.getrecyclesize(ui), record=profiler is not None)
+
+        # counted before converting the first revision, so the revmap is
+        # not loaded when there is nothing to convert
+        oldrevisions = None
         if stopat_rev:
             total = stopat_rev - start
         else:
@@ -482,13 +582,19 @@ def pull(repo, source, heads=[], force=False, meta=None):
         try:
             # start converting revisions
             firstrun = True
-            for r in svn.revisions(start=start, stop=stopat_rev):
+            logentries = meta.profiler.iterate(
+                'revisions', svn.revisions(start=start, stop=stopat_rev))
+            for r in logentries:
                 if (r.revnum in skiprevs or
                     (r.author is None and
                      r.message == 'This is an empty revision for padding.')):
                     lastpulled = r.revnum
                     continue
-                tbdelta = meta.update_branch_tag_map_for_rev(r)
+                if oldrevisions is None:
+                    oldrevisions = len(meta.revmap)
+                meta.profiler.startrev(r.revnum)
+                with meta.profiler.phase('branchtagmap'):
+                    tbdelta = meta.update_branch_tag_map_for_rev(r)
                 # got a 502? Try more than once!
                 tries = 0
                 converted = False
@@ -506,16 +612,21 @@ def pull(repo, source, heads=[], force=False, meta=None):
                         compathacks.progress(ui, 'pull', r.revnum - start,
                                              total=total)
 
-                        meta.save_tbdelta(tbdelta)
-                        close = pullfuns[have_replay](ui, meta, svn, r, tbdelta,
-                                                      firstrun)
-                        meta.committags(r, close)
-                        for branch, parent in close.iteritems():
-                            if parent in (None, node.nullid):
-                                continue
-                            meta.delbranch(branch, parent, r)
-
-                        meta.save()
+                        with meta.profiler.phase('save'):
+                            meta.save_tbdelta(tbdelta)
+                        with meta.profiler.phase('convert'):
+                            close = pullfuns[have_replay](ui, meta, svn, r,
+                                                          tbdelta, firstrun)
+                        with meta.profiler.phase('tags'):
+                            meta.committags(r, close)
+                        with meta.profiler.phase('delbranch'):
+                            for branch, parent in close.iteritems():
+                                if parent in (None, node.nullid):
+                                    continue
+                                meta.delbranch(branch, parent, r)
+
+                        with meta.profiler.phase('save'):
+                            meta.save()
                         converted = True
                         firstrun = False
 
@@ -534,6 +645,8 @@ def pull(repo, source, heads=[], force=False, meta=None):
                             raise hgerror.Abort(*e.args)
 
                 lastpulled = r.revnum
+                meta.profiler.endrev()
+                meta.memwatch.endrev(r.revnum, svn)
 
         except KeyboardInterrupt:
             ui.traceback()
@@ -542,11 +655,26 @@ def pull(repo, source, heads=[], force=False, meta=None):
     finally:
         if total is not None:
             compathacks.progress(ui, 'pull', None, total=total)
+        if profiler is not None:
+            meta.profiler = pullprofile.NullProfile()
+            profiler.endrev()
+            profiler.write(ui, meta.metapath)
+        if watch is not None:
+            meta.memwatch = memwatch.NullWatch()
+            if watch.record:
+                watch.write(ui, meta.metapath)
+        if netbase is not None and meta is not None:
+            netstats = svn.netstats.snapshot(since=netbase)
+            util.writenetstats(meta.metapath, netstats)
+            for line in svnwrap.format_netstats(netstats):
+                repo.ui.debug(line)
         util.swap_out_encoding(old_encoding)
 
     if lastpulled is not None:
-        meta.revmap.lastpulled = lastpulled
-    revisions = len(meta.revmap) - oldrevisions
+        meta.lastpulled = lastpulled
+    revisions = 0
+    if oldrevisions is not None:
+        revisions = len(meta.revmap) - oldrevisions
 
     if revisions == 0:
         ui.status(i18n._("no changes found\n"))
@@ -1,3 +1,4 @@
+import json
 import os
 import unittest
 import sys
@@ -114,7 +115,7 @@ def _run_assertions(self, name, single, src, dest, u):
     self.assertTrue(os.path.isdir(os.path.join(dest.path, 'svn')),
                     'no .hg/svn directory in the destination!')
     dest = hg.repository(u, os.path.dirname(dest.path))
-    for tf in ('lastpulled', 'rev_map', 'uuid', 'tagmap', 'layout', 'subdir',):
+    for tf in ('lastpulled', 'rev_map', 'uuid', 'tagmap', 'subdir',):
 
         stf = os.path.join(src.path, 'svn', tf)
         # the generation of tagmap is lazy so it doesn't strictly need to exist
@@ -142,6 +143,22 @@ def _run_assertions(self, name, single, src, dest, u):
         except AttributeError:
           # hg 2.8 and earlier
           self.assertEqual(src.branchtags(), dest.branchtags())
+    # options are only stored once they have been used, so compare
+    # those stored on both sides, which must include the layout
+    options = []
+    for repo in (src, dest):
+        optionsfile = os.path.join(repo.path, 'svn', 'options')
+        self.assertTrue(os.path.isfile(optionsfile),
+                        '%r is missing!' % optionsfile)
+        with open(optionsfile) as f:
+            options.append(json.load(f)['options'])
+    old, new = options
+    self.assertTrue('layout' in old and 'layout' in new,
+                    'layout option missing: old %r new %r' % (old, new))
+    common = set(old) & set(new)
+    self.assertEqual(dict((k, old[k]) for k in common),
+                     dict((k, new[k]) for k in common),
+                     'options differ old: %r new %r' % (old, new))
     srcbi = util.load(os.path.join(src.path, 'svn', 'branch_info'))
     destbi = util.load(os.path.join(dest.path, 'svn', 'branch_info'))
     self.assertEqual(sorted(srcbi.keys()), sorted(destbi.keys()))
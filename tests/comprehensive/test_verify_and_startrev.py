@@ -53,6 +53,8 @@ def _do_case(self, name, layout):
                                        stupid=True), 0)
         self.assertEqual(verify.verify(repo.ui, repo, rev=ctx.node(),
                                        stupid=False), 0)
+        self.assertEqual(verify.verify(repo.ui, repo, rev=ctx.node(),
+                                       checksum=True), 0)
 
     # check a startrev clone
     if layout == 'single' and name not in _skipshallow:
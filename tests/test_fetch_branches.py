@@ -7,6 +7,8 @@ from mercurial import hg
 from mercurial import node
 
 from hgsubversion import compathacks
+from hgsubversion import stupid
+from hgsubversion import svnrepo
 
 revsymbol = test_util.revsymbol
 
@@ -46,6 +48,18 @@ class TestFetchBranches(test_util.TestBase):
         self.assertEqual(sorted(heads['branch2'].manifest().keys()),
                          ['a', 'b'])
 
+    def test_unrelatedbranch_workers(self):
+        config = {
+            'hgsubversion.stupidworkers': '3',
+            }
+        repo = self._load_fixture_and_fetch('unrelatedbranch.svndump',
+                                            config=config)
+        heads = [repo[n] for n in repo.heads()]
+        heads = dict([(ctx.branch(), ctx) for ctx in heads])
+        self.assertEqual(heads['branch1'].manifest().keys(), ['b'])
+        self.assertEqual(sorted(heads['branch2'].manifest().keys()),
+                         ['a', 'b'])
+
     def test_unorderedbranch(self):
         repo = self._load_fixture_and_fetch('unorderedbranch.svndump')
         r = revsymbol(repo, 'branch')
@@ -201,6 +215,101 @@ class TestFetchBranches(test_util.TestBase):
             self.assertFalse('other/phile' in ctx, 'pulled in other project')
             self.assertFalse('phile' in ctx, 'merged other project in repo')
 
+    def _checkpathcache(self, fixture_name):
+        """Compare stupid mode path classification through a PathCache
+        with the uncached requests it replaces, for every revision.
+        """
+        repo, repo_path = self.load_and_fetch(fixture_name)
+        meta = repo.svnmeta()
+        svn = svnrepo.svnremoterepo(self.ui(),
+                                    test_util.fileurl(repo_path)).svn
+        tbdelta = {'branches': ({}, [])}
+        for i, r in enumerate(svn.revisions()):
+            firstrun = i == 0
+            cache = stupid.PathCache(svn, r.revnum)
+            branches = stupid.branches_in_paths(
+                meta, tbdelta, r.paths, r.revnum, cache.checkpath,
+                cache.list_files, firstrun)
+            expected = _oldbranches_in_paths(meta, tbdelta, r.paths,
+                                             r.revnum, svn, firstrun)
+            self.assertEqual(expected, branches, 'r%d' % r.revnum)
+
+            paths = set()
+            for p in r.paths:
+                while p:
+                    paths.add(p)
+                    p = p.rpartition('/')[0]
+            for p in sorted(paths):
+                kind = svn.checkpath(p, r.revnum)
+                self.assertEqual(kind, cache.checkpath(p, r.revnum),
+                                 '%s@%d' % (p, r.revnum))
+                if kind == 'd':
+                    self.assertEqual(
+                        sorted(svn.list_files(p, r.revnum)),
+                        sorted(cache.list_files(p, r.revnum)),
+                        '%s@%d' % (p, r.revnum))
+
+            for b, bp in sorted(branches.iteritems()):
+                if (meta.skipbranch(b) or
+                    svn.checkpath(bp, r.revnum) != 'd'):
+                    continue
+                parentctx = repo[meta.get_parent_revision(r.revnum, b)]
+                files = stupid.fetch_branchrev(
+                    svn, meta, b, bp, r, parentctx,
+                    pathcache=stupid.PathCache(svn, r.revnum))[0]
+                expected = stupid.fetch_branchrev(
+                    svn, meta, b, bp, r, parentctx, pathcache=svn)[0]
+                self.assertEqual(sorted(expected), sorted(files),
+                                 '%s@%d' % (b, r.revnum))
+
+    def test_pathcache_replace_branch(self):
+        # r5 deletes branch1 and copies it back from branch2, then
+        # replaces some of its entries in the same revision
+        self._checkpathcache('replace_branch_with_branch.svndump')
+
+    def test_pathcache_delete_restore(self):
+        self._checkpathcache('delete_restore_trunk.svndump')
+
+    def test_pathcache_copies(self):
+        self._checkpathcache('file_mixed_with_branches.svndump')
+
+def _oldbranches_in_paths(meta, tbdelta, paths, revnum, svn, firstrun):
+    """branches_in_paths() as it was before PathCache, checking every
+    path with a separate request in discovery order.
+    """
+    branches = {}
+    if firstrun:
+        paths_need_discovery = [p for (p, t) in svn.list_files('', revnum)
+                                if t == 'f']
+    else:
+        paths_need_discovery = []
+    for p in paths:
+        relpath, branch, branchpath = meta.split_branch_path(p)
+        if relpath is not None:
+            branches[branch] = branchpath
+        elif paths[p].action == 'D' and not meta.get_path_tag(p):
+            ln = meta.localname(p)
+            if ln in meta.branches or ln in tbdelta['branches'][1]:
+                branches[ln] = p
+        else:
+            paths_need_discovery.append(p)
+    actually_files = []
+    while paths_need_discovery:
+        p = paths_need_discovery.pop(0)
+        if svn.checkpath(p, revnum) == 'f':
+            actually_files.append(p)
+        elif paths[p].copyfrom_path and not meta.get_path_tag(p):
+            paths_need_discovery.extend(['%s/%s' % (p, x[0])
+                                         for x in svn.list_files(p, revnum)
+                                         if x[1] == 'f'])
+    for path in actually_files:
+        if meta.get_path_tag(path):
+            continue
+        fpath, branch, bpath = meta.split_branch_path(path, existing=False)
+        if bpath is None:
+            continue
+        branches[branch] = bpath
+    return branches
 
 def suite():
     all_tests = [unittest.TestLoader().loadTestsFromTestCase(TestFetchBranches),
@@ -1,9 +1,25 @@
-import os, sys, unittest
+import hashlib, os, sys, unittest
 
 _rootdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, _rootdir)
 
 from hgsubversion import editor
+from hgsubversion import stupid
+from hgsubversion import svnwrap
+
+class _FetchSvn(object):
+    """Connection stand-in recording the files it is asked for."""
+    def __init__(self, calls):
+        self.calls = calls
+
+    def clone(self):
+        return _FetchSvn(self.calls)
+
+    def get_file(self, path, revnum):
+        self.calls.append(path)
+        if path.startswith('missing'):
+            raise IOError(2, '%s not found' % path)
+        return '%s@%d' % (path, revnum), ''
 
 class TestHelpers(unittest.TestCase):
     def test_filestore(self):
@@ -31,3 +47,97 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual([], os.listdir(fs._tempdir))
         self.assertRaises(editor.EditingError, lambda: fs.getfile('bb'))
         fs.close()
+
+    def test_spooledbuffer(self):
+        fs = editor.FileStore(4)
+        buf = fs.newbuffer()
+        buf.write('ab')
+        self.assertFalse(buf.spilled())
+        self.assertEqual('ab', buf.getvalue())
+        buf.write('cde')
+        self.assertTrue(buf.spilled())
+        buf.write('f')
+        buf.close()
+        self.assertEqual('abcdef', buf.getvalue())
+        self.assertEqual('abcdef', buf.map()[:])
+        self.assertEqual(hashlib.md5('abcdef').hexdigest(), buf.hexdigest())
+
+        # spilled buffers are adopted by the store, not copied
+        fs.setfile('a', buf)
+        self.assertEqual(1, len(os.listdir(fs._tempdir)))
+        self.assertEqual('abcdef', fs.getfile('a'))
+
+        base = fs.spill('0123456789')
+        self.assertTrue(base.frozen)
+        self.assertRaises(editor.EditingError, lambda: base.write('x'))
+        self.assertEqual('2345', base.map()[2:6])
+        base.discard()
+        self.assertEqual(1, len(os.listdir(fs._tempdir)))
+
+        small = fs.newbuffer()
+        small.write('x')
+        fs.setfile('b', small)
+        self.assertEqual('x', fs._data.get('b'))
+        fs.close()
+
+    def test_txdelta_windows(self):
+        def apply(base, windows):
+            target = []
+            for soffset, slen, tlen, srcops, ops, data in windows:
+                self.assertTrue(tlen <= 1024)
+                self.assertTrue(slen <= 1024)
+                source = base[soffset:soffset + slen]
+                for action, offset, length in ops:
+                    if action == svnwrap.TXDELTA_SOURCE:
+                        target.append(source[offset:offset + length])
+                    else:
+                        target.append(data[offset:offset + length])
+            return ''.join(target)
+
+        base = ''.join('line %d\n' % i for i in xrange(10000))
+        target = base.replace('line 5000\n', 'changed\n')
+        windows = list(svnwrap.txdelta_windows(base, target, 1024))
+        self.assertEqual(target, apply(base, windows))
+        self.assertEqual('changed\n', ''.join(w[5] for w in windows))
+
+        # a short copy, new text, then a long copied run further on: the
+        # source view must not grow past the window size
+        base = ''.join('line %d\n' % i for i in xrange(1000))
+        target = base[:7] + 'x' * 500 + base[1000:]
+        windows = list(svnwrap.txdelta_windows(base, target, 1024))
+        self.assertEqual(target, apply(base, windows))
+
+        for base, target in [('', 'abc'), ('abc', ''), ('abc', 'abc')]:
+            windows = list(svnwrap.txdelta_windows(base, target, 1024))
+            self.assertEqual(target, apply(base, windows))
+
+    def test_filefetcher(self):
+        calls = []
+        pool = stupid.FetchPool(2)
+        fetcher = stupid.FileFetcher(_FetchSvn(calls), 3, pool)
+        paths = ['f%02d' % i for i in xrange(40)] + ['missing']
+        for p in paths:
+            fetcher.want(p)
+        # the first request retrieves a whole batch following it
+        self.assertEqual(('f05@3', ''), fetcher.get_file('f05'))
+        batch = stupid.FileFetcher.batchsize * pool.workers
+        self.assertEqual(sorted(paths[5:5 + batch]), sorted(calls))
+        del calls[:]
+        for p in paths[:5] + paths[6:-1]:
+            self.assertEqual(('%s@3' % p, ''), fetcher.get_file(p))
+        self.assertRaises(IOError, fetcher.get_file, 'missing')
+        # every file was retrieved exactly once
+        self.assertEqual(sorted(paths[:5] + paths[5 + batch:]),
+                         sorted(calls))
+        # files which were not announced are fetched on demand
+        del calls[:]
+        self.assertEqual(('other@3', ''), fetcher.get_file('other'))
+        self.assertEqual(['other'], calls)
+
+        # without workers, nothing is prefetched
+        calls = []
+        fetcher = stupid.FileFetcher(_FetchSvn(calls), 3, stupid.FetchPool(1))
+        fetcher.want('a')
+        fetcher.want('b')
+        self.assertEqual(('b@3', ''), fetcher.get_file('b'))
+        self.assertEqual(['b'], calls)
@@ -1,5 +1,7 @@
 import test_util
 
+import hashlib
+import json
 import os.path
 import subprocess
 from mercurial import error as hgerror
@@ -7,7 +9,11 @@ from mercurial import node
 from mercurial import ui
 from mercurial import util as hgutil
 from mercurial import commands
+from hgsubversion import svnmeta
+from hgsubversion import svnrepo
+from hgsubversion import svnwrap
 from hgsubversion import verify
+from hgsubversion import wrappers
 
 class TestPull(test_util.TestBase):
     def setUp(self):
@@ -25,6 +31,118 @@ class TestPull(test_util.TestBase):
         commands.pull(self.repo.ui, self.repo)
         self.assertEqual(state, self.repo[None].parents())
 
+    def test_nochanges_skips_revmap(self):
+        repo, repo_path = self._loadupdate('single_rev.svndump')
+        source = svnrepo.svnremoterepo(repo.ui, test_util.fileurl(repo_path))
+        def failrevmap(meta):
+            raise AssertionError('the revmap should not be loaded')
+        origrevmap = svnmeta.SVNMeta.revmap
+        svnmeta.SVNMeta.revmap = property(failrevmap)
+        try:
+            self.assertEqual(0, wrappers.pull(repo, source))
+        finally:
+            svnmeta.SVNMeta.revmap = origrevmap
+
+    def test_skipped_skips_revmap(self):
+        repo, repo_path = self._loadupdate('single_rev.svndump')
+        self.add_svn_rev(repo_path, {'trunk/alpha': 'Changed'})
+        self.add_svn_rev(repo_path, {'trunk/beta': 'More changed'})
+        repo.ui.setconfig('hgsubversion', 'unsafeskip', '3 4')
+        source = svnrepo.svnremoterepo(repo.ui, test_util.fileurl(repo_path))
+        def failrevmap(meta):
+            raise AssertionError('the revmap should not be loaded')
+        origrevmap = svnmeta.SVNMeta.revmap
+        svnmeta.SVNMeta.revmap = property(failrevmap)
+        try:
+            self.assertEqual(0, wrappers.pull(repo, source))
+        finally:
+            svnmeta.SVNMeta.revmap = origrevmap
+        self.assertEqual(4, svnmeta.SVNMeta(repo).lastpulled)
+        self.assertEqual(1, test_util.repolen(repo))
+
+    def test_profile(self):
+        repo, repo_path = self._loadupdate('single_rev.svndump')
+        self.add_svn_rev(repo_path, {'trunk/alpha': 'Changed'})
+        repo.ui.setconfig('hgsubversion', 'profile', True)
+        commands.pull(repo.ui, repo)
+        metapath = repo.vfs.join('svn')
+        with open(os.path.join(metapath, 'profile.json')) as f:
+            report = json.load(f)
+        self.assertEqual(report['revisions'], 1)
+        for phase in ('revisions', 'replay', 'commitctx', 'save'):
+            self.assertTrue(report['phases'][phase]['calls'] > 0, phase)
+        with open(os.path.join(metapath, 'profile.csv')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('3,'))
+
+    def test_recyclesize(self):
+        repo, repo_path = self._loadupdate('single_rev.svndump')
+        self.add_svn_rev(repo_path, {'trunk/alpha': 'Changed'})
+        self.add_svn_rev(repo_path, {'trunk/alpha': 'Changed again'})
+        repo.ui.setconfig('hgsubversion', 'profile', True)
+        repo.ui.setconfig('hgsubversion', 'recyclesize', 0)
+        commands.pull(repo.ui, repo)
+        with open(os.path.join(repo.vfs.join('svn'), 'memory.csv')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'revnum,rss,store,editor,revmap,recycled')
+        self.assertEqual([l.split(',')[0] for l in lines[1:]], ['3', '4'])
+        self.assertEqual([l.split(',')[-1] for l in lines[1:]], ['1', '1'])
+        self.assertEqual(len(repo), 4)
+
+    def _corruptpull(self, mode):
+        '''Pull a change to trunk/alpha with a corrupted text delta.
+
+        Return the repository and the recorded checksum errors.
+        '''
+        repo, repo_path = self._loadupdate('single_rev.svndump')
+        self.add_svn_rev(repo_path, {'trunk/alpha': 'Changed'})
+        repo.ui.setconfig('hgsubversion', 'checksummismatch', mode)
+        origapply = svnwrap.apply_txdelta
+        def apply_txdelta(source, target):
+            handler = origapply(source, target)
+            def corrupt(window):
+                handler(window)
+                if window is None:
+                    target.write('corrupted\n')
+            return corrupt
+        svnwrap.apply_txdelta = apply_txdelta
+        try:
+            try:
+                commands.pull(repo.ui, repo)
+            except hgerror.Abort, e:
+                self.assertTrue('checksum mismatch for trunk/alpha' in str(e),
+                                str(e))
+        finally:
+            svnwrap.apply_txdelta = origapply
+        errors = repo.vfs.join('svn', 'checksum_errors')
+        with open(errors) as f:
+            return repo, f.read().splitlines()
+
+    def _checkerrors(self, errors):
+        self.assertEqual(1, len(errors))
+        rev, expected, actual, path = errors[0].split(' ')
+        self.assertEqual(('3', 'trunk/alpha'), (rev, path))
+        self.assertEqual(hashlib.md5('Changed').hexdigest(), expected)
+        self.assertEqual(hashlib.md5('Changedcorrupted\n').hexdigest(),
+                         actual)
+
+    def test_checksummismatch_warn(self):
+        repo, errors = self._corruptpull('warn')
+        self._checkerrors(errors)
+        self.assertEqual('Changedcorrupted\n', repo['tip']['alpha'].data())
+
+    def test_checksummismatch_abort(self):
+        repo, errors = self._corruptpull('abort')
+        self._checkerrors(errors)
+        self.assertEqual(1, test_util.repolen(repo))
+
+    def test_checksummismatch_refetch(self):
+        repo, errors = self._corruptpull('refetch')
+        self._checkerrors(errors)
+        self.assertEqual(2, test_util.repolen(repo))
+        self.assertEqual('Changed', repo['tip']['alpha'].data())
+
     def test_onerevision_noupdate(self):
         repo, repo_path = self._loadupdate('single_rev.svndump')
         state = repo[None].parents()
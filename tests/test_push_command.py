@@ -20,6 +20,8 @@ from mercurial import util as hgutil
 
 from hgsubversion import util
 from hgsubversion import compathacks
+from hgsubversion import pushmod
+from hgsubversion import svnwrap
 
 import time
 
@@ -768,6 +770,154 @@ class PushTests(test_util.TestBase):
         self.assertEqual(util.getsvnrev(commit2),
                          prefix + '/branches/the_branch@5')
 
+    def test_push_two_that_modify_same_file_batched(self):
+        '''
+        A batched push commits both changesets and pulls them back once.
+        '''
+        repo = self.repo
+        repo.ui.setconfig('hgsubversion', 'batchpush', True)
+        pulls = []
+        repo.ui.setconfig('hooks',
+                          'debug-hgsubversion-between-push-and-pull-for-tests',
+                          lambda ui, repo, hooktype: pulls.append(hooktype))
+        oldlen = test_util.repolen(repo)
+
+        self.commitchanges([('gamma', 'gamma', 'sometext')])
+        changes = [('gamma', 'gamma', 'sometext\n moretext'),
+                   ('delta', 'delta', 'sometext\n moretext'),
+                  ]
+        newhash = self.commitchanges(changes)
+
+        hg.update(repo, newhash)
+        commands.push(repo.ui, repo)
+        self.assertEqual(len(pulls), 1)
+        self.assertEqual(test_util.repolen(self.repo), oldlen + 2)
+
+        prefix = 'svn:' + self.repo.svnmeta().uuid
+        ctx = revsymbol(self.repo, 'tip')
+        for files, revnum in ((['delta', 'gamma'], 6), (['gamma'], 5)):
+            self.assertEqual(ctx.files(), files)
+            self.assertEqual(util.getsvnrev(ctx),
+                             prefix + '/branches/the_branch@%d' % revnum)
+            ctx = ctx.parents()[0]
+
+    def test_push_batched_before_empty_ctx(self):
+        '''
+        A batched push stopping at a changeset without changes in
+        Subversion still pulls the changesets committed before it.
+        '''
+        repo = self.repo
+        repo.ui.setconfig('hgsubversion', 'batchpush', True)
+        pulls = []
+        repo.ui.setconfig('hooks',
+                          'debug-hgsubversion-between-push-and-pull-for-tests',
+                          lambda ui, repo, hooktype: pulls.append(hooktype))
+        oldlen = test_util.repolen(repo)
+
+        pushable = self.commitchanges([('gamma', 'gamma', 'sometext')])
+        def file_callback(repo, memctx, path):
+            raise IOError()
+        ctx = context.memctx(repo, (pushable, node.nullid), 'automated test',
+                             [], file_callback, 'an_author',
+                             '2008-10-07 20:59:48 -0500',
+                             {'branch': 'default', })
+        empty = repo.commitctx(ctx)
+
+        hg.update(repo, empty)
+        commands.push(repo.ui, repo)
+        self.assertEqual(len(pulls), 1)
+        self.assertEqual(test_util.repolen(self.repo), oldlen + 1)
+
+        prefix = 'svn:' + self.repo.svnmeta().uuid
+        converted = [self.repo[r] for r in self.repo
+                     if util.getsvnrev(self.repo[r]) ==
+                     prefix + '/branches/the_branch@5']
+        self.assertEqual(1, len(converted))
+        self.assertEqual(['gamma'], converted[0].files())
+        self.assertEqual('sometext', converted[0]['gamma'].data())
+
+    def test_push_batched_after_svn_commit(self):
+        '''
+        A batched push stops when Subversion has a revision unknown
+        locally before the first pushed one.
+        '''
+        repo = self.repo
+        repo.ui.setconfig('hgsubversion', 'batchpush', True)
+        pulls = []
+        repo.ui.setconfig('hooks',
+                          'debug-hgsubversion-between-push-and-pull-for-tests',
+                          lambda ui, repo, hooktype: pulls.append(hooktype))
+        oldlen = test_util.repolen(repo)
+
+        self.commitchanges([('gamma', 'gamma', 'sometext')])
+        newhash = self.commitchanges([('delta', 'delta', 'sometext')])
+        self.add_svn_rev(self.repo_path,
+                         {'branches/the_branch/epsilon': 'racy'})
+
+        hg.update(repo, newhash)
+        commands.push(repo.ui, repo)
+        # the second changeset was pushed on its own, after pulling
+        self.assertEqual(len(pulls), 2)
+        self.assertEqual(test_util.repolen(self.repo), oldlen + 3)
+
+        prefix = 'svn:' + self.repo.svnmeta().uuid
+        ctx = revsymbol(self.repo, 'tip')
+        for files, revnum in ((['delta'], 7), (['gamma'], 6),
+                              (['epsilon'], 5)):
+            self.assertEqual(ctx.files(), files)
+            self.assertEqual(util.getsvnrev(ctx),
+                             prefix + '/branches/the_branch@%d' % revnum)
+            ctx = ctx.parents()[0]
+
+    def test_push_reads_files_lazily(self):
+        '''
+        File contents are read once each, while they are sent.
+        '''
+        reads = []
+        phases = []
+        def data(fctx):
+            if phases:
+                reads.append((fctx.path(), phases[-1]))
+            return origdata(fctx)
+        def wrapcommit(orig, phase):
+            def commit(*args, **kwargs):
+                phases.append(phase)
+                try:
+                    return orig(*args, **kwargs)
+                finally:
+                    phases.pop()
+            return commit
+        origdata = context.filectx.data
+        origcommit = pushmod.commit
+        origsvncommit = svnwrap.SubversionRepo.commit
+        context.filectx.data = data
+        pushmod.commit = wrapcommit(origcommit, 'prepare')
+        svnwrap.SubversionRepo.commit = wrapcommit(origsvncommit, 'send')
+        try:
+            self.commitchanges([('binary', 'binary', 'a\0b'),
+                                ('text', 'text', 'text\n')])
+            self.pushrevisions()
+            self.assertEqual([('binary', 'send'), ('text', 'send')],
+                             sorted(reads))
+            self.assertEqual('application/octet-stream', test_util.svnpropget(
+                self.repo_path, 'branches/the_branch/binary', 'svn:mime-type'))
+            del reads[:]
+            self.commitchanges([('binary', 'binary', 'no longer binary\n'),
+                                ('text', 'text', 'now\0binary')])
+            self.pushrevisions()
+            self.assertEqual([('binary', 'send')] * 2 + [('text', 'send')] * 2,
+                             sorted(reads))
+        finally:
+            context.filectx.data = origdata
+            pushmod.commit = origcommit
+            svnwrap.SubversionRepo.commit = origsvncommit
+
+        for path, mimetype in (('binary', ''),
+                               ('text', 'application/octet-stream')):
+            self.assertEqual(mimetype, test_util.svnpropget(
+                self.repo_path, 'branches/the_branch/' + path,
+                'svn:mime-type'))
+
     def test_push_in_subdir(self, commit=True):
         repo = self.repo
         old_tip = revsymbol(repo, 'tip').node()
@@ -48,6 +48,56 @@ class TestPushDirectories(test_util.TestBase):
         self.assertEqual(test_util.svnls(repo_path, 'trunk'),
                          ['d2', 'd2/b', 'd31', 'd31/d32', 'd31/d32/a', ])
 
+    def test_push_dirs_added_and_removed(self):
+        repo_path = self.load_and_fetch('emptyrepo.svndump')[1]
+
+        changes = [
+            ('d1/a', 'd1/a', 'a\n'),
+            ('d2/a', 'd2/a', 'a\n'),
+            ('d2/b', 'd2/b', 'a\n'),
+            ('d31/d32/a', 'd31/d32/a', 'a\n'),
+            ]
+        self.commitchanges(changes)
+        self.pushrevisions()
+
+        changes = [
+            # Remove a directory
+            ('d1/a', None, None),
+            # Add a directory hierarchy
+            ('d4/d41/a', 'd4/d41/a', 'a\n'),
+            # Replace the files of a directory with a subdirectory
+            ('d2/a', None, None),
+            ('d2/b', 'd2/d21/b', None),
+            ('d2/b', None, None),
+            # Remove a directory hierarchy
+            ('d31/d32/a', None, None),
+            ]
+        self.commitchanges(changes)
+        self.pushrevisions()
+        self.assertEqual(test_util.svnls(repo_path, 'trunk'),
+                         ['d2', 'd2/d21', 'd2/d21/b', 'd4', 'd4/d41',
+                          'd4/d41/a'])
+
+        # The next changeset lists the directories again
+        changes = [
+            ('d4/d41/a', None, None),
+            ('d1/a', 'd1/a', 'a\n'),
+            ]
+        self.commitchanges(changes)
+        self.pushrevisions()
+        self.assertEqual(test_util.svnls(repo_path, 'trunk'),
+                         ['d1', 'd1/a', 'd2', 'd2/d21', 'd2/d21/b'])
+
+        # Replace a file with a directory of the same name
+        changes = [
+            ('d1/a', None, None),
+            ('d1/a/b', 'd1/a/b', 'b\n'),
+            ]
+        self.commitchanges(changes)
+        self.pushrevisions()
+        self.assertEqual(test_util.svnls(repo_path, 'trunk'),
+                         ['d1', 'd1/a', 'd1/a/b', 'd2', 'd2/d21', 'd2/d21/b'])
+
     def test_push_new_dir_project_root_not_repo_root(self):
         repo_path = self.load_and_fetch('fetch_missing_files_subdir.svndump',
                                         subdir='foo')[1]
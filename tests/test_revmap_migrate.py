@@ -1,5 +1,8 @@
 import test_util
 
+import hashlib
+import os
+
 from mercurial import util as hgutil
 from hgsubversion import svnmeta, maps
 from mercurial.node import hex
@@ -70,3 +73,29 @@ class TestRevMapMigrate(test_util.TestBase):
 
     def test_revmap_migrate_down(self):
         self._test_revmap_migrate(maps.SqliteRevMap, maps.RevMap)
+
+    def test_sqlite_prefetch_many(self):
+        path = os.path.join(self.tmpdir, 'rev_map')
+        revmap = maps.SqliteRevMap(path, path + '.lastpulled')
+        items = [(r, None, hashlib.sha1(str(r)).digest())
+                 for r in xrange(1, 1201)]
+        revmap.batchset(items, 1200)
+
+        # old SQLite versions accept at most 999 variables per statement
+        variables = []
+        origquery = revmap._query
+        def query(sql, params=()):
+            variables.append(len(params))
+            self.assertTrue(len(params) <= 999, sql)
+            return origquery(sql, params)
+        revmap._query = query
+
+        hashes = revmap.hashes()
+        missing = hashlib.sha1('missing').digest()
+        hashes.prefetch([ha for r, b, ha in items] + [missing])
+        self.assertEqual([500, 500, 201], variables)
+        del variables[:]
+        for r, b, ha in items:
+            self.assertEqual((r, None), hashes[ha])
+        self.assertFalse(missing in hashes)
+        self.assertEqual([], variables)
@@ -37,6 +37,34 @@ class TestBasicRepoLayout(unittest.TestCase):
         revs = list(self.repo.revisions(start=3))
         self.assertEqual(len(revs), 4)
 
+    def test_commit_netstats(self):
+        if not svnwrap.SubversionRepo.__module__.endswith('subvertpy_wrapper'):
+            # the SWIG bindings count the full text, see svn_swig_wrapper
+            raise test_util.SkipTest('test requires subvertpy')
+        path = 'trunk/netstats'
+        base = ''.join('line %d\n' % i for i in xrange(2000))
+        new = base[:5000] + 'changed\n' + base[5000:] + 'appended\n'
+
+        def commit(base_revision, base_text, new_text, action):
+            before = self.repo.netstats.snapshot()
+            rev = self.repo.commit([path], 'netstats', {
+                path: (lambda: base_text, lambda: new_text, action),
+            }, base_revision, [], [], {}, {})
+            return rev, self.repo.netstats.snapshot(before)['commit']
+
+        added, stats = commit(self.repo.HEAD, '', base, 'add')
+        self.assertEqual(1, stats['calls'])
+        self.assertEqual(len(base), stats['sent'])
+
+        modified, stats = commit(added.revnum, base, new, 'modify')
+        self.assertEqual(added.revnum + 1, modified.revnum)
+        self.assertEqual(1, stats['calls'])
+        # only the new data of the delta windows is counted
+        self.assertTrue(stats['sent'] < 100, stats['sent'])
+        self.assertEqual(sum(len(w[-1]) for w in
+                             svnwrap.txdelta_windows(base, new)),
+                         stats['sent'])
+
 class TestRootAsSubdirOfRepo(TestBasicRepoLayout):
     def setUp(self):
         self.tmpdir = tempfile.mkdtemp('svnwrap_test')
@@ -1,5 +1,6 @@
 import test_util
 
+import os
 import unittest
 
 from mercurial import commands
@@ -17,6 +18,10 @@ try:
 except ImportError:
     revset = None
 
+from hgsubversion import maps
+from hgsubversion import svnmeta
+from hgsubversion import util
+
 class CapturingUI(ui.ui):
 
     def __init__(self, *args, **kwds):
@@ -52,6 +57,50 @@ o
 o
 '''.strip())
 
+    @test_util.requiresmodule(templatekw)
+    def test_svn_keywords_cache(self):
+        defaults = {'date': None, 'rev': None, 'user': None}
+        repo = self._load_fixture_and_fetch('two_revs.svndump')
+        self.commitchanges([('foo', 'foo', 'frobnicate\n')])
+
+        ui = CapturingUI()
+        commands.log(ui, repo, template='{rev}:{svnrev}:{svnpath} ',
+                     **defaults)
+        self.assertEqual(ui._output, '2:: 1:3:/trunk 0:2:/trunk ')
+
+        # the cache is written when the repository is closed, and holds
+        # the same information as the changesets themselves
+        repo.close()
+        cachepath = repo.vfs.join('cache', 'hgsubversion-convertinfo')
+        self.assertTrue(os.path.exists(cachepath))
+        cache = maps.ConvertInfoCache(cachepath)
+        self.assertEqual(len(cache), 3)
+        for ctx in (repo[0], repo[1], repo[2]):
+            self.assertEqual(cache.get(ctx.rev(), ctx.node()),
+                             util.parseconvertinfo(util.getsvnrev(ctx)))
+
+        # entries for stripped changesets aren't reused
+        self.assertRaises(KeyError, cache.get, 2, '\0' * 20)
+
+    @test_util.requiresmodule(templatekw)
+    def test_svn_keywords_recorded(self):
+        defaults = {'date': None, 'rev': None, 'user': None}
+        repo = self._load_fixture_and_fetch('two_revs.svndump')
+
+        # what the changesets record is shown, not what the current
+        # configuration would generate for their revisions
+        def genextra(self, revnum, branch):
+            raise AssertionError('convert_revision should not be generated')
+        origgenextra = svnmeta.SVNMeta.genextra
+        svnmeta.SVNMeta.genextra = genextra
+        try:
+            ui = CapturingUI()
+            commands.log(ui, repo, template='{rev}:{svnrev}:{svnpath} ',
+                         **defaults)
+        finally:
+            svnmeta.SVNMeta.genextra = origgenextra
+        self.assertEqual(ui._output, '1:3:/trunk 0:2:/trunk ')
+
     @test_util.requiresmodule(revset)
     @test_util.requiresmodule(templatekw)
     def test_svn_revsets(self):
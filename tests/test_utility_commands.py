@@ -13,8 +13,10 @@ from mercurial import node
 from mercurial import commands
 from mercurial import util as hgutil
 
+from hgsubversion import maps
 from hgsubversion import util
 from hgsubversion import svncommands
+from hgsubversion import svnmeta
 from hgsubversion import verify
 from hgsubversion import wrappers
 from hgsubversion import compathacks
@@ -294,6 +296,53 @@ class UtilityTests(test_util.TestBase):
     def test_genignore_custom(self):
         self.test_genignore(layout='custom')
 
+    def test_svn_update(self):
+        repo, repo_path = self.load_and_fetch('two_heads.svndump')
+        branchtip = revsymbol(repo, 'the_branch').node()
+        self.assertNotEqual(branchtip, repo[None].p1().node())
+        svncommands.update(self.ui(), ['5'], repo)
+        self.assertEqual(branchtip, repo[None].p1().node())
+        hg.update(repo, revsymbol(repo, 'default').node())
+        svncommands.update(self.ui(), ['5', 'the_branch'], repo)
+        self.assertEqual(branchtip, repo[None].p1().node())
+        self.assertEqual(1, svncommands.update(self.ui(), ['5', 'default'],
+                                               repo))
+        self.assertEqual(1, svncommands.update(self.ui(), ['42'], repo))
+
+    def test_svnmeta_cache(self):
+        repo, repo_path = self.load_and_fetch('two_heads.svndump')
+        meta = repo.svnmeta()
+        meta.layout
+        meta = repo.svnmeta()
+        self.assertTrue(meta is repo.svnmeta())
+        self.assertFalse(meta is repo.svnmeta(skiperrorcheck=True))
+        meta.revmap[42, None] = '\0' * 20
+        self.assertFalse(meta is repo.svnmeta())
+
+    def test_svnmeta_options_migration(self):
+        repo, commit = self._convertedrepo()
+        metapath = repo.vfs.join('svn')
+        util.dump('single', os.path.join(metapath, 'layout'))
+        util.dump(False, os.path.join(metapath, 'usebranchnames'))
+
+        meta = svnmeta.SVNMeta(repo)
+        self.assertEqual('single', meta.layout)
+        self.assertEqual(False, meta.usebranchnames)
+        self.assertEqual('', meta.defaultmessage)
+        # values moved to the options file are removed from legacy ones
+        self.assertFalse(os.path.exists(os.path.join(metapath, 'layout')))
+        self.assertFalse(os.path.exists(os.path.join(metapath,
+                                                     'usebranchnames')))
+
+        # reading the values back does not write them again
+        optionsfile = os.path.join(metapath, 'options')
+        os.utime(optionsfile, (0, 0))
+        meta = svnmeta.SVNMeta(repo)
+        self.assertEqual('single', meta.layout)
+        self.assertEqual(False, meta.usebranchnames)
+        self.assertEqual('', meta.defaultmessage)
+        self.assertEqual(0, os.stat(optionsfile).st_mtime)
+
     def test_list_authors(self):
         repo_path = self.load_svndump('replace_trunk_with_branch.svndump')
         u = self.ui()
@@ -312,6 +361,21 @@ class UtilityTests(test_util.TestBase):
                                 authors=author_path)
         self.assertMultiLineEqual(open(author_path).read(), 'Augie=\nevil=\n')
 
+    def test_netstats(self):
+        repo, repo_path = self.load_and_fetch('two_heads.svndump')
+        stats = util.readnetstats(repo.vfs.join('svn'))
+        self.assertTrue(stats['get_log']['calls'] > 0)
+        self.assertEqual(sum(stats['get_log']['histogram']),
+                         stats['get_log']['calls'])
+        u = self.ui()
+        u.pushbuffer()
+        svncommands.netstats(u, repo)
+        actual = u.popbuffer()
+        self.assertTrue(re.search(r'^get_log +\d+ calls', actual, re.M),
+                        actual)
+        self.assertTrue(re.search(r'^total +\d+ calls', actual, re.M),
+                        actual)
+
     def test_svnverify(self):
         repo, repo_path = self.load_and_fetch('binaryfiles.svndump',
                                               noupdate=False)
@@ -332,6 +396,51 @@ unexpected file: binary1
 missing file: binary3
 """, output)
 
+    def test_svnverify_revisions(self):
+        repo, repo_path = self.load_and_fetch('two_heads.svndump')
+        revs = [r for r in repo if 'close' not in repo[r].extra()]
+        u = self.ui()
+        u.pushbuffer()
+        ret = verify.verify(u, repo, [], rev=['fromsvn()'])
+        output = u.popbuffer()
+        self.assertEqual(0, ret)
+        self.assertEqual(len(revs), output.count('verifying '))
+
+        # verified revisions are recorded and skipped
+        u.pushbuffer()
+        ret = verify.verify(u, repo, [], rev=['fromsvn()'])
+        output = u.popbuffer()
+        self.assertEqual(0, ret)
+        self.assertEqual(0, output.count('verifying '))
+        u.pushbuffer()
+        ret = verify.verify(u, repo, [], rev=['fromsvn()'], force=True)
+        output = u.popbuffer()
+        self.assertEqual(0, ret)
+        self.assertEqual(len(revs), output.count('verifying '))
+
+        # the watermark holds the changeset hash and its svn revision
+        with open(repo.vfs.join('svn/verified')) as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            n, svnrev = line.split(' ')
+            self.assertEqual(util.getsvnrev(repo[n]).rsplit('@', 1)[1],
+                             svnrev)
+
+    def test_svnverify_revisions_sqlite(self):
+        # forked workers open their own sqlite revmap connection
+        repo, repo_path = self.load_and_fetch(
+            'two_heads.svndump',
+            config={'hgsubversion.revmapimpl': 'sqlite',
+                    'worker.numcpus': '4'})
+        revs = [r for r in repo if 'close' not in repo[r].extra()]
+        u = self.ui()
+        u.setconfig('worker', 'numcpus', '4')
+        u.pushbuffer()
+        ret = verify.verify(u, repo, [], rev=['fromsvn()'])
+        output = u.popbuffer()
+        self.assertEqual(0, ret)
+        self.assertEqual(len(revs), output.count('verifying '))
+
     def test_corruption(self):
         SUCCESS = 0
         FAILURE = 1
@@ -367,6 +476,15 @@ missing file: binary3
 
         self.assertEqual((FAILURE, expected), (code, actual))
 
+        ui.pushbuffer()
+        code = verify.verify(ui, repo, rev='tip', checksum=True)
+        actual = ui.popbuffer()
+
+        actual = actual.replace(corrupt_source, '$REPO')
+        actual = set(actual.splitlines())
+
+        self.assertEqual((FAILURE, expected), (code, actual))
+
     def test_svnrebuildmeta(self):
         otherpath = self.load_svndump('binaryfiles-broken.svndump')
         otherurl = test_util.fileurl(otherpath)
@@ -380,3 +498,243 @@ missing file: binary3
         # rebuildmeta --unsafe-skip-uuid-check with unrelated repo
         svncommands.rebuildmeta(self.ui(), repo=self.repo, args=[otherurl],
                                 unsafe_skip_uuid_check=True)
+
+    def _commitconverted(self, repo, p1, files, path, revnum,
+                         branch='default', close=False):
+        '''Commit files as if converted from path@revnum; return its hex.'''
+        uuid = 'df2126f7-00ab-4d49-b42c-7e981dde0bcf'
+        extra = {'branch': branch,
+                 'convert_revision': 'svn:%s/%s@%d' % (uuid, path, revnum)}
+        if close:
+            extra['close'] = '1'
+        def filectxfn(repo, memctx, path):
+            if files[path] is None:
+                return None
+            return compathacks.makememfilectx(repo,
+                                              memctx=memctx,
+                                              path=path,
+                                              data=files[path],
+                                              islink=False,
+                                              isexec=False,
+                                              copied=False)
+        ctx = context.memctx(repo,
+                             (node.bin(p1), revlog.nullid),
+                             'r%d' % revnum,
+                             list(files),
+                             filectxfn,
+                             'testy',
+                             '2008-12-21 16:32:00 -0500',
+                             extra)
+        return node.hex(repo.commitctx(ctx))
+
+    def _convertedrepo(self):
+        repo = hg.repository(self.ui(), self.wc_path, create=True)
+        metapath = repo.vfs.join('svn')
+        os.mkdir(metapath)
+        util.dump('df2126f7-00ab-4d49-b42c-7e981dde0bcf',
+                  os.path.join(metapath, 'uuid'))
+        util.dump('', os.path.join(metapath, 'subdir'))
+        commit = lambda *args, **kwargs: self._commitconverted(repo, *args,
+                                                               **kwargs)
+        return repo, commit
+
+    def _readmeta(self, repo, names):
+        meta = {}
+        for name in names:
+            with open(repo.vfs.join('svn', name), 'rb') as f:
+                meta[name] = f.read()
+        return meta
+
+    def test_svnrebuildmeta_tags(self):
+        repo, commit = self._convertedrepo()
+        t1 = commit(node.nullhex, {'a': 'a\n'}, 'trunk', 1)
+        t2 = commit(t1, {'.hgtags': '%s tag1\n' % t1}, 'trunk', 2)
+        tags2 = '%s tag1\n%s tag2\n' % (t1, t2)
+        t3 = commit(t2, {'.hgtags': tags2}, 'trunk', 3)
+        # same .hgtags revision as t3, whose changeset is its linkrev
+        commit(t2, {'.hgtags': tags2}, 'branches/foo', 4, 'foo')
+        # rewrites tag1: only the appended text is taken into account
+        commit(t3, {'.hgtags': '%s tag1\n%s tag2\n%s tag3\n' % (t2, t2, t3)},
+               'trunk', 5)
+
+        appended = []
+        origappendedtags = svncommands._appendedtags
+        def appendedtags(repo, ctx):
+            newdata = origappendedtags(repo, ctx)
+            appended.append((ctx.rev(), newdata))
+            return newdata
+        svncommands._appendedtags = appendedtags
+        try:
+            svncommands.rebuildmeta(self.ui(), repo, args=[],
+                                    unsafe_skip_uuid_check=True)
+        finally:
+            svncommands._appendedtags = origappendedtags
+
+        self.assertEqual([(1, '%s tag1\n' % t1),
+                          (2, '%s tag2\n' % t2),
+                          (3, '%s tag2\n' % t2),
+                          (4, None)], appended)
+        self.assertEqual({'tagmap': ''.join(['2\n',
+                                             '%s 2 tag1\n' % t1,
+                                             '%s 3 tag2\n' % t2,
+                                             '%s 4 tag2\n' % t2,
+                                             '%s 5 tag3\n' % t3])},
+                         self._readmeta(repo, ['tagmap']))
+
+    def test_svnrebuildmeta_closed_branches(self):
+        repo, commit = self._convertedrepo()
+        t1 = commit(node.nullhex, {'a': 'a\n'}, 'trunk', 1)
+        t2 = commit(t1, {'a': 'a2\n'}, 'trunk', 2)
+        f1 = commit(t2, {'b': 'b\n'}, 'branches/foo', 3, 'foo')
+        f2 = commit(f1, {'b': 'b2\n'}, 'branches/foo', 4, 'foo')
+        commit(f2, {}, 'branches/foo', 5, 'foo', close=True)
+        t3 = commit(t2, {'.hgtags': '%s tag1\n' % t2}, 'trunk', 6)
+        t4 = commit(t3, {'.hgtags': '%s tag1\n%s tag2\n' % (t2, t3)},
+                    'trunk', 7)
+        b1 = commit(t4, {'c': 'c\n'}, 'branches/bar', 8, 'bar')
+        b2 = commit(b1, {'c': None}, 'branches/bar', 9, 'bar', close=True)
+        t5 = commit(t4, {'.hgtags': '%s tag1\n%s tag2\n%s tag4\n'
+                         % (t1, t3, f2)}, 'trunk', 10)
+        r1 = commit(t5, {'g': 'g\n'}, 'tags/rel', 11, 'rel')
+        commit(r1, {}, 'tags/rel', 12, 'rel', close=True)
+        z1 = commit(t5, {'d': 'd\n'}, 'branches/baz', 13, 'baz')
+        t6 = commit(t5, {'a': 'a3\n',
+                         '.hgtags': '%s tag1\n%s tag2\n%s tag4\n%s tag3\n'
+                         % (t1, t3, f2, z1)}, 'trunk', 14)
+        z2 = commit(z1, {'d': 'd2\n'}, 'branches/baz', 15, 'baz')
+        commit(z2, {}, 'branches/baz', 16, 'baz', close=True)
+        q1 = commit(t6, {'q': 'q\n'}, 'branches/qux', 17, 'qux')
+        q2 = commit(q1, {'q': 'q2\n'}, 'branches/qux', 18, 'qux')
+
+        # the metadata written when rebuilding from changectx objects
+        expected = {
+            'branch_info': '{"": [null, 0, 1], "qux": [null, 14, 17]}',
+            'lastpulled': '18',
+            'rev_map': ''.join(['1\n',
+                                '1 %s \n' % t1,
+                                '2 %s \n' % t2,
+                                '3 %s foo\n' % f1,
+                                '4 %s foo\n' % f2,
+                                '6 %s \n' % t3,
+                                '7 %s \n' % t4,
+                                '8 %s bar\n' % b1,
+                                '9 %s bar\n' % b2,
+                                '10 %s \n' % t5,
+                                '11 %s ../tags/rel\n' % r1,
+                                '13 %s baz\n' % z1,
+                                '14 %s \n' % t6,
+                                '15 %s baz\n' % z2,
+                                '17 %s qux\n' % q1,
+                                '18 %s qux\n' % q2]),
+            'tagmap': ''.join(['2\n',
+                               '%s 6 tag1\n' % t2,
+                               '%s 7 tag2\n' % t3,
+                               '%s 10 tag4\n' % f2,
+                               '%s 14 tag3\n' % z1]),
+        }
+
+        u = self.ui()
+        svncommands.rebuildmeta(u, repo, args=[], unsafe_skip_uuid_check=True)
+        self.assertEqual(expected, self._readmeta(repo, expected))
+
+        # decode the changesets through worker processes
+        origparallel = svncommands._PARALLELREBUILD
+        svncommands._PARALLELREBUILD = 0
+        try:
+            u.setconfig('worker', 'numcpus', 4)
+            svncommands.rebuildmeta(u, repo, args=[],
+                                    unsafe_skip_uuid_check=True)
+        finally:
+            svncommands._PARALLELREBUILD = origparallel
+        self.assertEqual(expected, self._readmeta(repo, expected))
+
+    def _commitlocal(self, repo, parents, data):
+        def filectxfn(repo, memctx, path):
+            return compathacks.makememfilectx(repo,
+                                              memctx=memctx,
+                                              path=path,
+                                              data=data,
+                                              islink=False,
+                                              isexec=False,
+                                              copied=False)
+        ctx = context.memctx(repo,
+                             parents,
+                             'local change',
+                             ['a'],
+                             filectxfn,
+                             'testy',
+                             '2008-12-21 16:32:00 -0500',
+                             {'branch': 'default'})
+        return repo.commitctx(ctx)
+
+    def _revmaps(self):
+        """Yield a dict-based and an sqlite-based revmap."""
+        for cls in (maps.RevMap, maps.SqliteRevMap):
+            path = os.path.join(self.tmpdir, cls.__name__)
+            yield cls(path, path + '.lastpulled')
+
+    def _svnancestor(self, repo, revmap, sourcerev):
+        """Call util._svnancestor on the reverse map of revmap.
+
+        Return its result and the sizes of the prefetched batches, or None
+        if the reverse map cannot prefetch.
+        """
+        reverse_map = revmap.hashes()
+        batches = None
+        if hasattr(reverse_map, 'prefetch'):
+            batches = []
+            origprefetch = reverse_map.prefetch
+            def prefetch(keys):
+                batches.append(len(keys))
+                return origprefetch(keys)
+            reverse_map.prefetch = prefetch
+        return util._svnancestor(repo, reverse_map, sourcerev), batches
+
+    def test_svnancestor_linear(self):
+        repo = hg.repository(self.ui(), self.wc_path, create=True)
+        nodes = []
+        with repo.lock():
+            for i in xrange(1600):
+                nodes.append(self._commitlocal(
+                    repo, (nodes and nodes[-1] or revlog.nullid,
+                           revlog.nullid), str(i)))
+
+        # batches grow from 16 changesets up to 512
+        expectedbatches = [16, 32, 64, 128, 256, 512, 512, 80]
+        for revmap in self._revmaps():
+            result, batches = self._svnancestor(repo, revmap, nodes[-1])
+            self.assertEqual((nodes[::-1], None), result)
+            if isinstance(revmap, maps.SqliteRevMap):
+                self.assertEqual(expectedbatches, batches)
+            else:
+                self.assertEqual(None, batches)
+
+            revmap[(1, None)] = nodes[100]
+            result, batches = self._svnancestor(repo, revmap, nodes[-1])
+            self.assertEqual((nodes[:100:-1], nodes[100]), result)
+            if isinstance(revmap, maps.SqliteRevMap):
+                self.assertEqual(expectedbatches[:7], batches)
+
+    def test_svnancestor_merge(self):
+        repo = hg.repository(self.ui(), self.wc_path, create=True)
+        null = revlog.nullid
+        with repo.lock():
+            root = self._commitlocal(repo, (null, null), 'root')
+            svn = self._commitlocal(repo, (root, null), 'svn')
+            other = self._commitlocal(repo, (root, null), 'other')
+            merge = self._commitlocal(repo, (svn, other), 'merge')
+            child = self._commitlocal(repo, (merge, null), 'child')
+            tip = self._commitlocal(repo, (child, null), 'tip')
+
+        for revmap in self._revmaps():
+            revmap[(1, None)] = svn
+            # the walk stops at the merge, which is not converted
+            self.assertRaises(hgerror.Abort,
+                              self._svnancestor, repo, revmap, tip)
+
+            # a converted merge is found before its parents are looked at
+            revmap[(2, None)] = merge
+            result, batches = self._svnancestor(repo, revmap, tip)
+            self.assertEqual(([tip, child], merge), result)
+            if isinstance(revmap, maps.SqliteRevMap):
+                self.assertEqual([3], batches)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""End-to-end benchmarks over synthetic Subversion repositories.
+
+A Subversion dumpfile is generated from a fixed seed and loaded with
+svnwrap.create_and_load, so every run converts exactly the same history.
+The history has a wide trunk, branches, tags, binary files and a chain of
+file copies. Each phase then runs as a separate hg process against the
+file:// URL:
+
+  clone       full clone of the repository
+  pull        incremental pull of the second half of the history
+  stupidpull  the same pull with --stupid
+  push        push of locally committed changesets
+  rebuildmeta 'hg svn rebuildmeta' on the full clone
+  verify      'hg svn verify' of the working copy parent
+  revsets     fromsvn() and svnrev() evaluation, and {svnrev} output
+
+Results are printed as JSON: wall-clock seconds, revisions per second and
+peak RSS for each phase. Passing the JSON of an earlier run with
+--compare prints the ratio for each phase, and exits with status 1 if
+any phase got slower than the --threshold.
+
+usage: bench-e2e.py [options] > results.json
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hgsubversion import svnwrap
+
+UUID = '7a6e6b5c-1b4e-4a59-9d3e-6b3c1c0c1e5f'
+
+def _props(props):
+    out = []
+    for k, v in props:
+        out.append('K %d\n%s\nV %d\n%s\n' % (len(k), k, len(v), v))
+    out.append('PROPS-END\n')
+    return ''.join(out)
+
+class DumpWriter(object):
+    """Write a version 2 Subversion dumpfile."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.rev = 0
+        fp.write('SVN-fs-dump-format-version: 2\n\nUUID: %s\n\n' % UUID)
+        self._revision([('svn:date', self._date(0))])
+
+    def _date(self, rev):
+        # one revision a minute, starting 2010-01-01
+        t = time.gmtime(1262304000 + 60 * rev)
+        return time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', t)
+
+    def _revision(self, props):
+        body = _props(props)
+        self.fp.write('Revision-number: %d\nProp-content-length: %d\n'
+                      'Content-length: %d\n\n%s\n'
+                      % (self.rev, len(body), len(body), body))
+
+    def revision(self, log):
+        self.rev += 1
+        self._revision([('svn:author', 'bench'), ('svn:date',
+                         self._date(self.rev)), ('svn:log', log)])
+
+    def node(self, path, kind, action, text=None, props=None,
+             copyfrom=None):
+        headers = ['Node-path: %s' % path]
+        if kind:
+            headers.append('Node-kind: %s' % kind)
+        headers.append('Node-action: %s' % action)
+        if copyfrom:
+            headers.append('Node-copyfrom-rev: %d' % copyfrom[1])
+            headers.append('Node-copyfrom-path: %s' % copyfrom[0])
+        propdata = ''
+        if props is not None:
+            propdata = _props(props)
+            headers.append('Prop-content-length: %d' % len(propdata))
+        if text is not None:
+            headers.append('Text-content-length: %d' % len(text))
+            headers.append('Text-content-md5: %s'
+                           % hashlib.md5(text).hexdigest())
+        if props is not None or text is not None:
+            headers.append('Content-length: %d'
+                           % (len(propdata) + len(text or '')))
+        self.fp.write('\n'.join(headers) + '\n\n')
+        self.fp.write(propdata)
+        if text is not None:
+            self.fp.write(text)
+        self.fp.write('\n\n')
+
+def _text(path, rev, lines):
+    return ''.join('%s line %d\n' % (path, i) for i in range(lines)) + (
+        'changed in r%d\n' % rev)
+
+def generate(fp, opts):
+    """Write the synthetic history to fp and return its revision count."""
+    rng = random.Random(opts.seed)
+    dump = DumpWriter(fp)
+    binprops = [('svn:mime-type', 'application/octet-stream')]
+
+    files = ['d%d/f%d' % (i // 50, i) for i in range(opts.width)]
+    dirs = sorted(set(f.split('/')[0] for f in files))
+
+    dump.revision('initial layout')
+    for d in ['trunk', 'branches', 'tags', 'trunk/chain', 'trunk/bin']:
+        dump.node(d, 'dir', 'add', props=[])
+    for d in dirs:
+        dump.node('trunk/' + d, 'dir', 'add', props=[])
+    for f in files:
+        dump.node('trunk/' + f, 'file', 'add', props=[],
+                  text=_text(f, 1, opts.lines))
+    dump.node('trunk/chain/c0', 'file', 'add', props=[],
+              text=_text('chain', 1, opts.lines))
+    if opts.binary_size:
+        dump.node('trunk/bin/blob', 'file', 'add', props=binprops,
+                  text=_randbytes(rng, opts.binary_size))
+
+    def spread(count):
+        if not count:
+            return set()
+        step = max(1, (opts.revisions - 1) // (count + 1))
+        return set(2 + step * (i + 1) for i in range(count))
+
+    branchrevs = spread(opts.branches)
+    tagrevs = spread(opts.tags)
+    branches = []
+    chain = 0
+    while dump.rev < opts.revisions:
+        rev = dump.rev + 1
+        if rev in branchrevs:
+            name = 'branches/b%d' % len(branches)
+            dump.revision('create %s' % name)
+            dump.node(name, 'dir', 'add', copyfrom=('trunk', rev - 1))
+            branches.append(name)
+        elif rev in tagrevs:
+            name = 'tags/t%d' % rev
+            dump.revision('create %s' % name)
+            dump.node(name, 'dir', 'add', copyfrom=('trunk', rev - 1))
+        elif chain < opts.copy_depth and rev % 3 == 0:
+            dump.revision('copy chain step %d' % chain)
+            dump.node('trunk/chain/c%d' % (chain + 1), 'file', 'add',
+                      copyfrom=('trunk/chain/c%d' % chain, rev - 1),
+                      text=_text('chain', rev, opts.lines))
+            chain += 1
+        elif (opts.binary_size and opts.binary_every
+              and rev % opts.binary_every == 0):
+            dump.revision('update binary')
+            dump.node('trunk/bin/blob', 'file', 'change',
+                      text=_randbytes(rng, opts.binary_size))
+        else:
+            base = 'trunk'
+            if branches and rng.random() < 0.3:
+                base = rng.choice(branches)
+            dump.revision('edit %s' % base)
+            for f in sorted(rng.sample(files, min(len(files),
+                                                  rng.randint(1, 3)))):
+                dump.node('%s/%s' % (base, f), 'file', 'change',
+                          text=_text(f, rev, opts.lines))
+    return dump.rev
+
+def _randbytes(rng, size):
+    return ('%0*x' % (size * 2, rng.getrandbits(size * 8))).decode('hex')
+
+class Runner(object):
+    def __init__(self, opts, workdir):
+        self.opts = opts
+        self.workdir = workdir
+        self.env = dict(os.environ, HGRCPATH=os.devnull, LC_ALL='C',
+                        HGPLAIN='1')
+        self.results = {}
+
+    def hg(self, args, cwd=None, phase=None, revs=None):
+        cmd = [self.opts.hg, '--config',
+               'extensions.hgsubversion=%s' % os.path.join(ROOT,
+                                                           'hgsubversion'),
+               '--config', 'ui.username=bench',
+               '--config', 'extensions.strip='] + args
+        devnull = open(os.devnull, 'w')
+        try:
+            start = time.time()
+            proc = subprocess.Popen(cmd, cwd=cwd or self.workdir,
+                                    env=self.env, stdout=devnull)
+            pid, status, usage = os.wait4(proc.pid, 0)
+            elapsed = time.time() - start
+        finally:
+            devnull.close()
+        if status:
+            raise SystemExit('command failed: %s' % ' '.join(cmd))
+        if phase is not None:
+            result = self.results.setdefault(phase, {
+                'seconds': 0.0, 'maxrss_kb': 0, 'steps': {}})
+            result['seconds'] += elapsed
+            result['maxrss_kb'] = max(result['maxrss_kb'], usage.ru_maxrss)
+            result['steps'][' '.join(args)] = round(elapsed, 4)
+            if revs:
+                result['revs'] = result.get('revs', 0) + revs
+                result['revs_per_sec'] = round(result['revs'] /
+                                               result['seconds'], 2)
+        return elapsed
+
+    def record(self, phase, elapsed, revs=None):
+        result = {'seconds': elapsed}
+        if revs:
+            result['revs'] = revs
+            result['revs_per_sec'] = round(revs / elapsed, 2)
+        self.results[phase] = result
+
+def run(opts):
+    workdir = tempfile.mkdtemp(prefix='hgsubversion-bench-')
+    try:
+        runner = Runner(opts, workdir)
+        svnpath = os.path.join(workdir, 'svnrepo')
+        url = 'file://' + svnpath
+        dumppath = os.path.join(workdir, 'bench.svndump')
+
+        start = time.time()
+        with open(dumppath, 'wb') as f:
+            revisions = generate(f, opts)
+        runner.record('generate', time.time() - start)
+
+        start = time.time()
+        svnwrap.create_and_load(svnpath, open(dumppath, 'rb'))
+        runner.record('load', time.time() - start, revisions)
+
+        half = revisions // 2
+        runner.hg(['clone', '--noupdate', '--quiet', url, 'full'],
+                  phase='clone', revs=revisions)
+
+        for phase, extra in (('pull', []), ('stupidpull', ['--stupid'])):
+            dest = 'partial-' + phase
+            runner.hg(['clone', '--noupdate', '--quiet', '--rev=%d' % half,
+                       url, dest] + extra)
+            runner.hg(['pull', '--quiet'] + extra,
+                      cwd=os.path.join(workdir, dest),
+                      phase=phase, revs=revisions - half)
+
+        full = os.path.join(workdir, 'full')
+        runner.hg(['update', '--quiet', 'default'], cwd=full)
+        for i in range(opts.push):
+            with open(os.path.join(full, 'd0', 'f0'), 'a') as f:
+                f.write('pushed change %d\n' % i)
+            runner.hg(['commit', '--quiet', '-m', 'push %d' % i], cwd=full)
+        runner.hg(['push', '--quiet'], cwd=full, phase='push',
+                  revs=opts.push)
+
+        runner.hg(['svn', 'rebuildmeta'], cwd=full, phase='rebuildmeta',
+                  revs=revisions)
+        runner.hg(['svn', 'verify'], cwd=full, phase='verify')
+
+        for args in (['log', '-r', 'fromsvn()', '-T', '{node}\n'],
+                     ['log', '-r', 'svnrev(%d)' % half, '-T', '{node}\n'],
+                     ['log', '-T', '{svnrev}\n']):
+            runner.hg(args, cwd=full, phase='revsets')
+
+        for result in runner.results.itervalues():
+            result['seconds'] = round(result['seconds'], 4)
+        return {
+            'version': 1,
+            'parameters': dict((k, getattr(opts, k)) for k in PARAMETERS),
+            'revisions': revisions,
+            'phases': runner.results,
+        }
+    finally:
+        if opts.keep:
+            sys.stderr.write('kept %s\n' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+def compare(baseline, current, threshold):
+    """Print per-phase ratios; return True if any phase regressed."""
+    if baseline.get('parameters') != current['parameters']:
+        sys.stderr.write('warning: baseline used different parameters\n')
+    regressed = False
+    for phase in sorted(current['phases']):
+        new = current['phases'][phase]['seconds']
+        old = baseline.get('phases', {}).get(phase, {}).get('seconds')
+        if not old:
+            continue
+        ratio = new / old
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        sys.stderr.write('%-12s %8.3fs -> %8.3fs  x%.2f%s\n'
+                         % (phase, old, new, ratio, flag))
+    return regressed
+
+PARAMETERS = ['seed', 'revisions', 'width', 'lines', 'branches', 'tags',
+              'binary_size', 'binary_every', 'copy_depth', 'push']
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] > results.json')
+    parser.add_option('--hg', default='hg', help='hg executable to run')
+    parser.add_option('--seed', type='int', default=1,
+                      help='random seed for the generated history [1]')
+    parser.add_option('--revisions', type='int', default=500,
+                      help='number of svn revisions [500]')
+    parser.add_option('--width', type='int', default=1000,
+                      help='number of files on trunk [1000]')
+    parser.add_option('--lines', type='int', default=20,
+                      help='lines per text file [20]')
+    parser.add_option('--branches', type='int', default=10,
+                      help='number of branches [10]')
+    parser.add_option('--tags', type='int', default=10,
+                      help='number of tags [10]')
+    parser.add_option('--binary-size', type='int', default=1 << 20,
+                      help='size of the binary file in bytes [1MB]')
+    parser.add_option('--binary-every', type='int', default=25,
+                      help='revisions between binary changes [25]')
+    parser.add_option('--copy-depth', type='int', default=50,
+                      help='length of the file copy chain [50]')
+    parser.add_option('--push', type='int', default=10,
+                      help='number of changesets to push [10]')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare against an earlier JSON result')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='slowdown ratio reported as regression [0.1]')
+    parser.add_option('--keep', action='store_true',
+                      help="don't delete the working directory")
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('unexpected arguments')
+
+    results = run(opts)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, opts.threshold):
+            return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""Microbenchmarks for the data structures in hgsubversion.maps.
+
+Each structure is built at every requested size, from generated data with
+a fixed seed, and the following operations are timed:
+
+  revmap, sqliterevmap
+      load, lookup, hashes (building the reverse map), reverse,
+      branchedits, branchmaxrevnum, batchset; plus migrate (v1 to
+      SQLite) for sqliterevmap
+  tags            load, lookup, set
+  authormap       load, lookup (exact entries), regex (pattern entries),
+                  default (unknown authors)
+  branchmap, tagmap
+                  load, lookup
+  filemap         load, check
+
+Every structure and size runs in a forked process. The reported memory
+figures are RSS deltas in that process. Lookups run until every sampled
+key is done or until --budget seconds have passed, so the slow linear
+maps still finish.
+
+The regular-expression maps (authormap, branchmap, tagmap) compare
+every entry on each load and lookup. They are skipped above
+--max-regex-size unless that limit is raised.
+
+Results are printed as JSON. As with bench-e2e.py, --compare prints
+per-operation ratios against an earlier run.
+
+usage: bench-maps.py [options] > results.json
+"""
+
+import hashlib
+import json
+import optparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mercurial import ui as uimod
+from hgsubversion import maps
+
+def _rsskb(field='VmRSS'):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class Case(object):
+    """Collect timings and memory deltas for one structure and size."""
+
+    def __init__(self, opts, tmpdir, size):
+        self.opts = opts
+        self.tmpdir = tmpdir
+        self.size = size
+        self.rng = random.Random(opts.seed)
+        self.results = {}
+        self.ui = uimod.ui()
+        self.ui.setconfig('ui', 'quiet', True)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def once(self, op, fn, count=1):
+        """Time a single call of fn that handles count entries."""
+        rss = _rsskb()
+        start = time.time()
+        result = fn()
+        elapsed = time.time() - start
+        self._record(op, elapsed, count, rss)
+        return result
+
+    def each(self, op, fn, args):
+        """Time fn over args, stopping early when the budget runs out."""
+        rss = _rsskb()
+        budget = self.opts.budget
+        done = 0
+        start = time.time()
+        for arg in args:
+            fn(arg)
+            done += 1
+            if not done % 16 and time.time() - start > budget:
+                break
+        self._record(op, time.time() - start, done, rss)
+
+    def _record(self, op, elapsed, count, rss):
+        self.results[op] = {
+            'seconds': round(elapsed, 6),
+            'count': count,
+            'usec_per_op': round(elapsed * 1e6 / max(count, 1), 3),
+            'rss_delta_kb': _rsskb() - rss,
+        }
+
+    def sample(self, population):
+        return self.rng.sample(population, min(self.opts.ops,
+                                               len(population)))
+
+def _node(i):
+    return hashlib.sha1(str(i)).digest()
+
+def _revmapentries(size):
+    """Return (revnum, branch, node) triples spread over a few branches."""
+    nbranches = max(1, size // 1000)
+    branches = [None] + ['branch%d' % i for i in range(1, nbranches)]
+    return [(i + 1, branches[i % nbranches], _node(i)) for i in xrange(size)]
+
+def _writerevmap(path, entries):
+    with open(path, 'w') as f:
+        f.write('%d\n' % maps.RevMap.VERSION)
+        for revnum, branch, node in entries:
+            f.write('%d %s %s\n' % (revnum, node.encode('hex'),
+                                    branch or ''))
+
+def _revmapops(case, revmap, entries):
+    keys = case.sample(entries)
+    case.each('lookup', lambda e: revmap[(e[0], e[1])], keys)
+    hashes = case.once('hashes', revmap.hashes)
+    case.each('reverse', lambda e: hashes[e[2]], keys)
+    scans = keys[:case.opts.scans]
+    case.each('branchedits', lambda e: revmap.branchedits(e[1], e[0]),
+              scans)
+    case.each('branchmaxrevnum',
+              lambda e: revmap.branchmaxrevnum(e[1], e[0]), scans)
+
+def bench_revmap(case):
+    entries = _revmapentries(case.size)
+    path, lastpulled = case.path('rev_map'), case.path('lastpulled')
+    _writerevmap(path, entries)
+    revmap = case.once('load', lambda: maps.RevMap(path, lastpulled),
+                       len(entries))
+    _revmapops(case, revmap, entries)
+
+    fresh = maps.RevMap(case.path('rev_map.new'), lastpulled)
+    case.once('batchset', lambda: fresh.batchset(entries, len(entries)),
+              len(entries))
+
+def bench_sqliterevmap(case):
+    entries = _revmapentries(case.size)
+    path, lastpulled = case.path('rev_map'), case.path('lastpulled')
+    _writerevmap(path, entries)
+    case.once('migrate', lambda: maps.SqliteRevMap(path, lastpulled),
+              len(entries))
+    revmap = case.once('load', lambda: maps.SqliteRevMap(path, lastpulled),
+                       len(entries))
+    _revmapops(case, revmap, entries)
+
+    fresh = maps.SqliteRevMap(case.path('rev_map.new'), lastpulled)
+    case.once('batchset', lambda: fresh.batchset(entries, len(entries)),
+              len(entries))
+
+def bench_tags(case):
+    path = case.path('tagmap')
+    tags = ['tag%d' % i for i in xrange(case.size)]
+    with open(path, 'w') as f:
+        f.write('%d\n' % maps.Tags.VERSION)
+        for i, tag in enumerate(tags):
+            f.write('%s %d %s\n' % (_node(i).encode('hex'), i + 1, tag))
+    tagmap = case.once('load', lambda: maps.Tags(case.ui, path),
+                       case.size)
+    case.each('lookup', lambda t: tagmap[t], case.sample(tags))
+    newtags = ['new%d' % i for i in xrange(case.opts.ops)]
+    case.each('set', lambda t: tagmap.__setitem__(t, (_node(t), 1)),
+              newtags)
+
+def _writebasemap(path, lines):
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+def bench_authormap(case):
+    path = case.path('authors')
+    nregex = max(1, case.size // 10)
+    plain = ['user%d' % i for i in xrange(case.size - nregex)]
+    lines = ['%s = User %s <%s@example.com>' % (u, u, u) for u in plain]
+    lines += ['re:^team%d-(.*)$ = \\1 <team%d@example.com>' % (i, i)
+              for i in xrange(nregex)]
+    _writebasemap(path, lines)
+    authors = case.once('load', lambda: maps.AuthorMap(
+        case.ui, path, 'example.com', False, None, True), case.size)
+    case.each('lookup', lambda a: authors[a], case.sample(plain))
+    teams = ['team%d-someone' % i for i in xrange(nregex)]
+    case.each('regex', lambda a: authors[a], case.sample(teams))
+    unknown = ['stranger%d' % i for i in xrange(case.opts.ops)]
+    case.each('default', lambda a: authors[a], unknown)
+
+def _bench_renamemap(case, cls):
+    path = case.path(cls.mapname())
+    names = ['name%d' % i for i in xrange(case.size)]
+    _writebasemap(path, ['%s = renamed%s' % (n, n) for n in names])
+    renames = case.once('load', lambda: cls(case.ui, path), case.size)
+    case.each('lookup', lambda n: renames.get(n), case.sample(names))
+
+def bench_branchmap(case):
+    _bench_renamemap(case, maps.BranchMap)
+
+def bench_tagmap(case):
+    _bench_renamemap(case, maps.TagMap)
+
+def bench_filemap(case):
+    path = case.path('filemap')
+    rules = []
+    for i in xrange(case.size):
+        cmd = i % 3 and 'include' or 'exclude'
+        rules.append('%s dir%d/sub%d' % (cmd, i % 997, i))
+    with open(path, 'w') as f:
+        f.write('%d\n' % maps.FileMap.VERSION)
+        for rule in rules:
+            f.write(rule + '\n')
+    filemap = case.once('load', lambda: maps.FileMap(case.ui, path),
+                        case.size)
+    paths = ['dir%d/sub%d/a/b/c/file%d' % (i % 997, i, i)
+             for i in xrange(case.size)]
+    case.each('check', lambda p: p in filemap, case.sample(paths))
+
+BENCHMARKS = [
+    ('revmap', bench_revmap),
+    ('sqliterevmap', bench_sqliterevmap),
+    ('tags', bench_tags),
+    ('authormap', bench_authormap),
+    ('branchmap', bench_branchmap),
+    ('tagmap', bench_tagmap),
+    ('filemap', bench_filemap),
+]
+
+REGEXMAPS = set(['authormap', 'branchmap', 'tagmap'])
+
+def runcase(opts, fn, size):
+    """Run one benchmark in a forked child and return its results."""
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        status = 1
+        tmpdir = tempfile.mkdtemp(prefix='hgsubversion-bench-')
+        try:
+            case = Case(opts, tmpdir, size)
+            baseline = _rsskb()
+            fn(case)
+            result = {'operations': case.results,
+                      'rss_kb': _rsskb() - baseline,
+                      'peak_kb': _rsskb('VmHWM') - baseline}
+            os.write(wfd, json.dumps(result))
+            status = 0
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            os._exit(status)
+    os.close(wfd)
+    chunks = []
+    while True:
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(rfd)
+    pid, status = os.waitpid(pid, 0)
+    if status:
+        return {'error': 'benchmark exited with status %d' % status}
+    return json.loads(''.join(chunks))
+
+def compare(baseline, current, threshold):
+    """Print per-operation ratios; return True if any regressed."""
+    regressed = False
+    for name, sizes in sorted(current['results'].iteritems()):
+        for size, result in sorted(sizes.iteritems(), key=lambda x: int(x[0])):
+            old = baseline.get('results', {}).get(name, {}).get(size, {})
+            for op, timing in sorted(result.get('operations', {}).iteritems()):
+                before = old.get('operations', {}).get(op, {})
+                if not before.get('usec_per_op'):
+                    continue
+                ratio = timing['usec_per_op'] / before['usec_per_op']
+                flag = ''
+                if ratio > 1 + threshold:
+                    flag = '  REGRESSION'
+                    regressed = True
+                sys.stderr.write('%-12s %8s %-16s x%.2f%s\n'
+                                 % (name, size, op, ratio, flag))
+    return regressed
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options] > results.json')
+    parser.add_option('--sizes', default='1000,10000,100000',
+                      help='comma separated map sizes '
+                      '[1000,10000,100000]')
+    parser.add_option('--only', default='',
+                      help='comma separated structures to benchmark [all]')
+    parser.add_option('--seed', type='int', default=1,
+                      help='random seed for sampling keys [1]')
+    parser.add_option('--ops', type='int', default=1000,
+                      help='number of keys sampled per lookup [1000]')
+    parser.add_option('--scans', type='int', default=20,
+                      help='number of branchedits/branchmaxrevnum calls '
+                      '[20]')
+    parser.add_option('--budget', type='float', default=5.0,
+                      help='seconds after which a lookup run stops [5]')
+    parser.add_option('--max-regex-size', type='int', default=10000,
+                      help='largest size used for regular expression '
+                      'maps [10000]')
+    parser.add_option('--compare', metavar='FILE',
+                      help='compare against an earlier JSON result')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='slowdown ratio reported as regression [0.1]')
+    opts, args = parser.parse_args()
+    if args:
+        parser.error('unexpected arguments')
+
+    sizes = [int(float(s)) for s in opts.sizes.split(',') if s]
+    only = set(s for s in opts.only.split(',') if s)
+
+    results = {}
+    for name, fn in BENCHMARKS:
+        if only and name not in only:
+            continue
+        for size in sizes:
+            if name in REGEXMAPS and size > opts.max_regex_size:
+                continue
+            sys.stderr.write('%s at %d entries\n' % (name, size))
+            results.setdefault(name, {})[str(size)] = runcase(opts, fn, size)
+
+    output = {
+        'version': 1,
+        'parameters': {'seed': opts.seed, 'ops': opts.ops,
+                       'scans': opts.scans, 'budget': opts.budget},
+        'results': results,
+    }
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+    if opts.compare:
+        with open(opts.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, output, opts.threshold):
+            return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
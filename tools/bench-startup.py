@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Measure the cost hgsubversion adds to hg commands that don't use it.
+
+Runs ``hg status`` in a scratch repository with and without the
+extension enabled, both with demandimport on and with it disabled, and
+prints the median wall-clock time of each configuration.
+
+usage: bench-startup.py [-n RUNS] [--hg HG]
+"""
+
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+EXTENSION = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'hgsubversion')
+
+def timecmd(args, env, runs):
+    times = []
+    devnull = open(os.devnull, 'w')
+    try:
+        for i in range(runs):
+            start = time.time()
+            subprocess.check_call(args, env=env, stdout=devnull,
+                                  stderr=devnull)
+            times.append(time.time() - start)
+    finally:
+        devnull.close()
+    times.sort()
+    return times[len(times) // 2]
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [-n RUNS] [--hg HG]')
+    parser.add_option('-n', '--runs', type='int', default=20,
+                      help='number of runs per configuration [20]')
+    parser.add_option('--hg', default='hg', help='hg executable to run')
+    options, args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='hgsubversion-bench-')
+    try:
+        env = dict(os.environ, HGRCPATH=os.devnull, LC_ALL='C')
+        subprocess.check_call([options.hg, 'init', tmpdir], env=env)
+        os.chdir(tmpdir)
+
+        base = [options.hg, 'status']
+        withext = [options.hg, '--config',
+                   'extensions.hgsubversion=' + EXTENSION, 'status']
+        configs = [
+            ('demandimport', env),
+            ('no demandimport', dict(env, HGDEMANDIMPORT='disable')),
+        ]
+        for label, cfgenv in configs:
+            plain = timecmd(base, cfgenv, options.runs)
+            ext = timecmd(withext, cfgenv, options.runs)
+            print '%-16s hg: %6.1f ms  hg+hgsubversion: %6.1f ms  (+%.1f ms)' % (
+                label, plain * 1000, ext * 1000, (ext - plain) * 1000)
+    finally:
+        os.chdir('/')
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    sys.exit(main())